@@ -1,8 +1,522 @@
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from copy import deepcopy
 import warnings
 import collections
+import os
+import heapq
+import bisect
+import json
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+def _rounding_bound(L, y0, terms):
+    """
+    Bound on the difference between the squared 2-norm error of a chord over
+    L+1 points computed from running sums, terms = (a^2 * sum_i i^2,
+    2*a * sum_i i*d_i, sum_i d_i^2), see StreamCompressor._push_norm2, and the
+    error computed from the whole segment starting at y0 by _compress_naive.
+    Errors within this bound of the tolerance are recomputed from the segment,
+    so every method accepts the same pieces as _compress_naive, including exact
+    ties such as integer valued time series at integer tolerances. Must match
+    rounding_bound in src/compress.cpp.
+    """
+    (t0, t1, t2) = terms
+    scale = abs(t0) + abs(t1) + t2 + abs(y0)*math.sqrt((L+1)*(abs(t0) + t2))
+    return 8*(L+1)*np.finfo(float).eps*scale
+
+class _PieceBuffer(object):
+    """
+    Growable two dimensional array used to collect pieces row by row. Rows are
+    written into a preallocated buffer whose capacity doubles when full, so
+    appending P rows costs O(P) copying in total. The filled rows are returned
+    by array().
+    """
+
+    def __init__(self, ncols=3, capacity=64):
+        self._data = np.empty([max(capacity, 1), ncols])
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, row):
+        if self._size == self._data.shape[0]:
+            data = np.empty([2*self._data.shape[0], self._data.shape[1]])
+            data[:self._size] = self._data
+            self._data = data
+        self._data[self._size] = row
+        self._size += 1
+
+    def array(self):
+        # copy so the spare capacity is released
+        return self._data[:self._size].copy()
+
+class _IncrementalCluster(object):
+    """
+    Center and error of a growing cluster of increments for
+    ABBA.digitize_incremental. Without weights they are running statistics
+    updated as members are added. With weights every accumulated increment
+    changes when a member is added, and they are recomputed from the members,
+    which are kept in order of their position in the time series instead of
+    being sorted at each step.
+    add() returns the center and error of the cluster including the new member.
+    A rejected member is never removed, the cluster is restarted by reset().
+    exact() computes the center and error from scratch, in the order of
+    operations of the original digitize_incremental.
+        weighted = False, norm = 2 - running mean and sum of squared deviations
+            (Welford), O(1) per member. These round differently from exact(),
+            so an error within rounding of the bound is recomputed by exact(),
+            as is the center of a finished cluster, which keeps the output of
+            digitize_incremental unchanged.
+        weighted = False, norm = 1 - median from two heaps and the largest
+            deviation from it, O(log ell) per member. The error is the 1-norm
+            of the deviations as a 1 x ell matrix, that is their largest
+            absolute value.
+        weighted = True, norm = 2 - center from the accumulated increments of
+            the members kept in order of position, O(ell) per member.
+        weighted = True, norm = 1 - weighted median of all accumulated
+            increments, O(ell log ell) per member.
+    """
+
+    def __init__(self, increments, norm, weighted):
+        self.increments = increments
+        self.norm = norm
+        self.weighted = weighted
+        self._members = []
+
+    def reset(self, position):
+        """
+        Restart the cluster with the single member at position.
+        """
+        v = self.increments[position]
+        self._members = [position]
+        self._ell = 1
+        if self.weighted:
+            pass
+        elif self.norm == 2:
+            (self._mean, self._M2, self._sumsq) = (v, 0.0, v*v)
+        else:
+            (self._lower, self._upper) = ([-v], [])
+            (self._min, self._max) = (v, v)
+
+    def add(self, position, bound):
+        """
+        Add the member at position and return the center and error, which is
+        compared with bound by the caller.
+        """
+        v = self.increments[position]
+        self._ell += 1
+        ell = self._ell
+        if self.weighted:
+            bisect.insort(self._members, position)
+            return self.exact(self._members)
+        elif self.norm == 2:
+            self._members.append(position)
+            delta = v - self._mean
+            self._mean += delta/ell
+            self._M2 += delta*(v - self._mean)
+            self._sumsq += v*v
+            if abs(self._M2 - bound) <= 4*ell*np.finfo(float).eps*self._sumsq:
+                return self.exact(self._members)
+            return self._mean, max(self._M2, 0.0)
+        else:
+            self._members.append(position)
+            return self._add_norm1(v, ell)
+
+    def exact(self, positions):
+        """
+        Center and error of the cluster with members at positions, computed
+        from their increments in order of position.
+        """
+        vals = self.increments[np.sort(positions)]
+        ell = len(vals)
+        if self.weighted and self.norm == 2:
+            # minimize accumulated increment errors in 2-norm
+            wgths = (ell+1)*ell/2 - np.cumsum(np.arange(0, ell))
+            mval = np.sum(vals*wgths)/((ell)*(ell+1)*(2*ell+1)/6)
+            err = np.cumsum(vals) - np.arange(1, ell+1)*mval
+            return mval, np.linalg.norm(err)**2
+        if self.weighted:
+            return self._weighted_norm1(vals)
+        if self.norm == 2:
+            mval = np.sum(vals)/ell
+        else:
+            mval = np.median(vals)
+        err = vals - np.ones((1, ell))*mval
+        return mval, np.linalg.norm(err)**2 if self.norm == 2 else np.linalg.norm(err, 1)
+
+    def _add_norm1(self, v, ell):
+        (lower, upper) = (self._lower, self._upper)
+        if v <= -lower[0]:
+            heapq.heappush(lower, -v)
+        else:
+            heapq.heappush(upper, v)
+        # keep len(lower) == len(upper) or len(upper)+1
+        if len(lower) > len(upper) + 1:
+            heapq.heappush(upper, -heapq.heappop(lower))
+        elif len(upper) > len(lower):
+            heapq.heappush(lower, -heapq.heappop(upper))
+        if ell % 2 == 1:
+            median = -lower[0]
+        else:
+            median = (-lower[0] + upper[0])/2
+        (self._min, self._max) = (min(self._min, v), max(self._max, v))
+        return median, max(median - self._min, self._max - median)
+
+    def _weighted_norm1(self, vals):
+        # minimize accumulated increment errors in 1-norm
+        ell = len(vals)
+        wgts = np.arange(1, ell+1)
+        wvals = np.cumsum(vals)/wgts
+        midpoint = 0.5*np.sum(wgts)
+        if ell > midpoint:
+            mval = wvals[-1]
+        else:
+            # weighted median, ties in value ordered by weight
+            order = np.lexsort((wgts, wvals))
+            (s_data, cs_weights) = (wvals[order], np.cumsum(wgts[order]))
+            idx = np.searchsorted(cs_weights, midpoint, side='right') - 1
+            if cs_weights[idx] == midpoint:
+                mval = np.mean(s_data[idx:idx+2])
+            else:
+                mval = s_data[idx+1]
+        err = np.cumsum(vals) - wgts*mval
+        return mval, np.linalg.norm(err, 1)
+
+def _weighted_std(values, weights=None):
+    """
+    Standard deviation of values, each repeated weights times if given.
+    """
+    if weights is None:
+        return np.std(values)
+    mean = np.average(values, weights=weights)
+    return np.sqrt(np.average((values - mean)**2, weights=weights))
+
+def _batch_worker(args):
+    """
+    Apply an ABBA method to one time series of a batch, see ABBA.compress_batch.
+    Returns the output and None, or None and the raised exception.
+    """
+    abba, method, time_series, seed = args
+    if seed is not None:
+        np.random.seed(seed)
+    try:
+        return getattr(abba, method)(time_series), None
+    except Exception as e:
+        return None, e
+
+class StreamCompressor(object):
+    """
+    Incremental version of ABBA.compress for time series which arrive in chunks.
+    Samples are passed to push(), which returns every piece that can no longer
+    change, and the trailing piece is returned by flush(). Only the open segment
+    is kept in memory. Pushing a time series in any number of chunks followed by
+    flush() gives the same pieces as compress.
+    Parameters
+    ----------
+    tol - float
+        Compression tolerance, see ABBA.
+    max_len - int
+        Maximum length of any segment, see ABBA.
+    norm - 1 or 2
+        Which norm to use for the compression phase.
+    Example
+    -------
+    >>> from ABBA import ABBA
+    >>> stream = ABBA(tol=0.5).compress_stream()
+    >>> for chunk in chunks:
+    ...     pieces = stream.push(chunk)
+    >>> last_piece = stream.flush()
+    """
+
+    def __init__(self, tol=0.1, max_len=np.inf, norm=2):
+        if norm not in [1, 2]:
+            raise NotImplementedError('norm = 1 or norm = 2')
+        self.tol = tol
+        self.max_len = max_len
+        self.norm = norm
+        self._reset()
+
+    def _reset(self):
+        self._started = False
+        self._y0 = 0.0 # first value of open segment
+        self._prev = 0.0 # last value of open segment
+        self._len = 0 # length of open segment
+        self._values = [] # values of open segment
+        (self._sum_wd, self._sum_d2) = (0.0, 0.0)
+        (self._lastinc, self._lasterr) = (0, 0)
+
+    def push(self, chunk):
+        """
+        Add samples to the time series.
+        Parameters
+        ----------
+        chunk - numpy array
+            Next samples of the time series.
+        Returns
+        -------
+        pieces - numpy array
+            Pieces finalised by these samples, possibly none. Each row contains
+            length, increment and error for the segment. See ABBA.compress.
+        """
+        values = np.asarray(chunk, dtype=float).reshape(-1).tolist()
+        pieces = _PieceBuffer(3)
+        if not values:
+            return pieces.array()
+        if not self._started:
+            self._started = True
+            self._y0 = self._prev = values[0]
+            self._values = [values[0]]
+            values = values[1:]
+        if self.norm == 2:
+            self._push_norm2(values, pieces)
+        else:
+            self._push_norm1(values, pieces)
+        return pieces.array()
+
+    def _push_norm2(self, values, pieces):
+        """
+        With d_i = time_series[start+i] - time_series[start] and a = inc/L the
+        squared error of the chord over a segment of length L is
+
+            sum_i (a*i - d_i)^2 = a^2 * sum_i i^2 - 2*a * sum_i i*d_i + sum_i d_i^2,
+
+        so only running sums of d_i^2 and i*d_i are needed to test the open
+        segment. Sums are taken relative to the first value of the segment and
+        restarted for every new segment, which keeps them well conditioned on
+        long series. An error within rounding of the tolerance is recomputed
+        from the values of the segment, see _rounding_bound.
+        """
+        tol = self.tol**2
+        epsilon = np.finfo(float).eps
+        (rounding, sqrt) = (8*epsilon, math.sqrt)
+        (y0, m) = (self._y0, self._len)
+        (sum_wd, sum_d2) = (self._sum_wd, self._sum_d2)
+        (lastinc, lasterr) = (self._lastinc, self._lasterr)
+        (prev, segment) = (self._prev, self._values)
+        for y in values:
+            while True:
+                L = m + 1
+                inc = y - y0
+                new_wd = sum_wd + L*inc
+                new_d2 = sum_d2 + inc*inc
+                a = inc/L
+                t0 = a*a*(L*(L+1)*(2*L+1)/6)
+                t1 = 2*a*new_wd
+                err = t0 - t1 + new_d2
+                err = err if err > 0 else 0.0
+                bound = tol*m + epsilon
+                # _rounding_bound(L, y0, (t0, t1, new_d2)) inlined
+                if m > 0 and abs(err - bound) <= rounding*(L+1)*(abs(t0) + abs(t1) + new_d2 + abs(y0)*sqrt((L+1)*(abs(t0) + new_d2))):
+                    values_ = np.array(segment + [y])
+                    err = np.linalg.norm((values_[0] + (inc/L)*np.arange(0, L+1)) - values_)**2
+                if (err <= bound) and (m < self.max_len):
+                    (lastinc, lasterr) = (inc, err)
+                    (sum_wd, sum_d2) = (new_wd, new_d2)
+                    segment.append(y)
+                    m = L
+                    break
+                pieces.append([m, lastinc, lasterr])
+                (y0, m) = (prev, 0)
+                (sum_wd, sum_d2) = (0.0, 0.0)
+                segment = [prev]
+            prev = y
+        (self._y0, self._len, self._prev, self._values) = (y0, m, prev, segment)
+        (self._sum_wd, self._sum_d2) = (sum_wd, sum_d2)
+        (self._lastinc, self._lasterr) = (lastinc, lasterr)
+
+    def _push_norm1(self, values, pieces):
+        epsilon = np.finfo(float).eps
+        for y in values:
+            while True:
+                L = self._len + 1
+                segment = np.array(self._values + [y])
+                inc = y - segment[0]
+                err = np.linalg.norm((segment[0] + (inc/L)*np.arange(L+1)) - segment, 1)
+                if ((err <= self.tol*self._len + epsilon) and (self._len < self.max_len)) or L == 1:
+                    (self._lastinc, self._lasterr) = (inc, err)
+                    self._values.append(y)
+                    self._len = L
+                    break
+                pieces.append([self._len, self._lastinc, self._lasterr])
+                self._values = [self._values[-1]]
+                self._len = 0
+        self._prev = self._values[-1]
+
+    def flush(self):
+        """
+        Finalise the open segment and reset the compressor.
+        Returns
+        -------
+        pieces - numpy array
+            The trailing piece as an array with one row, or no rows if no samples
+            were pushed since the last flush.
+        """
+        pieces = _PieceBuffer(3, capacity=1)
+        if self._started:
+            pieces.append([self._len, self._lastinc, self._lasterr])
+        self._reset()
+        return pieces.array()
+
+class ABBAPyramid(object):
+    """
+    Symbolic representations of one time series at several tolerances, built by
+    ABBA.pyramid. Level 0 is the coarsest. Each level holds the pieces, string
+    and centers of the representation, the largest absolute error of the symbolic
+    reconstruction over each piece, and for every piece the range of pieces of
+    the next finer level it covers. Breakpoints of a level are breakpoints of
+    every finer level, see ABBA.compress_hierarchy.
+    Parameters
+    ----------
+    tols - list
+        Compression tolerance of each level, coarsest first.
+    start - float
+        First element of the time series.
+    levels - list
+        One dictionary per level with keys 'pieces', 'string', 'centers' and
+        'error'.
+    Example
+    -------
+    >>> from ABBA import ABBA
+    >>> pyramid = ABBA(tol=0.1, verbose=0).pyramid(ts, [0.1, 0.2, 0.4])
+    >>> starts = pyramid.search(ts[100:150], 0.5)
+    >>> reconstructed_ts = pyramid.reconstruct(error_bound=1.0)
+    """
+
+    def __init__(self, tols, start, levels):
+        self.tols = list(tols)
+        self.start = start
+        self.levels = levels
+        self.length = int(np.sum(levels[0]['pieces'][:, 0])) + 1
+        self._reconstructions = {}
+
+        # coarse piece p covers fine pieces children[p] to children[p+1]-1
+        for coarse, fine in zip(levels[:-1], levels[1:]):
+            ends = np.cumsum(fine['pieces'][:, 0])
+            coarse['children'] = np.concatenate([[0], np.searchsorted(ends, np.cumsum(coarse['pieces'][:, 0])) + 1])
+        levels[-1]['children'] = np.zeros(0, dtype=int)
+
+    def children(self, level, piece):
+        """
+        Indices of the pieces of level+1 covered by a piece of level.
+        """
+        children = self.levels[level]['children']
+        return np.arange(children[piece], children[piece+1])
+
+    def level_for(self, error_bound):
+        """
+        Coarsest level whose symbolic reconstruction is within error_bound of
+        the time series at every time point.
+        """
+        for level in range(len(self.levels)):
+            if np.max(self.levels[level]['error']) <= error_bound:
+                return level
+        raise ValueError('No level satisfies the error bound.')
+
+    def _point_error(self, level):
+        # largest reconstruction error of the piece containing each time point
+        pieces = self.levels[level]['pieces']
+        error = self.levels[level]['error']
+        return np.concatenate([error[:1], np.repeat(error, pieces[:, 0].astype(int))])
+
+    def reconstruct(self, error_bound=None, level=None):
+        """
+        Reconstruct the time series from the coarsest level within error_bound,
+        or from the given level (finest level if neither is given).
+        Returns
+        -------
+        times_series - numpy array
+            Reconstruction of the time series.
+        """
+        if level is None:
+            level = len(self.levels)-1 if error_bound is None else self.level_for(error_bound)
+        if level not in self._reconstructions:
+            abba = ABBA(verbose=0)
+            ts = np.asarray(abba.inverse_transform(self.levels[level]['string'], self.levels[level]['centers'], self.start))
+            # quantized lengths can miss the length of the time series by rounding
+            if len(ts) < self.length:
+                ts = np.concatenate([ts, np.full(self.length - len(ts), ts[-1])])
+            self._reconstructions[level] = ts[:self.length]
+        return self._reconstructions[level]
+
+    def search(self, query, radius, error_bound=None):
+        """
+        Find the windows of the reconstruction whose largest absolute difference
+        to query is at most radius, at the coarsest level within error_bound
+        (finest level if not given). Windows are screened from the coarsest
+        level down, and a level only evaluates the windows that passed the level
+        above. By the triangle inequality a window is discarded only if it
+        cannot match at the target level.
+        Parameters
+        ----------
+        query - numpy array
+            Pattern searched for.
+        radius - float
+            Largest absolute difference between query and a matching window.
+        error_bound - float
+            Error bound used to select the target level, see level_for.
+        Returns
+        -------
+        starts - numpy array
+            Start indices of the matching windows.
+        """
+        query = np.asarray(query, dtype=float)
+        m = len(query)
+        target = len(self.levels)-1 if error_bound is None else self.level_for(error_bound)
+        starts = np.arange(max(self.length - m + 1, 0))
+        window = np.arange(m)
+        sample = np.unique(np.linspace(0, m-1, min(m, 8)).astype(int))
+        target_error = self._window_max(self._point_error(target), m)
+        for level in range(target+1):
+            ts = self.reconstruct(level=level)
+            if level < target:
+                bound = radius + self._window_max(self._point_error(level), m)[starts] + target_error[starts]
+            else:
+                bound = np.full(len(starts), float(radius))
+            # a few samples of the window bound the distance from below, the
+            # full distance is only computed at the target level
+            keep = np.max(np.abs(ts[starts[:, None] + sample] - query[sample]), axis=1) <= bound
+            starts = starts[keep]
+        keep = np.max(np.abs(ts[starts[:, None] + window] - query), axis=1) <= radius
+        return starts[keep]
+
+    @staticmethod
+    def _window_max(values, m):
+        # maximum of every window of length m in O(len(values)), van Herk/Gil-Werman
+        n = len(values)
+        if m > n:
+            return np.zeros(0)
+        blocks = np.concatenate([values, np.full(-n % m, -np.inf)]).reshape(-1, m)
+        prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+        suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+        return np.maximum(suffix[:n-m+1], prefix[m-1:n])
+
+    def save(self, file):
+        """
+        Save the pyramid to a .npz file, see load.
+        """
+        arrays = {'tols': np.array(self.tols), 'start': np.array(self.start)}
+        for level, data in enumerate(self.levels):
+            arrays['pieces_%d' % level] = data['pieces']
+            arrays['string_%d' % level] = np.array(data['string'])
+            arrays['centers_%d' % level] = data['centers']
+            arrays['error_%d' % level] = data['error']
+        np.savez(file, **arrays)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load a pyramid saved by save.
+        """
+        with np.load(file) as arrays:
+            tols = arrays['tols'].tolist()
+            levels = [{'pieces': arrays['pieces_%d' % level],
+                       'string': str(arrays['string_%d' % level]),
+                       'centers': arrays['centers_%d' % level],
+                       'error': arrays['error_%d' % level]} for level in range(len(tols))]
+            return cls(tols, float(arrays['start']), levels)
 
 class ABBA(object):
     """
@@ -48,7 +562,69 @@ class ABBA(object):
         to cumulative error.
     Symmetric - True/False
         When using c_method = 'incremental, cluster from both ends to ensure symmetry.
-
+    compress_method - 'auto', 'naive', 'linear', 'gallop' or 'native'
+        Algorithm used to evaluate the error of a candidate segment during compression.
+        'naive' - Recompute the norm over the whole segment at every step.
+        'linear' - Update running sums of the segment so the 2-norm error of
+            each candidate is checked in O(1), requires norm = 2.
+        'gallop' - Find the end of each segment by exponential then binary
+            search, so only O(log L) 1-norm errors are computed for a segment
+            of length L, requires norm = 1. Short segments are found by a linear
+            scan as in 'naive'.
+        'native' - Compiled implementation of 'linear' (norm = 2) or 'naive'
+            (norm = 1) from src/compress, see makefile.
+        'auto' - Use 'native' if available, otherwise 'linear' if norm = 2 and
+            'naive' if norm = 1.
+    exact - True/False
+        When using compress_method = 'gallop', verify that no earlier end point
+        of a segment fails the tolerance, so that the pieces are identical to
+        compress_method = 'naive'. If False, only end points which provably fail
+        the tolerance are detected, and the search then falls back to the
+        verified linear scan for that segment.
+    buffer_size - int
+        Number of time points read at once by compress_method = 'linear', and
+        number of pieces written at once by compress_method = 'native'. Time
+        series given as memory maps are walked in buffers of this size, so they
+        are never loaded into memory as a whole.
+    k_search - 'linear', 'warm' or 'bracket'
+        Search for the number of clusters k when clustering with sklearn KMeans.
+        'linear' - Fit k = min_k, min_k+1, ... until the cluster variance is
+            within the bound.
+        'warm' - As 'linear', but each k is initialised from the solution for
+            k-1 by splitting its cluster of largest variance, with one fit per k.
+        'bracket' - Exponential search on k followed by bisection, assuming the
+            cluster variance decreases with k.
+    n_init - int
+        Number of initialisations of each KMeans fit. If None then the sklearn
+        default is used.
+    k_jobs - int
+        Number of values of k fitted at once when k_search = 'linear'. The
+        smallest k within the bound is used, as in serial mode, and fits of
+        larger k still pending are cancelled. If None then os.cpu_count() is used.
+    k_backend - 'thread' or 'process'
+        Pool used to fit the values of k when k_jobs != 1.
+    dedup - True/False
+        When using c_method = 'kmeans' with scl other than 0 and np.inf,
+        cluster the distinct pieces once each with sklearn KMeans, weighted by
+        the number of times they occur, and give every copy of a piece the
+        label of its distinct piece. Cluster variances are weighted, so the
+        bound is tested as if every copy was clustered. The distinct pieces keep
+        their order of first occurrence, so without duplicates the symbols are
+        unchanged, but with duplicates the weighted KMeans seeding differs and
+        only the bound is preserved. With scl = 0 or np.inf the one dimensional
+        clustering, which is linear in the number of pieces, clusters every
+        piece, since weighted sums resolve ties between equally good clusters
+        differently, so dedup does not change the symbols.
+    ck_method - 'linear', 'loglinear', 'quadratic' or 'auto'
+        Method filling the dynamic programming matrix of the compiled Ckmeans
+        when using c_method = 'kmeans' with scl = 0 or np.inf. 'linear'
+        uses SMAWK, 'loglinear' divide and conquer and 'quadratic' tries every
+        split. 'auto' uses 'quadratic' for few pieces and 'loglinear'
+        otherwise, the fastest in practice. The methods resolve ties between
+        equally good splits differently, so on repeated values, such as
+        quantised increments or lengths, they may give different clusters and
+        even a different number of clusters. The NumPy fallback ignores
+        ck_method and resolves ties as 'quadratic'.
 
     Raises
     ------
@@ -72,7 +648,7 @@ class ABBA(object):
     Institute for Mathematical Sciences, The University of Manchester, UK, 2019.
     """
 
-    def __init__(self, *, tol=0.1, scl=0, min_k=2, max_k=100, max_len = np.inf, verbose=1, seed=True, norm=2, c_method='kmeans', weighted=False, symmetric=True):
+    def __init__(self, *, tol=0.1, scl=0, min_k=2, max_k=100, max_len = np.inf, verbose=1, seed=True, norm=2, c_method='kmeans', weighted=False, symmetric=True, compress_method='auto', exact=True, buffer_size=65536, k_search='linear', n_init=None, k_jobs=1, k_backend='thread', dedup=False, ck_method='linear'):
         self.tol = tol
         self.scl = scl
         self.min_k = min_k
@@ -84,12 +660,27 @@ class ABBA(object):
         self.c_method = c_method
         self.weighted = weighted
         self.symmetric = symmetric
+        self.compress_method = compress_method
+        self.exact = exact
+        self.buffer_size = buffer_size
+        self.k_search = k_search
+        self.n_init = n_init
+        self.k_jobs = k_jobs
+        self.k_backend = k_backend
+        self.dedup = dedup
+        self.ck_method = ck_method
+
+        # codebook learned by fit
+        self.centers_ = None
+        self.len_std_ = None
+        self.inc_std_ = None
 
         self._check_parameters()
 
     def _check_time_series(self, time_series):
-        # Convert time series to numpy array
-        time_series_ = np.array(time_series)
+        # Convert time series to numpy array, memory maps and other buffers are
+        # used without copying
+        time_series_ = np.asarray(time_series)
 
         # Check normalisation if Normalise=False and Verbose
         if self.verbose == 2: # pragma: no cover
@@ -144,9 +735,51 @@ class ABBA(object):
         if type(self.symmetric) is not bool:
             raise ValueError('Invalid symmetric.')
 
+        # Check compress_method
+        if self.compress_method not in ['auto', 'naive', 'linear', 'gallop', 'native']:
+            raise ValueError('Invalid compress_method.')
+        if self.compress_method == 'linear' and self.norm != 2:
+            raise ValueError('compress_method = linear requires norm = 2.')
+        if self.compress_method == 'gallop' and self.norm != 1:
+            raise ValueError('compress_method = gallop requires norm = 1.')
+
+        # Check exact
+        if type(self.exact) is not bool:
+            raise ValueError('Invalid exact.')
+
+        # Check buffer_size
+        if not isinstance(self.buffer_size, int) or self.buffer_size < 1:
+            raise ValueError('Invalid buffer_size.')
+
+        # Check k_search
+        if self.k_search not in ['linear', 'warm', 'bracket']:
+            raise ValueError('Invalid k_search.')
+
+        # Check n_init
+        if self.n_init is not None and not (isinstance(self.n_init, int) and self.n_init >= 1):
+            raise ValueError('Invalid n_init.')
+
+        # Check k_jobs and k_backend
+        if self.k_jobs is not None and not (isinstance(self.k_jobs, int) and self.k_jobs >= 1):
+            raise ValueError('Invalid k_jobs.')
+        if self.k_jobs != 1 and self.k_search != 'linear':
+            raise ValueError('k_jobs != 1 requires k_search = linear.')
+        if self.k_backend not in ['thread', 'process']:
+            raise ValueError('Invalid k_backend.')
+
+        # Check dedup
+        if type(self.dedup) is not bool:
+            raise ValueError('Invalid dedup.')
+
+        # Check ck_method
+        if self.ck_method not in ['auto', 'linear', 'loglinear', 'quadratic']:
+            raise ValueError('Invalid ck_method.')
+
     def transform(self, time_series):
         """
-        Convert time series representation to ABBA symbolic representation
+        Convert time series representation to ABBA symbolic representation. If
+        the ABBA object has been fitted, the pieces are assigned to its codebook,
+        see fit and digitize_fitted.
         Parameters
         ----------
         time_series - numpy array
@@ -164,10 +797,162 @@ class ABBA(object):
         # Perform compression
         pieces = self.compress(time_series_)
 
-        # Perform digitization
+        # Perform digitization, to the fitted codebook if any
+        if self.centers_ is not None:
+            return self.digitize_fitted(pieces)
         string, centers = self.digitize(pieces)
         return string, centers
 
+    def fit(self, corpus):
+        """
+        Learn a codebook of cluster centers from the pieces of a collection of
+        time series. Afterwards transform assigns the pieces of every time series
+        to the nearest center, so all strings share one alphabet.
+        Parameters
+        ----------
+        corpus - list
+            List of normalised time series as numpy arrays.
+        Returns
+        -------
+        self - ABBA
+            The fitted ABBA object, with the cluster centers in centers_ and the
+            standard deviations of the lengths and increments of the pooled
+            pieces in len_std_ and inc_std_.
+        """
+        pieces = np.vstack([self.compress(self._check_time_series(ts)) for ts in corpus])
+        string, centers = self.digitize(pieces)
+        self.centers_ = centers
+        (self.len_std_, self.inc_std_) = [std if std > np.finfo(float).eps else 1 for std in np.std(pieces[:,:2], axis=0)]
+        return self
+
+    def digitize_fitted(self, pieces):
+        """
+        Convert compressed representation to symbolic representation using the
+        codebook learned by fit, assigning each piece to the nearest center.
+        When clustering in one dimension (scl = 0, scl = inf or c_method =
+        'incremental') the nearest center is found by binary search among the
+        midpoints of the sorted centers, otherwise lengths and increments are
+        scaled as in digitize.
+        Parameters
+        ----------
+        pieces - numpy array
+            Time series in compressed format. See compression.
+        Returns
+        -------
+        string - string
+            Time series in symbolic representation using unicode characters starting
+            with character 'a'.
+        centers - numpy array
+            Centers of the codebook, see fit.
+        """
+        if self.centers_ is None:
+            raise ValueError('ABBA has not been fitted, see fit.')
+        if self.c_method == 'incremental' or self.scl in [0, np.inf]:
+            col = 0 if self.c_method == 'kmeans' and self.scl == np.inf else 1
+            order = np.argsort(self.centers_[:,col])
+            c = self.centers_[order, col]
+            labels = order[np.searchsorted((c[1:] + c[:-1])/2, pieces[:,col])]
+        else:
+            scale = np.array([self.scl/self.len_std_, 1/self.inc_std_])
+            data = pieces[:,:2]*scale
+            centers = self.centers_*scale
+            distance = np.sum(data**2, axis=1)[:,None] - 2*data@centers.T + np.sum(centers**2, axis=1)
+            labels = np.argmin(distance, axis=1)
+        string = ''.join([chr(97 + j) for j in labels])
+        return string, self.centers_
+
+    def save(self, file):
+        """
+        Save the parameters and the codebook of a fitted ABBA object to a .npz
+        file, see load.
+        """
+        if self.centers_ is None:
+            raise ValueError('ABBA has not been fitted, see fit.')
+        parameters = {name: getattr(self, name) for name in ['tol', 'scl', 'min_k', 'max_k',
+            'max_len', 'verbose', 'seed', 'norm', 'c_method', 'weighted', 'symmetric',
+            'compress_method', 'exact', 'buffer_size', 'k_search', 'n_init', 'k_jobs', 'k_backend', 'dedup', 'ck_method']}
+        np.savez(file, parameters=np.array(json.dumps(parameters)), centers=self.centers_,
+                 std=np.array([self.len_std_, self.inc_std_]))
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load a fitted ABBA object saved by save.
+        """
+        with np.load(file) as arrays:
+            abba = cls(**json.loads(str(arrays['parameters'])))
+            abba.centers_ = arrays['centers']
+            (abba.len_std_, abba.inc_std_) = arrays['std'].tolist()
+        return abba
+
+    def _map_batch(self, method, time_series_list, n_jobs, chunksize, random_state):
+        """
+        Apply method to every time series, in a process pool if n_jobs != 1.
+        """
+        items = [(self, method, ts, None if random_state is None else random_state + i)
+                 for i, ts in enumerate(time_series_list)]
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        n_jobs = min(n_jobs, max(len(items), 1))
+        if n_jobs == 1:
+            results = [_batch_worker(item) for item in items]
+        else:
+            # workers are not forked, see _select_k_parallel
+            with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results = list(executor.map(_batch_worker, items, chunksize=chunksize))
+        outputs = [r[0] for r in results]
+        errors = [r[1] for r in results]
+        return outputs, errors
+
+    def compress_batch(self, time_series_list, n_jobs=None, chunksize=1, random_state=None):
+        """
+        Compress a collection of time series, possibly of different lengths, in
+        parallel. See compress.
+        Parameters
+        ----------
+        time_series_list - list
+            List of time series, each a list or numpy array.
+        n_jobs - int
+            Number of worker processes. If None or less than 1 then one process
+            per CPU is used, if 1 then the time series are compressed serially.
+            Workers are spawned rather than forked, so a script calling this
+            with n_jobs != 1 needs an if __name__ == '__main__' guard.
+        chunksize - int
+            Number of time series submitted to a worker process at once.
+        random_state - int
+            If not None, the numpy random number generator is seeded with
+            random_state + i before processing the i-th time series, so results
+            do not depend on how the work is distributed.
+        Returns
+        -------
+        pieces - list
+            Compressed representation of each time series, in input order. None
+            for time series which raised an exception.
+        errors - list
+            The exception raised for each time series, or None.
+        """
+        return self._map_batch('compress', time_series_list, n_jobs, chunksize, random_state)
+
+    def transform_batch(self, time_series_list, n_jobs=None, chunksize=1, random_state=None):
+        """
+        Convert a collection of time series, possibly of different lengths, to
+        ABBA symbolic representations in parallel. Each time series is clustered
+        separately. See transform and compress_batch.
+        Returns
+        -------
+        strings - list
+            Symbolic representation of each time series, in input order. None for
+            time series which raised an exception.
+        centers - list
+            Cluster centres for each time series, or None.
+        errors - list
+            The exception raised for each time series, or None.
+        """
+        outputs, errors = self._map_batch('transform', time_series_list, n_jobs, chunksize, random_state)
+        strings = [None if out is None else out[0] for out in outputs]
+        centers = [None if out is None else out[1] for out in outputs]
+        return strings, centers, errors
+
     def inverse_transform(self, string, centers, start=0):
         """
         Convert ABBA symbolic representation back to numeric time series representation.
@@ -206,40 +991,662 @@ class ABBA(object):
             Numpy array with three columns, each row contains length, increment
             error for the segment.
         """
+        method = self.compress_method
+        if method in ['auto', 'native']:
+            # Try compiled compression
+            try:
+                from src.compress import compress_pieces
+                method = 'native'
+            except ImportError:
+                if method == 'native' and self.verbose in [1, 2]: # pragma: no cover
+                    warnings.warn('Compression module unavailable, try running makefile. Using Python implementation instead.',  stacklevel=2)
+                method = 'linear' if self.norm == 2 else 'naive'
+
+        if method == 'native':
+            pieces = self._compress_native(time_series)
+        elif method == 'linear':
+            pieces = self._compress_linear(time_series)
+        elif method == 'gallop':
+            pieces = self._compress_gallop(time_series)
+        else:
+            pieces = self._compress_naive(time_series)
+
+        if self.verbose in [1, 2]: # pragma: no cover
+            print('Compression: Reduced time series of length', len(time_series), 'to', len(pieces), 'segments')
+        return pieces
+
+    def _compress_naive(self, time_series):
+        """
+        Greedy compression which recomputes the norm of the whole segment each
+        time the end point is extended. See compress.
+        """
         start = 0 # start point
         end = 1 # end point
-        pieces = np.empty([0, 3]) # [increment, length, error]
+        pieces = _PieceBuffer(3) # [increment, length, error]
         if self.norm == 2:
             tol = self.compression_tol**2
         else:
             tol = self.compression_tol
-        x = np.arange(0, len(time_series))
         epsilon =  np.finfo(float).eps
 
         (lastinc, lasterr) = (0, 0)
         while end < len(time_series):
             # error function for linear piece
             inc = time_series[end] - time_series[start]
+            x = np.arange(0, end-start+1)
 
             if self.norm == 2:
-                err = np.linalg.norm((time_series[start] + (inc/(end-start))*x[0:end-start+1]) - time_series[start:end+1])**2
+                err = np.linalg.norm((time_series[start] + (inc/(end-start))*x) - time_series[start:end+1])**2
             else:
-                err = np.linalg.norm((time_series[start] + (inc/(end-start))*x[0:end-start+1]) - time_series[start:end+1],1)
+                err = np.linalg.norm((time_series[start] + (inc/(end-start))*x) - time_series[start:end+1],1)
 
-            if (err <= tol*(end-start-1) + epsilon) and (end-start-1 < self.max_len):
-            # epsilon added to prevent error when err ~ 0 and (end-start-1) = 0
+            if ((err <= tol*(end-start-1) + epsilon) and (end-start-1 < self.max_len)) or end-start == 1:
+            # epsilon added to prevent error when err ~ 0 and (end-start-1) = 0,
+            # a piece of length one is always accepted as rounding in the 1-norm
+            # can exceed epsilon, which would otherwise restart it forever
                 (lastinc, lasterr) = (inc, err)
                 end += 1
                 continue
             else:
-                pieces = np.vstack([pieces, np.array([end-start-1, lastinc, lasterr])])
+                pieces.append([end-start-1, lastinc, lasterr])
                 start = end - 1
 
-        pieces = np.vstack([pieces, np.array([end-start-1, lastinc, lasterr])])
+        pieces.append([end-start-1, lastinc, lasterr])
+        return pieces.array()
+
+    def _compress_linear(self, time_series):
+        """
+        Greedy compression in the 2-norm with O(1) work per time point, see
+        StreamCompressor. The time series is read buffer_size time points at a
+        time, so memory maps and other buffers are never copied as a whole and
+        only the open segment is carried from one buffer to the next.
+        """
+        stream = self.compress_stream()
+        pieces = [stream.push(time_series[i:i+self.buffer_size]) for i in range(0, len(time_series), self.buffer_size)]
+        pieces.append(stream.flush())
+        pieces = np.vstack(pieces)
+        if len(pieces) == 0:
+            pieces = np.zeros([1, 3])
+        return pieces
+
+    def _compress_native(self, time_series):
+        """
+        Greedy compression by the compiled kernel in src/compress, which reads
+        the time series from a contiguous float64 buffer. See compress.
+        """
+        from src.compress import compress_pieces
+        ts = np.ascontiguousarray(time_series, dtype=float)
+        if len(ts) < 2:
+            return np.zeros([1, 3])
+        tol = self.compression_tol**2 if self.norm == 2 else self.compression_tol
+        max_len = float(self.max_len)
+
+        # pieces are written into blocks, resuming after the last piece of a full block
+        pieces = []
+        (start, open_length) = (0, 0)
+        buffer = np.empty([min(len(ts)-1, self.buffer_size), 3])
+        while start < len(ts)-1:
+            block = buffer[:min(len(ts)-1-start, self.buffer_size)]
+            count = compress_pieces(ts, start, open_length, tol, self.norm, max_len, block)
+            pieces.append(block[:count].copy())
+            start += int(np.sum(block[:count, 0]))
+            open_length = 0
+            if count < len(block) and start < len(ts)-1:
+                # the kernel stops where the error of extending the open segment
+                # is within rounding of the tolerance, see _rounding_bound, and
+                # the error is recomputed from the segment as in _compress_naive
+                m = int(block[count, 0])
+                inc = ts[start+m+1] - ts[start]
+                d = (ts[start] + (inc/(m+1))*np.arange(0, m+2)) - ts[start:start+m+2]
+                # equals np.linalg.norm(d)**2
+                err = math.sqrt(d.dot(d))**2
+                if err <= tol*m + np.finfo(float).eps:
+                    open_length = m + 1
+                else:
+                    pieces.append(block[count:count+1].copy())
+                    start += m
+        return np.vstack(pieces)
+
+    def _compress_gallop(self, time_series):
+        """
+        Greedy compression in the 1-norm which searches for the end of each
+        segment instead of extending it one time point at a time. See compress.
+
+        The first few end points of a segment are scanned one at a time,
+        so short segments cost no more than compress_method = 'naive'. Beyond
+        them the candidate end is moved 1, 2, 4, ... time points ahead until it
+        fails the tolerance, and the last success and first failure are then
+        bisected. The 1-norm error of a chord over L+1 points
+        lies between its 2-norm error and sqrt(L+1) times its 2-norm error, and
+        the 2-norm errors of all end points before the failure found are cheap
+        to compute from cumulative sums. They are used to check that no earlier
+        end point fails, as the test is not monotone in general. End points
+        which provably fail make the search fall back to a linear scan, and with
+        exact = True undecided end points are evaluated as well.
+        """
+        ts = np.asarray(time_series, dtype=float)
+        n = len(ts)
+        pieces = _PieceBuffer(3) # [increment, length, error]
+        tol = self.compression_tol
+        epsilon = np.finfo(float).eps
+        scan = 16 # end points scanned linearly before galloping
+
+        def error(start, end):
+            inc = ts[end] - ts[start]
+            return np.linalg.norm((ts[start] + (inc/(end-start))*np.arange(0, end-start+1)) - ts[start:end+1], 1)
+
+        def accept(start, end, err):
+            return ((err <= tol*(end-start-1) + epsilon) and (end-start-1 < self.max_len)) or end-start == 1
+
+        def first_failure(start, end):
+            # First end point in (start+1, end) failing the tolerance, otherwise end.
+            if end - start <= 2:
+                return end
+            d = ts[start:end] - ts[start]
+            i = np.arange(0, end-start)
+            sum_wd = np.cumsum(i*d)
+            sum_d2 = np.cumsum(d*d)
+            L = i[2:]
+            a = d[2:]/L
+            terms = (a*a*(L*(L+1)*(2*L+1)/6), 2*a*sum_wd[2:], sum_d2[2:])
+            err2 = terms[0] - terms[1] + terms[2]
+            slack = 1e-12*(np.abs(terms[0]) + np.abs(terms[1]) + terms[2])
+            lower = np.sqrt(np.maximum(err2 - slack, 0))
+            upper = np.sqrt(np.maximum(err2 + slack, 0))*np.sqrt(L+1)
+            threshold = tol*(L-1) + epsilon
+            fails = (lower > threshold*(1 + 1e-9)) | (L-1 >= self.max_len)
+            passes = (upper < threshold*(1 - 1e-9)) & ~fails
+            if self.exact:
+                candidates = np.nonzero(~passes)[0]
+            else:
+                candidates = np.nonzero(fails)[0]
+                if len(candidates) == 0:
+                    return end
+                # not monotone, verify all end points up to the failure
+                candidates = np.nonzero(~passes[:candidates[0]+1])[0]
+            for j in candidates:
+                if fails[j] or not accept(start, start+j+2, error(start, start+j+2)):
+                    return start+j+2
+            return end
+
+        start = 0
+        while start < n-1:
+            # linear scan of the first few end points, end = start+1 always passes
+            (last, step) = (start+1, 1)
+            fail = n
+            while last < min(start + scan, n-1):
+                if accept(start, last+1, error(start, last+1)):
+                    last += 1
+                else:
+                    fail = last+1
+                    break
+            if fail < n:
+                # short segment, every earlier end point was evaluated
+                end = last
+                pieces.append([end-start, ts[end]-ts[start], error(start, end)])
+                start = end
+                continue
+            # exponential search
+            while last < n-1:
+                end = min(last + step, n-1)
+                if accept(start, end, error(start, end)):
+                    last = end
+                    step *= 2
+                else:
+                    fail = end
+                    break
+            # binary search between last success and first failure
+            while fail - last > 1 and fail < n:
+                mid = (last + fail)//2
+                if accept(start, mid, error(start, mid)):
+                    last = mid
+                else:
+                    fail = mid
+            fail = first_failure(start, fail)
+            end = fail - 1
+            pieces.append([end-start, ts[end]-ts[start], error(start, end)])
+            start = end
+            if fail == n:
+                break
+        if n < 2:
+            pieces.append([0, 0, 0])
+        return pieces.array()
+
+    def compress_parallel(self, time_series, n_jobs=None, n_chunks=None):
+        """
+        Approximate a long time series using a continuous piecewise linear
+        function, compressing contiguous chunks concurrently in worker processes.
+        Neighbouring chunks share their boundary point. The last piece of each
+        chunk and the first piece of the next are recompressed together, so all
+        pieces satisfy the tolerance, but the breakpoints near each seam can
+        differ from compress. The number of pieces typically differs from
+        compress by at most a few per seam, see examples/Benchmarks.py.
+        Parameters
+        ----------
+        time_series - numpy array
+            Time series as numpy array.
+        n_jobs - int
+            Number of worker processes. If None or less than 1 then one process
+            per CPU is used.
+        n_chunks - int
+            Number of chunks the time series is split into. Defaults to n_jobs.
+        Returns
+        -------
+        pieces - numpy array
+            Numpy array with three columns, each row contains length, increment
+            error for the segment. See compress.
+        """
+        ts = np.asarray(time_series)
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count() or 1
+        if n_chunks is None:
+            n_chunks = n_jobs
+        n_chunks = max(1, min(n_chunks, (len(ts)-1)//2))
+        bounds = np.linspace(0, len(ts)-1, n_chunks+1).astype(int)
+
+        worker = deepcopy(self)
+        worker.verbose = 0
+        chunks = [ts[bounds[j]:bounds[j+1]+1] for j in range(n_chunks)]
+        results, errors = worker._map_batch('compress', chunks, n_jobs, 1, None)
+        for e in errors:
+            if e is not None:
+                raise e
+
+        # stitch chunks, recompressing the two pieces either side of each seam
+        pieces = [results[0]]
+        for j in range(1, n_chunks):
+            while len(pieces[-1]) == 0:
+                pieces.pop()
+            last = pieces[-1][-1:]
+            pieces[-1] = pieces[-1][:-1]
+            first = results[j][:1]
+            seam_start = bounds[j] - int(last[0, 0])
+            seam_end = bounds[j] + int(first[0, 0])
+            pieces.append(worker.compress(ts[seam_start:seam_end+1]))
+            pieces.append(results[j][1:])
+        pieces = np.vstack(pieces)
         if self.verbose in [1, 2]: # pragma: no cover
-            print('Compression: Reduced time series of length', len(time_series), 'to', len(pieces), 'segments')
+            print('Compression: Reduced time series of length', len(ts), 'to', len(pieces), 'segments')
         return pieces
 
+    def compress_target(self, time_series, n_pieces=None, ratio=None, max_iter=60):
+        """
+        Approximate a time series using a continuous piecewise linear function
+        with a prescribed number of pieces, searching for the compression
+        tolerance by bisection. The tolerance is first doubled until the target
+        is met, then bisected until the number of pieces equals the target or
+        max_iter compressions have been performed. The time series is converted
+        once and every trial tolerance is compressed at most once. The pieces
+        only change at critical tolerances, where a piece would be extended by
+        the step which closed it, see _tol_upper. The bracket is bisected from
+        the critical tolerance above its lower end, so every compression passes
+        at least one critical tolerance, and once the bracket is narrow that
+        critical tolerance is also tried, which ends the search when it is the
+        last one below the upper end.
+        Parameters
+        ----------
+        time_series - numpy array
+            Time series as numpy array.
+        n_pieces - int
+            Maximum number of pieces.
+        ratio - float
+            Maximum number of pieces as a fraction of the length of the time
+            series, used if n_pieces is None.
+        max_iter - int
+            Maximum number of compressions performed during the search.
+        Returns
+        -------
+        pieces - numpy array
+            Numpy array with three columns, each row contains length, increment
+            error for the segment. See compress.
+        tol - float
+            Smallest compression tolerance found for which compress returns at
+            most n_pieces pieces.
+        """
+        ts = np.asarray(time_series)
+        if self.compress_method in ['auto', 'native']:
+            ts = np.ascontiguousarray(ts, dtype=float)
+        if n_pieces is None:
+            if ratio is None:
+                raise ValueError('Either n_pieces or ratio must be given.')
+            n_pieces = int(np.floor(ratio*len(ts)))
+        if n_pieces < 1:
+            raise ValueError('Invalid target number of pieces.')
+
+        worker = deepcopy(self)
+        worker.verbose = 0
+        trials = {}
+        def trial(tol):
+            if tol not in trials:
+                worker.compression_tol = tol
+                trials[tol] = worker.compress(ts)
+            return trials[tol]
+
+        # bracket the target, lo misses it and hi meets it
+        lo, hi = 0.0, 0.0
+        if len(trial(hi)) > n_pieces:
+            hi = self.compression_tol if self.compression_tol > 0 else 1.0
+            while len(trial(hi)) > n_pieces:
+                if len(trials) >= max_iter:
+                    raise ValueError('Target number of pieces not attained, try increasing max_len.')
+                lo, hi = hi, 2*hi
+            if lo == 0.0:
+                lo = hi/2
+                while len(trials) < max_iter and len(trial(lo)) <= n_pieces:
+                    lo, hi = lo/2, lo
+
+            # bisect the bracket, lo gives the same pieces up to its critical tolerance
+            (uppers, critical) = ({}, False)
+            while len(trials) < max_iter and len(trial(hi)) < n_pieces:
+                if lo not in uppers:
+                    uppers[lo] = max(self._tol_upper(ts, trial(lo)), np.nextafter(lo, np.inf))
+                mid = uppers[lo] if critical else (uppers[lo] + hi)/2
+                if mid >= hi:
+                    break
+                # try the critical tolerance after every bisection of a narrow bracket
+                critical = not critical and (hi - uppers[lo]) < 1e-6*hi
+                if len(trial(mid)) <= n_pieces:
+                    hi = mid
+                else:
+                    lo = mid
+
+        pieces = trial(hi)
+        if self.verbose in [1, 2]: # pragma: no cover
+            print('Compression: Reduced time series of length', len(ts), 'to', len(pieces), 'segments with tol', hi)
+        return pieces, hi
+
+    def _tol_upper(self, ts, pieces):
+        """
+        Smallest tolerance at which compress would extend one of pieces, which
+        it returned for the time series ts, by the step which closed it. Below
+        it, and down to the tolerance which gave pieces, compress returns the
+        same pieces. The compiled critical_tol from src/compress is used if
+        available, otherwise the errors of the closing steps are summed over
+        each piece by np.add.reduceat.
+        """
+        try:
+            from src.compress import critical_tol
+            return critical_tol(np.ascontiguousarray(ts, dtype=float), np.ascontiguousarray(pieces, dtype=float),
+                                self.norm, float(self.max_len))
+        except ImportError:
+            pass
+        lengths = pieces[:,0].astype(int)
+        starts = np.cumsum(lengths) - lengths
+        closed = (starts + lengths < len(ts) - 1) & (lengths < self.max_len)
+        if not np.any(closed):
+            return np.inf
+        ends = np.minimum(starts + lengths + 1, len(ts) - 1)
+        slope = (ts[ends] - ts[starts])/(lengths + 1)
+
+        # deviations of the chord over each piece and the two time points after it
+        origin = np.repeat(starts, lengths)
+        d = (ts[origin] + np.repeat(slope, lengths)*(np.arange(len(origin)) - origin)) - ts[:len(origin)]
+        tail = [(ts[starts] + slope*i) - ts[np.minimum(starts + i, len(ts) - 1)] for i in [lengths, lengths+1]]
+        if self.norm == 2:
+            err = np.add.reduceat(d*d, starts) + tail[0]**2 + tail[1]**2
+            critical = np.sqrt(np.maximum(err - np.finfo(float).eps, 0)/lengths)
+        else:
+            err = np.add.reduceat(np.abs(d), starts) + np.abs(tail[0]) + np.abs(tail[1])
+            critical = np.maximum(err - np.finfo(float).eps, 0)/lengths
+        return np.min(critical[closed])
+
+    def compress_hierarchy(self, time_series, tols):
+        """
+        Approximate a time series at several compression tolerances with nested
+        pieces. The smallest tolerance is compressed by compress. Each coarser
+        level then runs the greedy compression over the breakpoints of the level
+        below only, so the breakpoints of a coarser level are a subset of those
+        of every finer level. For norm = 2 the segment errors are obtained by
+        merging sums precomputed once per piece of the finest level, so coarser
+        levels never revisit the time series. For norm = 1 the errors of merged
+        segments are computed from the time series.
+        Parameters
+        ----------
+        time_series - numpy array
+            Time series as numpy array.
+        tols - list
+            Compression tolerances in increasing order.
+        Returns
+        -------
+        hierarchy - list
+            One numpy array of pieces per tolerance, see compress.
+        index - numpy array
+            Numpy array with two columns, each row contains the position of a
+            breakpoint of the finest level and the first tolerance in tols at
+            which it is removed (inf if it is kept at every level). See
+            extract_pieces.
+        """
+        tols = [float(tol) for tol in tols]
+        if len(tols) == 0 or np.any(np.diff(tols) < 0):
+            raise ValueError('tols must be a non-empty list in increasing order.')
+        ts = np.asarray(time_series, dtype=float)
+        epsilon = np.finfo(float).eps
+
+        worker = deepcopy(self)
+        worker.verbose = 0
+        worker.compression_tol = tols[0]
+        pieces = worker.compress(ts)
+        hierarchy = [pieces]
+
+        # sums over each piece relative to its first value, d_j = y[s+j] - y[s]
+        # for j = 1,...,L gives sum_j d_j, sum_j d_j^2 and sum_j j*d_j
+        lengths = pieces[:, 0].astype(int)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        owner = np.repeat(np.arange(len(lengths)), lengths)
+        j = np.arange(1, np.sum(lengths)+1) - starts[owner]
+        d = ts[1:np.sum(lengths)+1] - ts[starts[owner]]
+        stats = np.column_stack([np.bincount(owner, d, len(lengths)),
+                                 np.bincount(owner, d*d, len(lengths)),
+                                 np.bincount(owner, j*d, len(lengths))])
+
+        vanish = np.full(len(lengths)-1, np.inf)
+        alive = np.arange(len(lengths)-1) # breakpoints of the current level
+        for tol in tols[1:]:
+            tol_ = tol**2 if self.norm == 2 else tol
+            new_pieces = _PieceBuffer(3)
+            new_stats = []
+            kept = []
+            (M, inc, sd, sd2, sjd, err) = (0, 0.0, 0.0, 0.0, 0.0, 0.0)
+            ends = np.cumsum(pieces[:, 0]).astype(int)
+            for b in range(len(pieces)):
+                (L, inc_b) = (int(pieces[b, 0]), pieces[b, 1])
+                # merge block b into the open segment of length M
+                N = M + L
+                s = ends[b] - N
+                new_inc = ts[ends[b]] - ts[s]
+                new_sd = sd + stats[b, 0] + L*inc
+                new_sd2 = sd2 + stats[b, 1] + 2*inc*stats[b, 0] + L*inc*inc
+                new_sjd = sjd + stats[b, 2] + inc*L*(L+1)/2 + M*stats[b, 0] + M*L*inc
+                bound = tol_*(N-1) + epsilon
+                if self.norm == 2:
+                    a = new_inc/N
+                    terms = (a*a*(N*(N+1)*(2*N+1)/6), 2*a*new_sjd, new_sd2)
+                    new_err = max(terms[0] - terms[1] + terms[2], 0.0)
+                    if M > 0 and abs(new_err - bound) <= _rounding_bound(N, ts[s], terms):
+                        new_err = np.linalg.norm((ts[s] + (new_inc/N)*np.arange(N+1)) - ts[s:s+N+1])**2
+                else:
+                    new_err = np.linalg.norm((ts[s] + (new_inc/N)*np.arange(N+1)) - ts[s:s+N+1], 1)
+
+                if M == 0 or ((new_err <= bound) and (N-1 < self.max_len)):
+                    if M > 0:
+                        vanish[alive[b-1]] = tol
+                    (M, inc, sd, sd2, sjd, err) = (N, new_inc, new_sd, new_sd2, new_sjd, new_err)
+                    continue
+                new_pieces.append([M, inc, err])
+                new_stats.append([sd, sd2, sjd])
+                kept.append(alive[b-1])
+                (M, inc, sd, sd2, sjd, err) = (L, inc_b, stats[b, 0], stats[b, 1], stats[b, 2], pieces[b, 2])
+            new_pieces.append([M, inc, err])
+            new_stats.append([sd, sd2, sjd])
+
+            pieces = new_pieces.array()
+            stats = np.array(new_stats)
+            alive = np.array(kept, dtype=int)
+            hierarchy.append(pieces)
+
+        index = np.column_stack([np.cumsum(lengths)[:-1], vanish])
+        if self.verbose in [1, 2]: # pragma: no cover
+            print('Compression: Reduced time series of length', len(ts), 'to', [len(p) for p in hierarchy], 'segments')
+        return hierarchy, index
+
+    def extract_pieces(self, time_series, index, tol):
+        """
+        Extract the pieces of one level of compress_hierarchy without
+        recompressing, keeping the breakpoints not yet removed at tolerance tol.
+        For a tolerance between two levels this gives the pieces of the finer
+        level.
+        Parameters
+        ----------
+        time_series - numpy array
+            Time series as numpy array.
+        index - numpy array
+            Breakpoint index returned by compress_hierarchy.
+        tol - float
+            Compression tolerance.
+        Returns
+        -------
+        pieces - numpy array
+            Numpy array with three columns, each row contains length, increment
+            error for the segment. See compress.
+        """
+        ts = np.asarray(time_series, dtype=float)
+        breakpoints = np.concatenate([[0], index[index[:, 1] > tol, 0].astype(int), [len(ts)-1]])
+        pieces = np.zeros([len(breakpoints)-1, 3])
+        for p in range(len(breakpoints)-1):
+            (s, e) = (breakpoints[p], breakpoints[p+1])
+            inc = ts[e] - ts[s]
+            chord = ts[s] + (inc/(e-s))*np.arange(e-s+1) - ts[s:e+1]
+            if self.norm == 2:
+                pieces[p] = [e-s, inc, np.linalg.norm(chord)**2]
+            else:
+                pieces[p] = [e-s, inc, np.linalg.norm(chord, 1)]
+        return pieces
+
+    def pyramid(self, time_series, tols):
+        """
+        Build symbolic representations of a time series at several tolerances
+        with nested pieces, see ABBAPyramid. The pieces are computed by
+        compress_hierarchy and each level is digitized with its own tolerance.
+        Parameters
+        ----------
+        time_series - numpy array
+            Normalised time series as numpy array.
+        tols - list
+            Compression tolerances, in any order.
+        Returns
+        -------
+        pyramid - ABBAPyramid
+            Representations ordered from the coarsest to the finest level.
+        """
+        ts = np.asarray(self._check_time_series(time_series), dtype=float)
+        tols = sorted(float(tol) for tol in tols)
+        hierarchy, _ = self.compress_hierarchy(ts, tols)
+
+        worker = deepcopy(self)
+        levels = []
+        for tol, pieces in zip(tols, hierarchy):
+            worker.digitization_tol = tol
+            string, centers = worker.digitize(pieces)
+            levels.append({'pieces': pieces, 'string': string, 'centers': centers})
+        pyramid = ABBAPyramid(tols[::-1], ts[0], levels[::-1])
+
+        # largest reconstruction error over each piece, end points included
+        for level, data in enumerate(pyramid.levels):
+            error = np.abs(pyramid.reconstruct(level=level) - ts)
+            ends = np.cumsum(data['pieces'][:, 0]).astype(int)
+            starts = np.concatenate([[0], ends[:-1]])
+            data['error'] = np.maximum(np.maximum.reduceat(error, starts), error[ends])
+        return pyramid
+
+    def compress_multichannel(self, time_series, criterion='any'):
+        """
+        Approximate several time series sampled at the same times by continuous
+        piecewise linear functions with shared breakpoints. The chord errors of
+        all channels are updated together, so one pass over the data replaces
+        one call to compress per channel.
+        Parameters
+        ----------
+        time_series - numpy array
+            Array of shape (n_samples, n_channels). A one dimensional array is
+            treated as a single channel.
+        criterion - 'any' or 'mean'
+            'any' - A segment is cut when the error of any channel exceeds the
+                tolerance used by compress.
+            'mean' - A segment is cut when the mean error over all channels
+                exceeds the tolerance.
+        Returns
+        -------
+        pieces - numpy array
+            Numpy array with n_channels + 2 columns, each row contains length,
+            the increment of every channel and the error for the segment, which
+            is the largest (criterion = 'any') or mean (criterion = 'mean')
+            error over the channels.
+        """
+        if criterion not in ['any', 'mean']:
+            raise ValueError('Invalid criterion.')
+        ts = np.asarray(time_series, dtype=float)
+        if ts.ndim == 1:
+            ts = ts.reshape(-1, 1)
+        (n, c) = ts.shape
+        pieces = _PieceBuffer(c+2) # [length, increments, error]
+        if self.norm == 2:
+            tol = self.compression_tol**2
+        else:
+            tol = self.compression_tol
+        epsilon = np.finfo(float).eps
+        reduce = np.max if criterion == 'any' else np.mean
+
+        start = 0 # start point
+        end = 1 # end point
+        (sum_wd, sum_d2) = (np.zeros(c), np.zeros(c)) # running sums for norm = 2
+        (lastinc, lasterr) = (np.zeros(c), 0)
+        while end < n:
+            L = end - start
+            inc = ts[end] - ts[start]
+            bound = tol*(L-1) + epsilon
+            if self.norm == 2:
+                new_wd = sum_wd + L*inc
+                new_d2 = sum_d2 + inc*inc
+                a = inc/L
+                terms = (a*a*(L*(L+1)*(2*L+1)/6), 2*a*new_wd, new_d2)
+                err = np.maximum(terms[0] - terms[1] + terms[2], 0)
+                slack = max(_rounding_bound(L, ts[start, j], [t[j] for t in terms]) for j in range(c))
+                if L > 1 and abs(reduce(err) - bound) <= slack:
+                    # recompute each channel from the segment as _compress_naive
+                    deviation = np.ascontiguousarray(((ts[start] + (inc/L)*np.arange(0, L+1).reshape(-1, 1)) - ts[start:end+1]).T)
+                    err = np.array([np.linalg.norm(d)**2 for d in deviation])
+            else:
+                deviation = np.ascontiguousarray(((ts[start] + (inc/L)*np.arange(0, L+1).reshape(-1, 1)) - ts[start:end+1]).T)
+                err = np.array([np.linalg.norm(d, 1) for d in deviation])
+            err = reduce(err)
+
+            if ((err <= bound) and (L-1 < self.max_len)) or L == 1:
+                (lastinc, lasterr) = (inc, err)
+                if self.norm == 2:
+                    (sum_wd, sum_d2) = (new_wd, new_d2)
+                end += 1
+            else:
+                pieces.append(np.hstack([L-1, lastinc, lasterr]))
+                start = end - 1
+                (sum_wd, sum_d2) = (np.zeros(c), np.zeros(c))
+
+        pieces.append(np.hstack([end-start-1, lastinc, lasterr]))
+        if self.verbose in [1, 2]: # pragma: no cover
+            print('Compression: Reduced', c, 'time series of length', n, 'to', len(pieces), 'segments')
+        return pieces.array()
+
+    def compress_stream(self):
+        """
+        Construct a StreamCompressor with the compression parameters of this
+        object, for time series which do not fit in memory or arrive in chunks.
+        Returns
+        -------
+        stream - StreamCompressor
+            Object accepting samples via push() and returning the trailing piece
+            on flush().
+        """
+        return StreamCompressor(tol=self.compression_tol, max_len=self.max_len, norm=self.norm)
+
     def inverse_compress(self, start, pieces):
         """
         Reconstruct time series from its first value `ts0` and its `pieces`.
@@ -259,15 +1666,146 @@ class ABBA(object):
         -------
         time_series : Reconstructed time series
         """
-        time_series = [start]
-        # stitch linear piece onto last
-        for j in range(0, len(pieces)):
-            x = np.arange(0,pieces[j,0]+1)/(pieces[j,0])*pieces[j,1]
-            y = time_series[-1] + x
-            time_series = time_series + y[1:].tolist()
-        return time_series
+        # stitch linear piece onto last, all pieces at once
+        lengths = pieces[:,0]
+        counts = np.ceil(lengths).astype(int) # points added by each piece
+        if len(pieces) == 0 or np.sum(counts) == 0:
+            return [start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rise = np.where(counts > 0, counts/lengths*pieces[:,1], 0) # last point of piece minus first
+        base = np.cumsum(np.concatenate([[start], rise[:-1]]))
+        owner = np.repeat(np.arange(len(pieces)), counts)
+        x = np.arange(1, np.sum(counts)+1) - np.repeat(np.cumsum(counts) - counts, counts)
+        y = base[owner] + x/lengths[owner]*pieces[owner,1]
+        return [start] + y.tolist()
+
+    def _fit_kmeans(self, data, k, bound, init=None, weights=None):
+        """
+        Fit sklearn KMeans with k clusters, from the initial centers init if
+        given and with rows of data weighted by weights if given, and return the
+        centers, labels and largest cluster variance.
+        """
+        # tol=0 ensures labels and centres coincide
+        kwargs = {'n_clusters': k, 'tol': 0}
+        if init is not None:
+            kwargs.update(init=init, n_init=1)
+        elif self.n_init is not None:
+            kwargs['n_init'] = self.n_init
+        if self.seed:
+            kwargs['random_state'] = 0
+        kmeans = KMeans(**kwargs).fit(data, sample_weight=weights)
+        centers = kmeans.cluster_centers_
+        labels = kmeans.labels_
+        error_1, error_2 = self._max_cluster_var(data, labels, centers, k, weights)
+        if self.verbose == 2: # pragma: no cover
+            print('k:', k)
+            print('d1_error:', error_1, 'd2_error:', error_2, 'bound:', bound)
+        return centers, labels, max([error_1, error_2])
+
+    def _select_k(self, data, bound, weights=None):
+        """
+        Smallest number of clusters k between min_k and max_k for which the
+        largest cluster variance of KMeans is at most bound, see k_search. If no
+        k satisfies the bound then max_k is used.
+        Parameters
+        ----------
+        data - numpy array
+            Data to cluster, one row per piece.
+        bound - float
+            Bound on the largest cluster variance.
+        weights - numpy array
+            Number of occurrences of each row of data, see dedup.
+        Returns
+        -------
+        k - int
+            Number of clusters.
+        centers - numpy array
+            Centers of the k clusters.
+        labels - numpy array
+            Cluster label of each row of data.
+        """
+        if self.k_search == 'bracket':
+            fits = {}
+            def fit(k):
+                if k not in fits:
+                    fits[k] = self._fit_kmeans(data, k, bound, weights=weights)
+                return fits[k][2] <= bound
+
+            # exponential search for a k within the bound, then bisection, every
+            # point is its own cluster for k = len(data) so larger k are not tried
+            max_k = max(min(self.max_k, len(data)), self.min_k)
+            (lo, hi, step) = (self.min_k - 1, self.min_k, 1)
+            while hi < max_k and not fit(hi):
+                (lo, hi, step) = (hi, min(hi + step, max_k), 2*step)
+            if fit(hi):
+                while hi - lo > 1:
+                    mid = (lo + hi)//2
+                    if fit(mid):
+                        hi = mid
+                    else:
+                        lo = mid
+            centers, labels, _ = fits[hi]
+            return hi, centers, labels
+
+        if self.k_jobs != 1:
+            return self._select_k_parallel(data, bound, weights)
+
+        init = None
+        for k in range(self.min_k, self.max_k+1):
+            centers, labels, error = self._fit_kmeans(data, k, bound, init, weights)
+            if error <= bound:
+                break
+            if self.k_search == 'warm':
+                # split the cluster of largest variance, its point furthest from
+                # the center becomes the new center
+                spread = np.bincount(labels, np.sum((data - centers[labels])**2, axis=1)*(1 if weights is None else weights), k)
+                members = np.where(labels == np.argmax(spread))[0]
+                furthest = members[np.argmax(np.sum((data[members] - centers[labels[members]])**2, axis=1))]
+                init = np.vstack([centers, data[furthest]])
+        return k, centers, labels
+
+    def _select_k_parallel(self, data, bound, weights=None):
+        """
+        As k_search = 'linear', with k_jobs values of k fitted at once. Results
+        are read in order of k, and each failing k makes room for the next, so
+        the k, centers and labels are those of the serial search.
+        """
+        k_jobs = (os.cpu_count() or 1) if self.k_jobs is None else self.k_jobs
+        if self.k_backend == 'thread':
+            executor = ThreadPoolExecutor(max_workers=k_jobs)
+        else:
+            # workers are not forked, a child forked from a process that has run
+            # KMeans can deadlock in the OpenMP runtime bundled with sklearn
+            executor = ProcessPoolExecutor(max_workers=k_jobs, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            pending = collections.deque()
+            next_k = self.min_k
+            while True:
+                while next_k <= self.max_k and len(pending) < k_jobs:
+                    pending.append((next_k, executor.submit(self._fit_kmeans, data, next_k, bound, None, weights)))
+                    next_k += 1
+                k, future = pending.popleft()
+                centers, labels, error = future.result()
+                if error <= bound or (not pending and next_k > self.max_k):
+                    break
+        finally:
+            # fits of larger k still running are not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+        return k, centers, labels
+
+    def _piece_totals(self, data, weights=None):
+        """
+        Total length of the pieces plus one, and number of pieces, counting every
+        occurrence of a piece if weights is given, see dedup.
+        """
+        if weights is None:
+            N = 1
+            for i in data:
+                N += i[0]
+            return N, len(data)
+        return 1 + np.sum(weights*data[:,0]), np.sum(weights)
 
-    def _max_cluster_var(self, pieces, labels, centers, k):
+    def _max_cluster_var(self, pieces, labels, centers, k, weights=None):
         """
         Calculate the maximum variance among all clusters after k-means, in both
         the inc and len dimension.
@@ -283,31 +1821,30 @@ class ABBA(object):
         k - int
             Number of clusters. Corresponds to numberof rows in centers, and number
             of unique symbols in labels.
+        weights - numpy array
+            Number of occurrences of each piece, see dedup.
         Returns
         -------
         variance - float
             Largest variance among clusters from k-means.
         """
-        d1 = [0] # direction 1
-        d2 = [0] # direction 2
-        for i in range(k):
-            matrix = ((pieces[np.where(labels==i), :] - centers[i])[0]).T
-            # Check not all zero
-            if not np.all(np.abs(matrix[0,:]) < np.finfo(float).eps):
-                # Check more than one value
-                if len(matrix[0,:]) > 1:
-                    d1.append(np.var(matrix[0,:]))
-
-            # If performing 2-d clustering
-            if matrix.shape[0] == 2:
-                # Check not all zero
-                if not np.all(np.abs(matrix[1,:]) < np.finfo(float).eps):
-                    # Check more than one value
-                    if len(matrix[1,:]) > 1:
-                        d2.append(np.var(matrix[1,:]))
-        return np.max(d1), np.max(d2)
-
-    def _build_centers(self, pieces, labels, c1, k, col):
+        # per cluster statistics of the deviations from the centers in one pass
+        labels = np.asarray(labels)
+        deviation = pieces - centers[labels]
+        weights = np.ones(len(labels)) if weights is None else weights
+        count = np.bincount(labels, weights, k)
+        size = np.maximum(count, 1)
+        variance = [0, 0]
+        for d in range(deviation.shape[1]):
+            mean = np.bincount(labels, weights*deviation[:,d], k)/size
+            var = np.bincount(labels, weights*(deviation[:,d] - mean[labels])**2, k)/size
+            # Check not all zero and more than one value
+            nonzero = np.bincount(labels, np.abs(deviation[:,d]) >= np.finfo(float).eps, k) > 0
+            var = var[nonzero & (count > 1)]
+            variance[d] = max(np.max(var), 0) if len(var) > 0 else 0
+        return variance[0], variance[1]
+
+    def _build_centers(self, pieces, labels, c1, k, col, weights=None):
         """
         utility function for digitize, helps build 2d cluster centers after 1d clustering.
         Parameters
@@ -322,19 +1859,19 @@ class ABBA(object):
             Number of clusters
         col - 0 or 1
             Which column was clustered during 1d clustering
+        weights - numpy array
+            Number of occurrences of each piece, see dedup.
         Returns
         -------
         centers - numpy array
             centers of clusters from clustering algorithm. Each centre corresponds
             to character in string.
         """
-        c2 = []
-        for i in range(k):
-            location = np.where(labels==i)[0]
-            if location.size == 0:
-                c2.append(np.NaN)
-            else:
-                c2.append(np.mean(pieces[location, col]))
+        labels = np.asarray(labels)
+        weights = np.ones(len(labels)) if weights is None else weights
+        count = np.bincount(labels, weights, k)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c2 = np.where(count > 0, np.bincount(labels, weights*pieces[:,col], k)/count, np.nan)
         if col == 0:
             return (np.array((c2, c1))).T
         else:
@@ -375,14 +1912,28 @@ class ABBA(object):
         #     'kmeans'
         ########################################################################
         elif self.c_method == 'kmeans':
+            # cluster distinct pieces weighted by their number of occurrences
+            (weights, inverse) = (None, None)
+            if self.dedup and self.scl not in [0, np.inf]:
+                data, first, inverse, weights = np.unique(data, axis=0, return_index=True, return_inverse=True, return_counts=True)
+                # distinct pieces in order of first occurrence, which seeds KMeans
+                order = np.argsort(first, kind='stable')
+                (data, weights) = (data[order], weights[order].astype(float))
+                inverse = np.argsort(order)[inverse.reshape(-1)]
             if self.scl == np.inf or self.scl == 0:
-                labels, centers = self.digitize_ckmeans(data)
+                labels, centers = self.digitize_ckmeans(data, weights)
             else:
-                labels, centers = self.digitize_kmeans(data)
+                labels, centers = self.digitize_kmeans(data, weights)
+            if inverse is not None:
+                labels = np.asarray(labels)[inverse.reshape(-1)]
 
-        ########################################################################
-        #     Convert labels
-        ########################################################################
+        return self._symbols(labels, centers)
+
+    def _symbols(self, labels, centers):
+        """
+        Convert cluster labels to a string and reorder the centers accordingly,
+        see digitize.
+        """
         # Order cluster centres so 'a' is the most populated cluster, and so forth.
         k = len(set(labels))
         new_to_old = [0] * k
@@ -399,19 +1950,191 @@ class ABBA(object):
         string = ''.join([ chr(97 + old_to_new[j]) for j in labels ])
         return string, centers[new_to_old, :]
 
-    def digitize_ckmeans(self, data):
+    def digitize_batch(self, pieces_list, n_threads=None):
+        """
+        Convert the compressed representations of a collection of time series to
+        symbolic representations, each clustered separately as in digitize.
+        With c_method = 'kmeans' and scl = 0 or scl = inf, all time series are
+        clustered by one call to the compiled Ckmeans module, which runs on
+        n_threads threads without holding the GIL. Otherwise digitize is applied
+        to each time series in turn.
+        Parameters
+        ----------
+        pieces_list - list
+            Time series in compressed format, see compression.
+        n_threads - int
+            Number of threads of the compiled Ckmeans module. If None then all
+            hardware threads are used.
+        Returns
+        -------
+        strings - list
+            Symbolic representation of each time series.
+        centers - list
+            Cluster centres for each time series.
+        """
+        for pieces in pieces_list:
+            if len(pieces) < self.min_k:
+                raise ValueError('Number of pieces less than min_k.')
+        try:
+            from src.Ckmeans import kmeans_1d_dp_batch
+            compiled = True
+        except ImportError: # pragma: no cover
+            compiled = False
+        if not (compiled and self.c_method == 'kmeans' and self.scl in [0, np.inf]):
+            outputs = [self.digitize(pieces) for pieces in pieces_list]
+            return [out[0] for out in outputs], [out[1] for out in outputs]
+        self.Ck = True
+
+        # scale and bound of every time series as in digitize_ckmeans
+        (col, other) = (1, 0) if self.scl == 0 else (0, 1)
+        s = .20
+        (values, stds, bounds, batched) = ([], [], [], [])
+        for m, pieces in enumerate(pieces_list):
+            (N, n) = self._piece_totals(pieces)
+            bounds.append(((6*(N-n))/(N*n))*((self.digitization_tol*self.digitization_tol)/(s*s)))
+            std = np.std(pieces[:,col])
+            stds.append(std if std > np.finfo(float).eps else 1)
+            values.append(pieces[:,col]/stds[-1])
+            # time series with too few unique pieces for Ckmeans use digitize
+            if len(set(values[-1])) >= self.min_k:
+                batched.append(m)
+
+        x = np.concatenate([values[m] for m in batched]) if batched else np.zeros(0)
+        offsets = np.concatenate([[0], np.cumsum([len(values[m]) for m in batched])]).astype(np.intc)
+        labels = np.empty(len(x), dtype=np.intc)
+        centres = np.empty(len(x))
+        k = np.empty(len(batched), dtype=np.intc)
+        status = kmeans_1d_dp_batch(x, offsets, np.full(len(batched), self.min_k, dtype=np.intc),
+                                    np.full(len(batched), self.max_k, dtype=np.intc),
+                                    np.array([bounds[m] for m in batched], dtype=float), self.ck_method,
+                                    0 if n_threads is None else n_threads, labels, centres, k)
+        if status < 0:
+            raise ValueError('Invalid arguments to kmeans_1d_dp_batch.')
+
+        strings = [None]*len(pieces_list)
+        centers = [None]*len(pieces_list)
+        for i, m in enumerate(batched):
+            (start, end) = (offsets[i], offsets[i+1])
+            data = pieces_list[m][:,0:2]
+            c = centres[start:start+k[i]]*stds[m]
+            if self.verbose in [1, 2]: # pragma: no cover
+                print('Digitization: Using', k[i], 'symbols')
+            strings[m], centers[m] = self._symbols(labels[start:end], self._build_centers(data, labels[start:end], c, k[i], other))
+        for m in range(len(pieces_list)):
+            if strings[m] is None:
+                strings[m], centers[m] = self.digitize(pieces_list[m])
+        return strings, centers
+
+    def digitize_sweep(self, pieces, tols):
+        """
+        Convert compressed representation to symbolic representations for
+        several digitization tolerances, as digitize with tol = [compression tol,
+        digitization tol] for each of tols. With c_method = 'kmeans' and scl = 0
+        or scl = inf, the dynamic programming tables of Ckmeans are filled once,
+        and each tolerance only selects the number of clusters and backtracks
+        the tables. Otherwise digitize is repeated for each tolerance.
+        Parameters
+        ----------
+        pieces - numpy array
+            Time series in compressed format. See compression.
+        tols - list
+            Digitization tolerances.
+        Returns
+        -------
+        strings - list
+            Symbolic representation for each tolerance.
+        centers - list
+            Cluster centres for each tolerance.
+        """
+        if len(pieces) < self.min_k:
+            raise ValueError('Number of pieces less than min_k.')
+        try:
+            from src.Ckmeans import Ckmeans1d
+        except ImportError: # pragma: no cover
+            from src.kmeans_1d import Ckmeans1d
+
+        # scale as in digitize_ckmeans
+        data = deepcopy(pieces[:,0:2])
+        (col, other) = (1, 0) if self.scl == 0 else (0, 1)
+        std = np.std(data[:,col])
+        std = std if std > np.finfo(float).eps else 1
+        x = np.ascontiguousarray(data[:,col]/std)
+
+        if not (self.c_method == 'kmeans' and self.scl in [0, np.inf] and len(set(x)) >= self.min_k):
+            (strings, centers) = ([], [])
+            for tol in tols:
+                abba = deepcopy(self)
+                abba.digitization_tol = tol
+                string, c = abba.digitize(pieces)
+                strings.append(string)
+                centers.append(c)
+            return strings, centers
+
+        self.Ck = True
+        s = .20
+        (N, n) = self._piece_totals(data)
+        table = Ckmeans1d(x, self.max_k, self.ck_method)
+        (strings, centers) = ([], [])
+        for tol in tols:
+            bound = ((6*(N-n))/(N*n))*((tol*tol)/(s*s))
+            labels = np.empty(len(x), dtype=np.intc)
+            c = np.empty(max(self.max_k, 1))
+            k = table.cluster(table.select(bound, self.min_k), labels, c)
+            if self.verbose in [1, 2]: # pragma: no cover
+                print('Digitization: Using', k, 'symbols')
+            string, c = self._symbols(labels, self._build_centers(data, labels, c[:k]*std, k, other))
+            strings.append(string)
+            centers.append(c)
+        return strings, centers
+
+    def _kmeans_1d_dp(self, x, bound, weights=None, compiled=True):
+        """
+        Optimal 1d k-means of x, with the smallest number of clusters between
+        min_k and max_k for which every cluster variance is below bound. The
+        compiled Ckmeans module reads x and writes the labels and centres in
+        place, the NumPy implementation is used if compiled is False or if
+        weights are given.
+        Returns
+        -------
+        labels - numpy array
+            Cluster label of each element of x.
+        centres - numpy array
+            Centres of the clusters.
+        k - int
+            Number of clusters.
+        """
+        if compiled and weights is None:
+            from src.Ckmeans import kmeans_1d_dp_buffer
+            x = np.ascontiguousarray(x, dtype=float)
+            labels = np.empty(len(x), dtype=np.intc)
+            centres = np.empty(max(self.max_k, 1))
+            k = kmeans_1d_dp_buffer(x, self.min_k, self.max_k, bound, self.ck_method, labels, centres)
+            if k == 0 and len(x) > 0:
+                raise ValueError('Invalid arguments to kmeans_1d_dp_buffer.')
+            return labels, centres[:k], k
+        from src.kmeans_1d import kmeans_1d_dp
+        output = kmeans_1d_dp(x, self.min_k, self.max_k, bound, self.ck_method, weights)
+        return output.cluster, output.centres, output.Kopt
+
+    def digitize_ckmeans(self, data, weights=None):
         # Initialise variables
         centers = np.zeros((0,2))
         labels = [-1]*np.shape(data)[0]
         # Try Cpp wrapper
         try:
-            from src.Ckmeans import kmeans_1d_dp
-            from src.Ckmeans import double_vector
-            self.Ck = True
-        except: #TODO use https://github.com/llimllib/ckmeans/blob/master/ckmeans.py instead
-            self.Ck = False
-            if self.verbose in [1, 2]: # pragma: no cover
-                warnings.warn('Ckmeans module unavailable, try running makefile. Using sklearn KMeans instead.',  stacklevel=3)
+            from src.Ckmeans import kmeans_1d_dp_buffer
+            (self.Ck, compiled) = (True, True)
+        except ImportError:
+            # Try NumPy implementation of the same algorithm
+            try:
+                from src.kmeans_1d import kmeans_1d_dp
+                (self.Ck, compiled) = (True, False)
+                if self.verbose in [1, 2]: # pragma: no cover
+                    warnings.warn('Ckmeans module unavailable, try running makefile. Using NumPy implementation instead.',  stacklevel=3)
+            except ImportError:
+                self.Ck = False
+                if self.verbose in [1, 2]: # pragma: no cover
+                    warnings.warn('Ckmeans module unavailable, try running makefile. Using sklearn KMeans instead.',  stacklevel=3)
 
         ########################################################################
         #     scl == 0
@@ -419,13 +2142,11 @@ class ABBA(object):
         if self.scl == 0:
             # construct tol_s
             s = .20
-            N = 1
-            for i in data:
-                N += i[0]
-            bound = ((6*(N-len(data)))/(N*len(data)))*((self.digitization_tol*self.digitization_tol)/(s*s))
+            (N, n) = self._piece_totals(data, weights)
+            bound = ((6*(N-n))/(N*n))*((self.digitization_tol*self.digitization_tol)/(s*s))
 
             # scale inc to unit variance
-            inc_std = np.std(data[:,1])
+            inc_std = _weighted_std(data[:,1], weights)
             inc_std = inc_std if inc_std > np.finfo(float).eps else 1
             data[:,1] /= inc_std
 
@@ -437,40 +2158,18 @@ class ABBA(object):
 
             # Use C++ CKmeans
             if self.Ck: # pragma: no cover
-                d = double_vector(data[:,1])
-                output = kmeans_1d_dp(d, self.min_k, self.max_k, bound, 'linear')
-                labels = np.array(output.cluster)
-
-                c = np.array(output.centres)
+                labels, c, k = self._kmeans_1d_dp(data[:,1], bound, weights, compiled)
                 c *= inc_std
-                centers = self._build_centers(data, labels, c, output.Kopt, 0)
+                centers = self._build_centers(data, labels, c, k, 0, weights)
 
                 if self.verbose in [1, 2]: # pragma: no cover
-                    print('Digitization: Using', output.Kopt, 'symbols')
-
-                k = output.Kopt
+                    print('Digitization: Using', k, 'symbols')
 
             # Use Kmeans
             else:
-                # Run through values of k from min_k to max_k checking bound
+                # Search values of k from min_k to max_k checking bound
                 if self.digitization_tol != 0:
-                    error = np.inf
-                    k = self.min_k - 1
-                    while k <= self.max_k-1 and (error > bound):
-                        k += 1
-                        # tol=0 ensures labels and centres coincide
-                        if self.seed:
-                            kmeans = KMeans(n_clusters=k, tol=0, random_state=0).fit(data[:,1].reshape(-1,1))
-                        else:
-                            kmeans = KMeans(n_clusters=k, tol=0).fit(data[:,1].reshape(-1,1))
-                        centers = kmeans.cluster_centers_
-                        labels = kmeans.labels_
-
-                        error_1, error_2 = self._max_cluster_var(data[:,1].reshape(-1,1), labels, centers, k)
-                        error = max([error_1, error_2])
-                        if self.verbose == 2: # pragma: no cover
-                            print('k:', k)
-                            print('d1_error:', error_1, 'd2_error:', error_2, 'bound:', bound)
+                    k, centers, labels = self._select_k(data[:,1].reshape(-1,1), bound, weights)
                     if self.verbose in [1, 2]: # pragma: no cover
                         print('Digitization: Using', k, 'symbols')
 
@@ -482,17 +2181,17 @@ class ABBA(object):
                         k = self.max_k
 
                     # tol=0 ensures labels and centres coincide
-                    kmeans = KMeans(n_clusters=k, tol=0).fit(data[:,1].reshape(-1,1))
+                    kmeans = KMeans(n_clusters=k, tol=0).fit(data[:,1].reshape(-1,1), sample_weight=weights)
                     centers = kmeans.cluster_centers_
                     labels = kmeans.labels_
-                    error = self._max_cluster_var(data[:,1].reshape(-1,1), labels, centers, k)
+                    error = self._max_cluster_var(data[:,1].reshape(-1,1), labels, centers, k, weights)
                     if self.verbose in [1, 2]: # pragma: no cover
                         print('Digitization: Using', k, 'symbols')
 
                 # build cluster centers
                 c = centers.reshape(1,-1)[0]
                 c *= inc_std
-                centers = self._build_centers(data, labels, c, k, 0)
+                centers = self._build_centers(data, labels, c, k, 0, weights)
 
         ########################################################################
         #     scl == inf
@@ -500,13 +2199,11 @@ class ABBA(object):
         elif self.scl == np.inf:
             # construct tol_s
             s = .20
-            N = 1
-            for i in data:
-                N += i[0]
-            bound = ((6*(N-len(data)))/(N*len(data)))*((self.digitization_tol*self.digitization_tol)/(s*s))
+            (N, n) = self._piece_totals(data, weights)
+            bound = ((6*(N-n))/(N*n))*((self.digitization_tol*self.digitization_tol)/(s*s))
 
             # scale length to unit variance
-            len_std = np.std(data[:,0])
+            len_std = _weighted_std(data[:,0], weights)
             len_std = len_std if len_std > np.finfo(float).eps else 1
             data[:,0] /= len_std
 
@@ -518,39 +2215,18 @@ class ABBA(object):
 
             # Use Ckmeans
             if self.Ck: # pragma: no cover
-                d = double_vector(data[:,0])
-                output = kmeans_1d_dp(d, self.min_k, self.max_k, bound, 'linear')
-                labels = np.array(output.cluster)
-
-                c = np.array(output.centres)
+                labels, c, k = self._kmeans_1d_dp(data[:,0], bound, weights, compiled)
                 c *= len_std
-                centers = self._build_centers(data, labels, c, output.Kopt, 1)
+                centers = self._build_centers(data, labels, c, k, 1, weights)
 
                 if self.verbose in [1, 2]: # pragma: no cover
-                    print('Digitization: Using', output.Kopt, 'symbols')
-
-                k = output.Kopt
+                    print('Digitization: Using', k, 'symbols')
 
             # Use Kmeans
             else:
-                # Run through values of k from min_k to max_k checking bound
+                # Search values of k from min_k to max_k checking bound
                 if self.digitization_tol != 0:
-                    error = np.inf
-                    k = self.min_k - 1
-                    while k <= self.max_k-1 and (error > bound):
-                        k += 1
-                        # tol=0 ensures labels and centres coincide
-                        if self.seed:
-                            kmeans = KMeans(n_clusters=k, tol=0, random_state=0).fit(data[:,0].reshape(-1,1))
-                        else:
-                            kmeans = KMeans(n_clusters=k, tol=0).fit(data[:,0].reshape(-1,1))
-                        centers = kmeans.cluster_centers_
-                        labels = kmeans.labels_
-                        error_1, error_2 = self._max_cluster_var(data[:,0].reshape(-1,1), labels, centers, k)
-                        error = max([error_1, error_2])
-                        if self.verbose == 2: # pragma: no cover
-                            print('k:', k)
-                            print('d1_error:', error_1, 'd2_error:', error_2, 'bound:', bound)
+                    k, centers, labels = self._select_k(data[:,0].reshape(-1,1), bound, weights)
                     if self.verbose in [1, 2]: # pragma: no cover
                         print('Digitization: Using', k, 'symbols')
 
@@ -562,20 +2238,20 @@ class ABBA(object):
                         k = self.max_k
 
                     # tol=0 ensures labels and centres coincide
-                    kmeans = KMeans(n_clusters=k, tol=0).fit(data[:,0].reshape(-1,1))
+                    kmeans = KMeans(n_clusters=k, tol=0).fit(data[:,0].reshape(-1,1), sample_weight=weights)
                     centers = kmeans.cluster_centers_
                     labels = kmeans.labels_
-                    error = self._max_cluster_var(data[:,0].reshape(-1,1), labels, centers, k)
+                    error = self._max_cluster_var(data[:,0].reshape(-1,1), labels, centers, k, weights)
                     if self.verbose in [1, 2]: # pragma: no cover
                         print('Digitization: Using', k, 'symbols')
 
                 # build cluster centers
                 c = centers.reshape(1,-1)[0]
                 c *= len_std
-                centers = self._build_centers(data, labels, c, k, 1)
+                centers = self._build_centers(data, labels, c, k, 1, weights)
         return labels, centers
 
-    def digitize_kmeans(self, data):
+    def digitize_kmeans(self, data, weights=None):
         # Initialise variables
         centers = np.zeros((0,2))
         labels = [-1]*np.shape(data)[0]
@@ -584,41 +2260,24 @@ class ABBA(object):
         ########################################################################
         # construct tol_s
         s = .20
-        N = 1
-        for i in data:
-            N += i[0]
-        bound = ((6*(N-len(data)))/(N*len(data)))*((self.digitization_tol*self.digitization_tol)/(s*s))
+        (N, n) = self._piece_totals(data, weights)
+        bound = ((6*(N-n))/(N*n))*((self.digitization_tol*self.digitization_tol)/(s*s))
 
         # scale length to unit variance
-        len_std = np.std(data[:,0])
+        len_std = _weighted_std(data[:,0], weights)
         len_std = len_std if len_std > np.finfo(float).eps else 1
         data[:,0] /= len_std
 
         # scale inc to unit variance
-        inc_std = np.std(data[:,1])
+        inc_std = _weighted_std(data[:,1], weights)
         inc_std = inc_std if inc_std > np.finfo(float).eps else 1
         data[:,1] /= inc_std
 
         # Kmeans
         data[:,0] *= self.scl # scale lengths accordingly
-        # Run through values of k from min_k to max_k checking bound
+        # Search values of k from min_k to max_k checking bound
         if self.digitization_tol != 0:
-            error = np.inf
-            k = self.min_k - 1
-            while k <= self.max_k-1 and (error > bound):
-                k += 1
-                # tol=0 ensures labels and centres coincide
-                if self.seed:
-                    kmeans = KMeans(n_clusters=k, tol=0, random_state=0).fit(data)
-                else:
-                    kmeans = KMeans(n_clusters=k, tol=0).fit(data)
-                centers = kmeans.cluster_centers_
-                labels = kmeans.labels_
-                error_1, error_2 = self._max_cluster_var(data, labels, centers, k)
-                error = max([error_1, error_2])
-                if self.verbose == 2: # pragma: no cover
-                    print('k:', k)
-                    print('d1_error:', error_1, 'd2_error:', error_2, 'bound:', bound)
+            k, centers, labels = self._select_k(data, bound, weights)
             if self.verbose in [1, 2]: # pragma: no cover
                 print('Digitization: Using', k, 'symbols')
 
@@ -630,10 +2289,10 @@ class ABBA(object):
                 k = self.max_k
 
             # tol=0 ensures labels and centres coincide
-            kmeans = KMeans(n_clusters=k, tol=0).fit(data)
+            kmeans = KMeans(n_clusters=k, tol=0).fit(data, sample_weight=weights)
             centers = kmeans.cluster_centers_
             labels = kmeans.labels_
-            error = self._max_cluster_var(data, labels, centers, k)
+            error = self._max_cluster_var(data, labels, centers, k, weights)
             if self.verbose in [1, 2]: # pragma: no cover
                 print('Digitization: Using', k, 'symbols')
 
@@ -651,29 +2310,8 @@ class ABBA(object):
         It is tolerance driven.
         """
 
-        def weighted_median(data, weights):
-            """
-            Args:
-              data (list or numpy.array): data
-              weights (list or numpy.array): weights
-            Taken from https://gist.github.com/tinybike/d9ff1dad515b66cc0d87
-            """
-            data, weights = np.array(data).squeeze(), np.array(weights).squeeze()
-            s_data, s_weights = map(np.array, zip(*sorted(zip(data, weights))))
-            midpoint = 0.5 * sum(s_weights)
-            if any(weights > midpoint):
-                w_median = (data[weights == np.max(weights)])[0]
-            else:
-                cs_weights = np.cumsum(s_weights)
-                idx = np.where(cs_weights <= midpoint)[0][-1]
-                if cs_weights[idx] == midpoint:
-                    w_median = np.mean(s_data[idx:idx+2])
-                else:
-                    w_median = s_data[idx+1]
-            return w_median
-
         # Initialise variables
-        centers = np.zeros((0,2))
+        centers = []
         labels = [-1]*np.shape(data)[0]
 
         if self.symmetric:
@@ -684,7 +2322,11 @@ class ABBA(object):
         k = 0 # counter for clusters
         inds = 0    # given accepted cluster
         inde = 0
+        ell = 1
         mval = data[ind[inds], 1]
+        # center and error of the cluster are updated as points are added
+        cluster = _IncrementalCluster(data[:,1], self.norm, self.weighted)
+        cluster.reset(ind[inds])
 
         last_sign = np.sign(mval)  # as soon as there is a cluster having a sign change in increments
         sign_change = False        # we have covered the point zero. from that on we should work
@@ -697,37 +2339,12 @@ class ABBA(object):
                 nrmerr = np.inf
             else:
                 # try to add another point to cluster
-                vals = data[np.sort(ind[inds:inde+2]), 1]
-
                 if np.sign(data[ind[inde+1], 1]) != last_sign: # added point has different sign
                     sign_change = True
 
                 ell = inde-inds+2 # number of points in new test cluster
                 old_mval = mval
-
-                if self.weighted and self.norm==1: # minimize accumulated increment errors in 1-norm
-                    wgts = np.arange(1,ell+1)
-                    wvals = np.cumsum(vals)/wgts
-                    mval = weighted_median(wvals, wgts)
-                    err = np.cumsum(vals) - np.arange(1,ell+1)*mval
-                    nrmerr = np.linalg.norm(err,1)
-
-                if self.weighted and self.norm==2: # minimize accumulated increment errors in 2-norm
-                    wgths = (ell+1)*ell/2 - np.cumsum(np.arange(0,ell))
-                    wvals = vals*wgths
-                    mval = np.sum(wvals)/((ell)*(ell+1)*(2*ell+1)/6)
-                    err = np.cumsum(vals) - np.arange(1,ell+1)*mval
-                    nrmerr = np.linalg.norm(err)**2
-
-                if not self.weighted and self.norm==1: # minimize nonaccumulated increment errors in 1-norm
-                    mval = np.median(vals)   # standard median
-                    err = vals - np.ones((1,ell))*mval
-                    nrmerr = np.linalg.norm(err,1)
-
-                if not self.weighted and self.norm==2: # minimize nonaccumulated increment errors in 2-norm
-                    mval = np.sum(vals)/ell  # standard mean
-                    err = vals - np.ones((1,ell))*mval
-                    nrmerr = np.linalg.norm(err)**2
+                mval, nrmerr = cluster.add(ind[inde+1], ell*self.digitization_tol)
 
             if nrmerr < ell*self.digitization_tol and inde+1<np.shape(data)[0]:   # accept enlarged cluster
                 inde += 1
@@ -735,7 +2352,10 @@ class ABBA(object):
                 mlen = np.mean(data[ind[inds:inde+1], 0])
                 for ii in ind[inds:inde+1]:
                     labels[ii] = k
-                centers = np.vstack((centers, np.array([mlen, old_mval])))
+                if inde > inds and not self.weighted and self.norm == 2:
+                    # running mean rounds differently from the mean of the members
+                    old_mval = cluster.exact(ind[inds:inde+1])[0]
+                centers.append([mlen, old_mval])
 
                 if self.symmetric and not sign_sorted and sign_change:
                     ind1 = ind[inde+1:]
@@ -750,7 +2370,161 @@ class ABBA(object):
 
                 if inds < np.shape(data)[0]:
                     mval = data[ind[inds], 1]
-        return labels, centers
+                    cluster.reset(ind[inds])
+        return labels, np.array(centers).reshape(-1, 2)
+
+    def _piece_batches(self, batches, batch_size=None):
+        """
+        Iterate over the lengths and increments of batches of pieces, in chunks
+        of batch_size rows if given, see digitize_stream.
+        """
+        iterable = batches() if callable(batches) else batches
+        if not callable(batches) and iter(batches) is batches:
+            raise ValueError('batches must be re-iterable, pass a list or a function returning an iterable.')
+
+        def chunks():
+            (buffer, size) = ([], 0)
+            for batch in iterable:
+                batch = np.asarray(batch, dtype=float).reshape(-1, np.shape(batch)[-1])[:,0:2]
+                if batch_size is None:
+                    yield batch
+                    continue
+                buffer.append(batch)
+                size += len(batch)
+                if size >= batch_size:
+                    batch = np.vstack(buffer)
+                    for start in range(0, size - batch_size + 1, batch_size):
+                        yield batch[start:start+batch_size]
+                    (buffer, size) = ([batch[start+batch_size:]], size - start - batch_size)
+            if batch_size is not None and size > 0:
+                yield np.vstack(buffer)
+        return chunks()
+
+    def digitize_stream(self, batches, batch_size=65536, n_epochs=1):
+        """
+        Convert compressed representation to symbolic representation using
+        mini-batch k-means, for collections of pieces too large to cluster at
+        once. The pieces are read in chunks of batch_size rows, so memory is
+        bounded by the batch size rather than the number of pieces. As in
+        digitize, the smallest number of clusters between min_k and max_k that
+        satisfies the bound from tol is used. For every k the centers are
+        initialised by KMeans on a uniform sample of batch_size pieces, refined
+        over n_epochs passes and checked against the bound in one more pass. The
+        labels are assigned in a final pass as the strings are consumed.
+        Parameters
+        ----------
+        batches - list or function
+            Arrays of pieces in compressed format, see compression. Either a list
+            or a function returning a new iterable of them on every call, since
+            the pieces are read more than once.
+        batch_size - int
+            Number of pieces passed to MiniBatchKMeans at a time.
+        n_epochs - int
+            Number of passes over the pieces to fit the centers for every k.
+        Returns
+        -------
+        strings - generator
+            Symbolic representation of every array of pieces in batches, using
+            unicode characters starting with character 'a'.
+        centers - numpy array
+            centers of clusters from clustering algorithm. Each centre corresponds
+            to character in string.
+        """
+        if self.c_method != 'kmeans':
+            raise ValueError('digitize_stream requires c_method = kmeans.')
+
+        # first pass, number of pieces, total length and standard deviations,
+        # and a uniform sample of batch_size pieces to initialise the centers
+        batch_size = max(batch_size, self.max_k)
+        rng = np.random.default_rng(0 if self.seed else None)
+        (n, length, mean, m2, sample) = (0, 0, np.zeros(2), np.zeros(2), np.zeros((0, 2)))
+        for data in self._piece_batches(batches, batch_size):
+            (m, batch_mean) = (len(data), np.mean(data, axis=0))
+            fill = min(batch_size - len(sample), m)
+            sample = np.vstack([sample, data[:fill]])
+            replace = rng.integers(0, n + np.arange(fill, m) + 1)
+            keep = replace < batch_size
+            sample[replace[keep]] = data[fill:][keep]
+            delta = batch_mean - mean
+            m2 += np.sum((data - batch_mean)**2, axis=0) + delta**2*n*m/(n + m)
+            mean += delta*m/(n + m)
+            n += m
+            length += np.sum(data[:,0])
+        if n < self.min_k:
+            raise ValueError('Number of pieces less than min_k.')
+        std = np.sqrt(m2/n)
+        std[std <= np.finfo(float).eps] = 1
+
+        # construct tol_s
+        s = .20
+        N = 1 + length
+        bound = ((6*(N-n))/(N*n))*((self.digitization_tol*self.digitization_tol)/(s*s))
+
+        # cluster the increments (scl = 0), the lengths (scl = inf) or both
+        if self.scl == 0:
+            (cols, scale) = ([1], np.array([1/std[1]]))
+        elif self.scl == np.inf:
+            (cols, scale) = ([0], np.array([1/std[0]]))
+        else:
+            (cols, scale) = ([0, 1], np.array([self.scl/std[0], 1/std[1]]))
+        sample = sample[:,cols]*scale
+
+        def scaled(size):
+            for data in self._piece_batches(batches, size):
+                yield data, data[:,cols]*scale
+
+        # Search values of k from min_k to max_k checking bound
+        max_k = max(min(self.max_k, n), self.min_k)
+        for k in range(self.min_k if self.digitization_tol != 0 else max_k, max_k+1):
+            # batch_size is at least max_k, so the sample has at least k pieces
+            init, _, _ = self._fit_kmeans(sample, k, bound)
+            kmeans = MiniBatchKMeans(n_clusters=k, init=init, n_init=1, random_state=0 if self.seed else None)
+            for epoch in range(n_epochs):
+                for data, x in scaled(batch_size):
+                    kmeans.partial_fit(x)
+            centers = kmeans.cluster_centers_
+
+            # per cluster statistics of the deviations from the centers
+            (count, total, dev, dev_sq, nonzero) = (np.zeros(k), np.zeros((k, 2)), np.zeros((k, len(cols))),
+                                                    np.zeros((k, len(cols))), np.zeros((k, len(cols)), dtype=bool))
+            for data, x in scaled(batch_size):
+                labels = kmeans.predict(x)
+                count += np.bincount(labels, minlength=k)
+                deviation = x - centers[labels]
+                for d in range(2):
+                    total[:,d] += np.bincount(labels, data[:,d], k)
+                for d in range(len(cols)):
+                    dev[:,d] += np.bincount(labels, deviation[:,d], k)
+                    dev_sq[:,d] += np.bincount(labels, deviation[:,d]**2, k)
+                    nonzero[:,d] |= np.bincount(labels, np.abs(deviation[:,d]) >= np.finfo(float).eps, k) > 0
+            size = np.maximum(count, 1)[:,None]
+            var = np.maximum(dev_sq/size - (dev/size)**2, 0)
+            var = var[nonzero & (count[:,None] > 1)]
+            error = np.max(var) if len(var) > 0 else 0
+            if self.verbose == 2: # pragma: no cover
+                print('k:', k)
+                print('error:', error, 'bound:', bound)
+            if error <= bound:
+                break
+        if self.verbose in [1, 2]: # pragma: no cover
+            print('Digitization: Using', k, 'symbols')
+
+        # build cluster centers, 1d clustering uses the mean of the other column
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c = np.where(count[:,None] > 0, total/count[:,None], np.nan)
+        c[:,cols] = centers/scale
+
+        # Order cluster centres so 'a' is the most populated cluster, and so
+        # forth, empty clusters are dropped
+        new_to_old = np.argsort(-count, kind='stable')[:np.count_nonzero(count)]
+        old_to_new = np.zeros(k, dtype=int)
+        old_to_new[new_to_old] = np.arange(len(new_to_old))
+
+        def strings():
+            for data, x in scaled(None):
+                labels = old_to_new[kmeans.predict(x)] if len(x) > 0 else []
+                yield ''.join([chr(97 + j) for j in labels])
+        return strings(), c[new_to_old, :]
 
     def inverse_digitize(self, string, centers):
         """
@@ -768,10 +2542,8 @@ class ABBA(object):
         pieces - np.array
             Time series in compressed format. See compression.
         """
-        pieces = np.empty([0,2])
-        for p in string:
-            pc = centers[ord(p)-97,:]
-            pieces = np.vstack([pieces, pc])
+        labels = np.fromiter((ord(p)-97 for p in string), dtype=int, count=len(string))
+        pieces = np.asarray(centers, dtype=float)[labels, :]
         return pieces
 
     def quantize(self, pieces):
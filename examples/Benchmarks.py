@@ -0,0 +1,499 @@
+import sys
+import os
+sys.path.append('./..')
+import numpy as np
+np.random.seed(0)
+from time import perf_counter
+from ABBA import ABBA
+
+
+def timeit(f, *args, repeat=3):
+    """ Return the best wall clock time of f(*args) over repeat runs, and its output. """
+    best = np.inf
+    for _ in range(repeat):
+        t0 = perf_counter()
+        out = f(*args)
+        best = min(best, perf_counter() - t0)
+    return best, out
+
+
+if __name__ == '__main__':
+    # pools in ABBA spawn their workers, which import this script
+
+    # Compression: naive norm recomputation against running sums
+    #-----------------------------------------------------------------------------#
+    print('Compression (norm = 2), naive vs linear')
+    frmt = "{:>10}{:>8}{:>10}{:>12}{:>12}{:>10}"
+    print(frmt.format('n', 'tol', 'pieces', 'naive [s]', 'linear [s]', 'speedup'))
+    for n in [10**3, 10**4, 10**5]:
+        for name, ts in [('random walk', np.cumsum(np.random.randn(n))),
+                         ('sine', np.sin(np.linspace(0, 20*np.pi, n)))]:
+            tol = 0.5
+            t_naive, p_naive = timeit(ABBA(tol=tol, verbose=0, compress_method='naive').compress, ts, repeat=1)
+            t_linear, p_linear = timeit(ABBA(tol=tol, verbose=0, compress_method='linear').compress, ts)
+            assert p_naive.shape == p_linear.shape and np.allclose(p_naive, p_linear)
+            print(frmt.format(n, tol, len(p_linear), '%.4f' % t_naive, '%.4f' % t_linear, '%.1f' % (t_naive/t_linear)), name)
+
+
+    # Compression and inverse digitization with many pieces
+    #-----------------------------------------------------------------------------#
+    print('Series with many pieces (preallocated piece buffer)')
+    frmt = "{:>10}{:>10}{:>15}{:>22}"
+    print(frmt.format('n', 'pieces', 'compress [s]', 'inverse_digitize [s]'))
+    for n in [10**4, 10**5, 10**6]:
+        ts = np.random.randn(n)
+        abba = ABBA(tol=0.01, verbose=0)
+        t_compress, pieces = timeit(abba.compress, ts, repeat=1)
+        centers = np.random.randn(26, 2)
+        string = ''.join(chr(97 + j) for j in np.random.randint(0, 26, len(pieces)))
+        t_inverse, _ = timeit(abba.inverse_digitize, string, centers)
+        print(frmt.format(n, len(pieces), '%.4f' % t_compress, '%.4f' % t_inverse))
+
+
+    # Compression (norm = 1): linear scan against galloping search
+    #-----------------------------------------------------------------------------#
+    print('Compression (norm = 1), naive vs gallop')
+    frmt = "{:>10}{:>8}{:>10}{:>12}{:>20}{:>20}"
+    print(frmt.format('n', 'tol', 'pieces', 'naive [s]', 'gallop exact [s]', 'gallop inexact [s]'))
+    for n in [10**4, 5*10**4]:
+        ts = np.sin(np.linspace(0, 20*np.pi, n))
+        for tol in [0.1, 0.5]:
+            t_naive, p_naive = timeit(ABBA(tol=tol, norm=1, verbose=0, compress_method='naive').compress, ts, repeat=1)
+            t_exact, p_exact = timeit(ABBA(tol=tol, norm=1, verbose=0, compress_method='gallop').compress, ts)
+            t_inexact, p_inexact = timeit(ABBA(tol=tol, norm=1, verbose=0, compress_method='gallop', exact=False).compress, ts)
+            assert p_naive.shape == p_exact.shape and np.allclose(p_naive, p_exact)
+            print(frmt.format(n, tol, len(p_naive), '%.4f' % t_naive, '%.4f' % t_exact,
+                              '%.4f (%d pieces)' % (t_inexact, len(p_inexact))))
+
+
+    # Compression with the compiled kernel, see makefile
+    #-----------------------------------------------------------------------------#
+    try:
+        from src.compress import compress_pieces
+        print('Compression (norm = 2), linear vs native')
+        frmt = "{:>10}{:>10}{:>12}{:>12}{:>22}"
+        print(frmt.format('n', 'pieces', 'linear [s]', 'native [s]', 'native [samples/s]'))
+        for n in [10**5, 10**6, 10**7]:
+            for name, ts in [('random walk', np.cumsum(np.random.randn(n))),
+                             ('sine', np.sin(np.linspace(0, 20*np.pi, n)))]:
+                t_linear, p_linear = timeit(ABBA(tol=0.5, verbose=0, compress_method='linear').compress, ts, repeat=1)
+                t_native, p_native = timeit(ABBA(tol=0.5, verbose=0, compress_method='native').compress, ts)
+                assert p_linear.shape == p_native.shape and np.allclose(p_linear, p_native)
+                print(frmt.format(n, len(p_native), '%.4f' % t_linear, '%.4f' % t_native, '%.3g' % (n/t_native)), name)
+    except ImportError:
+        print('Compression module unavailable, try running makefile.')
+
+
+    # Chunk parallel compression of a single time series
+    #-----------------------------------------------------------------------------#
+    print('Compression of one time series, serial vs chunk parallel (compress_method = linear)')
+    frmt = "{:>10}{:>8}{:>12}{:>14}{:>10}{:>18}"
+    print(frmt.format('n', 'n_jobs', 'serial [s]', 'parallel [s]', 'speedup', 'pieces (serial)'))
+    for n in [10**5, 10**6]:
+        ts = np.cumsum(np.random.randn(n))
+        abba = ABBA(tol=0.5, verbose=0, compress_method='linear')
+        t_serial, p_serial = timeit(abba.compress, ts, repeat=1)
+        for n_jobs in [2, 4, 8]:
+            t_parallel, p_parallel = timeit(abba.compress_parallel, ts, n_jobs, repeat=1)
+            print(frmt.format(n, n_jobs, '%.4f' % t_serial, '%.4f' % t_parallel, '%.1f' % (t_serial/t_parallel),
+                              '%d (%+d)' % (len(p_serial), len(p_parallel) - len(p_serial))))
+
+
+    # Searching the tolerance for a target compression ratio
+    #-----------------------------------------------------------------------------#
+    print('Tolerance for 20% compression, grid search as in paper/performance_profiles vs compress_target')
+    def grid_search(ts, norm):
+        for tol in [0.05*i for i in range(1, 11)]:
+            pieces = ABBA(tol=tol, norm=norm, verbose=0, compress_method='naive').compress(ts)
+            if len(pieces) <= len(ts)/5:
+                break
+        return pieces, tol
+
+    frmt = "{:>6}{:>6}{:>10}{:>10}{:>12}{:>10}{:>8}"
+    print(frmt.format('n', 'norm', 'grid [s]', 'grid tol', 'target [s]', 'tol', 'pieces'))
+    for n in [1000, 5000]:
+        ts = np.cumsum(np.random.randn(n))
+        ts = (ts - np.mean(ts))/np.std(ts)
+        for norm in [1, 2]:
+            t_grid, (p_grid, tol_grid) = timeit(grid_search, ts, norm, repeat=1)
+            abba = ABBA(tol=0.05, norm=norm, verbose=0)
+            t_target, (p_target, tol_target) = timeit(abba.compress_target, ts, None, 0.2, repeat=1)
+            print(frmt.format(n, norm, '%.3f' % t_grid, '%.2f' % tol_grid, '%.3f' % t_target, '%.4f' % tol_target, len(p_target)))
+
+
+    # Compressing at several tolerances
+    #-----------------------------------------------------------------------------#
+    print('Compression at tolerances 0.05, 0.1, ..., 0.5, one compress per tolerance vs compress_hierarchy')
+    tols = [0.05*i for i in range(1, 11)]
+    frmt = "{:>8}{:>6}{:>16}{:>18}"
+    print(frmt.format('n', 'norm', 'compress [s]', 'hierarchy [s]'))
+    for n in [10**4, 5*10**4]:
+        ts = np.cumsum(np.random.randn(n))
+        ts = (ts - np.mean(ts))/np.std(ts)
+        for norm in [1, 2]:
+            abba = ABBA(tol=0.05, norm=norm, verbose=0)
+            t_grid, _ = timeit(lambda: [ABBA(tol=tol, norm=norm, verbose=0).compress(ts) for tol in tols], repeat=1)
+            t_hierarchy, _ = timeit(abba.compress_hierarchy, ts, tols, repeat=1)
+            print(frmt.format(n, norm, '%.3f' % t_grid, '%.3f' % t_hierarchy))
+
+
+    # Coarse-to-fine search in a pyramid
+    #-----------------------------------------------------------------------------#
+    print('Pattern search at the finest level, scan of the reconstruction vs coarse-to-fine search')
+    frmt = "{:>8}{:>12}{:>14}{:>10}"
+    print(frmt.format('n', 'scan [s]', 'pyramid [s]', 'matches'))
+    for n in [10**4, 10**5]:
+        ts = np.cumsum(np.random.randn(n))
+        ts = (ts - np.mean(ts))/np.std(ts)
+        pyramid = ABBA(verbose=0).pyramid(ts, [0.05, 0.1, 0.2, 0.4])
+        query = ts[n//2:n//2+100]
+        def scan():
+            windows = np.lib.stride_tricks.sliding_window_view(pyramid.reconstruct(), len(query))
+            return np.where(np.max(np.abs(windows - query), axis=1) <= 0.1)[0]
+        pyramid.reconstruct()
+        t_scan, _ = timeit(scan)
+        t_pyramid, starts = timeit(pyramid.search, query, 0.1)
+        print(frmt.format(n, '%.4f' % t_scan, '%.4f' % t_pyramid, len(starts)))
+
+
+    # Search for the number of clusters with sklearn KMeans
+    #-----------------------------------------------------------------------------#
+    print('Digitization with scl = 1, searching k = min_k, ..., max_k for each k_search')
+    frmt = "{:>6}{:>8}{:>10}{:>8}{:>10}{:>6}"
+    print(frmt.format('tol', 'pieces', 'k_search', 'n_init', 'time [s]', 'k'))
+    ts = np.cumsum(np.random.randn(5000))
+    ts = (ts - np.mean(ts))/np.std(ts)
+    for tol in [0.1, 0.2, 0.4]:
+        pieces = ABBA(tol=tol, verbose=0).compress(ts)
+        for k_search, n_init in [('linear', None), ('linear', 1), ('warm', None), ('bracket', None), ('bracket', 1)]:
+            abba = ABBA(tol=tol, scl=1, verbose=0, k_search=k_search, n_init=n_init)
+            t, (string, centers) = timeit(abba.digitize, pieces, repeat=1)
+            print(frmt.format(tol, len(pieces), k_search, str(n_init), '%.3f' % t, len(centers)))
+
+
+    # Optimal 1-d clustering without the compiled Ckmeans module
+    #-----------------------------------------------------------------------------#
+    print('Clustering of increments (scl = 0), compiled Ckmeans vs NumPy kmeans_1d_dp vs sklearn KMeans sweep')
+    from src.kmeans_1d import kmeans_1d_dp as numpy_kmeans_1d_dp
+    try:
+        from src.Ckmeans import kmeans_1d_dp, double_vector
+    except ImportError:
+        kmeans_1d_dp = None
+    frmt = "{:>8}{:>12}{:>12}{:>12}{:>6}"
+    print(frmt.format('pieces', 'C++ [s]', 'NumPy [s]', 'sklearn [s]', 'k'))
+    for n in [100, 1000, 5000]:
+        x = np.random.randn(n)
+        bound = 1e-3
+        abba = ABBA(verbose=0, min_k=2, max_k=100)
+        t_numpy, output = timeit(numpy_kmeans_1d_dp, x, 2, 100, bound, repeat=1)
+        t_sklearn, _ = timeit(abba._select_k, x.reshape(-1, 1), bound, repeat=1)
+        t_compiled = np.nan
+        if kmeans_1d_dp is not None:
+            t_compiled, _ = timeit(kmeans_1d_dp, double_vector(x), 2, 100, bound, 'linear', repeat=1)
+        print(frmt.format(n, '%.4f' % t_compiled, '%.4f' % t_numpy, '%.4f' % t_sklearn, output.Kopt))
+
+
+    # Cluster statistics
+    #-----------------------------------------------------------------------------#
+    print('Cluster statistics with k = 100 and n = 1e5, loop over clusters vs grouped reductions')
+    def max_cluster_var_loop(pieces, labels, centers, k):
+        # previous implementation of ABBA._max_cluster_var
+        d1 = [0]
+        d2 = [0]
+        for i in range(k):
+            matrix = ((pieces[np.where(labels==i), :] - centers[i])[0]).T
+            if not np.all(np.abs(matrix[0,:]) < np.finfo(float).eps):
+                if len(matrix[0,:]) > 1:
+                    d1.append(np.var(matrix[0,:]))
+            if matrix.shape[0] == 2:
+                if not np.all(np.abs(matrix[1,:]) < np.finfo(float).eps):
+                    if len(matrix[1,:]) > 1:
+                        d2.append(np.var(matrix[1,:]))
+        return np.max(d1), np.max(d2)
+
+    def build_centers_loop(pieces, labels, c1, k, col):
+        # previous implementation of ABBA._build_centers
+        c2 = []
+        for i in range(k):
+            location = np.where(labels==i)[0]
+            if location.size == 0:
+                c2.append(np.nan)
+            else:
+                c2.append(np.mean(pieces[location, col]))
+        if col == 0:
+            return (np.array((c2, c1))).T
+        else:
+            return (np.array((c1, c2))).T
+
+    n, k = 10**5, 100
+    pieces = np.random.randn(n, 2)
+    labels = np.random.randint(0, k, n)
+    centers = np.random.randn(k, 2)
+    abba = ABBA(verbose=0)
+    frmt = "{:>18}{:>12}{:>14}{:>10}"
+    print(frmt.format('', 'loop [s]', 'grouped [s]', 'speedup'))
+    t_loop, var_loop = timeit(max_cluster_var_loop, pieces, labels, centers, k)
+    t_grouped, var_grouped = timeit(abba._max_cluster_var, pieces, labels, centers, k)
+    assert np.allclose(var_loop, var_grouped)
+    print(frmt.format('_max_cluster_var', '%.4f' % t_loop, '%.4f' % t_grouped, '%.1f' % (t_loop/t_grouped)))
+    t_loop, c_loop = timeit(build_centers_loop, pieces, labels, centers[:,1], k, 0)
+    t_grouped, c_grouped = timeit(abba._build_centers, pieces, labels, centers[:,1], k, 0)
+    assert np.allclose(c_loop, c_grouped)
+    print(frmt.format('_build_centers', '%.4f' % t_loop, '%.4f' % t_grouped, '%.1f' % (t_loop/t_grouped)))
+
+
+    # Incremental digitization
+    #-----------------------------------------------------------------------------#
+    print('Incremental digitization, recomputing each cluster (previous) vs incremental statistics')
+    def digitize_incremental_recompute(abba, data):
+        # previous implementation of ABBA.digitize_incremental, without the
+        # symmetric reordering
+        def weighted_median(data, weights):
+            data, weights = np.array(data).squeeze(), np.array(weights).squeeze()
+            s_data, s_weights = map(np.array, zip(*sorted(zip(data, weights))))
+            midpoint = 0.5 * sum(s_weights)
+            if any(weights > midpoint):
+                return (data[weights == np.max(weights)])[0]
+            cs_weights = np.cumsum(s_weights)
+            idx = np.where(cs_weights <= midpoint)[0][-1]
+            if cs_weights[idx] == midpoint:
+                return np.mean(s_data[idx:idx+2])
+            return s_data[idx+1]
+
+        ind = np.argsort(data[:,1])
+        labels = [-1]*len(data)
+        (k, inds, inde) = (0, 0, 0)
+        mval = data[ind[0], 1]
+        while inde < len(data):
+            if inde == len(data)-1:
+                (old_mval, nrmerr) = (mval, np.inf)
+            else:
+                vals = data[np.sort(ind[inds:inde+2]), 1]
+                ell = inde-inds+2
+                old_mval = mval
+                if abba.weighted and abba.norm == 1:
+                    wgts = np.arange(1, ell+1)
+                    mval = weighted_median(np.cumsum(vals)/wgts, wgts)
+                    nrmerr = np.linalg.norm(np.cumsum(vals) - wgts*mval, 1)
+                elif abba.weighted:
+                    wgths = (ell+1)*ell/2 - np.cumsum(np.arange(0, ell))
+                    mval = np.sum(vals*wgths)/((ell)*(ell+1)*(2*ell+1)/6)
+                    nrmerr = np.linalg.norm(np.cumsum(vals) - np.arange(1, ell+1)*mval)**2
+                elif abba.norm == 1:
+                    mval = np.median(vals)
+                    nrmerr = np.linalg.norm(vals - np.ones((1, ell))*mval, 1)
+                else:
+                    mval = np.sum(vals)/ell
+                    nrmerr = np.linalg.norm(vals - np.ones((1, ell))*mval)**2
+            if nrmerr < ell*abba.digitization_tol and inde+1 < len(data):
+                inde += 1
+            else:
+                for ii in ind[inds:inde+1]:
+                    labels[ii] = k
+                (k, inds, inde) = (k+1, inde+1, inde+1)
+                if inds < len(data):
+                    mval = data[ind[inds], 1]
+        return labels
+
+    frmt = "{:>8}{:>6}{:>8}{:>14}{:>16}{:>8}"
+    print(frmt.format('pieces', 'norm', 'weighted', 'previous [s]', 'incremental [s]', 'k'))
+    for n in [1000, 5000]:
+        data = np.column_stack([np.random.randint(1, 10, n), np.random.randn(n)]).astype(float)
+        for weighted in [False, True]:
+            for norm in [1, 2]:
+                tol = 0.05 if not weighted else 0.02
+                for tol in [tol, 10*tol]:
+                    abba = ABBA(tol=tol, verbose=0, c_method='incremental', norm=norm, weighted=weighted, symmetric=False)
+                    t_previous, labels_previous = timeit(digitize_incremental_recompute, abba, data, repeat=1)
+                    t_incremental, (labels, centers) = timeit(abba.digitize_incremental, data.copy(), repeat=1)
+                    assert labels_previous == list(labels)
+                    print(frmt.format(n, norm, str(weighted), '%.3f' % t_previous, '%.3f' % t_incremental, len(centers)))
+
+
+    # Shared codebook
+    #-----------------------------------------------------------------------------#
+    print('Symbolic representation of 100 time series, clustering each vs assigning to a fitted codebook')
+    corpus = [np.cumsum(np.random.randn(1000)) for i in range(100)]
+    corpus = [(ts - np.mean(ts))/np.std(ts) for ts in corpus]
+    frmt = "{:>6}{:>14}{:>10}{:>16}"
+    print(frmt.format('scl', 'transform [s]', 'fit [s]', 'codebook [s]'))
+    for scl in [0, 1]:
+        abba = ABBA(tol=0.1, scl=scl, verbose=0)
+        t_transform, _ = timeit(lambda: [abba.transform(ts) for ts in corpus], repeat=1)
+        t_fit, _ = timeit(abba.fit, corpus[:10], repeat=1)
+        t_codebook, _ = timeit(lambda: [abba.transform(ts) for ts in corpus], repeat=1)
+        print(frmt.format(scl, '%.3f' % t_transform, '%.3f' % t_fit, '%.3f' % t_codebook))
+
+
+    # Streaming digitization
+    #-----------------------------------------------------------------------------#
+    print('Digitization of the pooled pieces of 50 time series, in memory vs in mini-batches')
+    import tracemalloc
+    corpus = [np.cumsum(np.random.randn(5000)) for i in range(50)]
+    corpus = [(ts - np.mean(ts))/np.std(ts) for ts in corpus]
+    abba = ABBA(tol=[0.1, 2], scl=1, verbose=0)
+    batches = [abba.compress(ts) for ts in corpus]
+    frmt = "{:>12}{:>10}{:>10}{:>14}"
+    print(frmt.format('method', 'time [s]', 'symbols', 'peak [MB]'))
+    for method, batch_size in [('digitize', None), ('stream', 1000), ('stream', 5000)]:
+        tracemalloc.start()
+        if method == 'digitize':
+            t, (string, centers) = timeit(lambda: abba.digitize(np.vstack(batches)), repeat=1)
+        else:
+            def stream():
+                strings, centers = abba.digitize_stream(batches, batch_size=batch_size)
+                return ''.join(strings), centers
+            t, (string, centers) = timeit(stream, repeat=1)
+        peak = tracemalloc.get_traced_memory()[1]/2**20
+        tracemalloc.stop()
+        print(frmt.format(method if batch_size is None else method + ' ' + str(batch_size), '%.2f' % t, len(centers), '%.1f' % peak))
+
+
+    # Parallel k search
+    #-----------------------------------------------------------------------------#
+    print('Digitization with scl = 1, fitting k_jobs values of k at once')
+    ts = np.cumsum(np.random.randn(50000))
+    ts = (ts - np.mean(ts))/np.std(ts)
+    frmt = "{:>8}{:>10}{:>10}{:>10}"
+    print(frmt.format('k_jobs', 'backend', 'time [s]', 'symbols'))
+    for k_jobs, k_backend in [(1, 'thread'), (4, 'thread'), (os.cpu_count(), 'thread'), (4, 'process')]:
+        abba = ABBA(tol=[0.05, 0.5], scl=1, max_k=200, verbose=0, k_jobs=k_jobs, k_backend=k_backend)
+        pieces = abba.compress(ts)
+        t, (string, centers) = timeit(abba.digitize, pieces, repeat=1)
+        print(frmt.format(k_jobs, k_backend, '%.3f' % t, len(centers)))
+
+
+    # Deduplicated digitization
+    #-----------------------------------------------------------------------------#
+    print('Digitization of 50000 quantised pieces, clustering every piece vs distinct pieces with weights')
+    pieces = np.vstack([np.random.randint(1, 6, 50000), np.round(np.random.randn(50000)*4)/4, np.zeros(50000)]).T
+    print('Distinct pieces:', len(np.unique(pieces[:,:2], axis=0)))
+    frmt = "{:>6}{:>12}{:>12}{:>10}"
+    print(frmt.format('scl', 'all [s]', 'dedup [s]', 'symbols'))
+    for scl in [0.5, 1, 3]:
+        abba = ABBA(tol=[0.1, 0.5], scl=scl, verbose=0)
+        t_all, (string, centers) = timeit(abba.digitize, pieces, repeat=1)
+        abba = ABBA(tol=[0.1, 0.5], scl=scl, verbose=0, dedup=True)
+        t_dedup, (string_, centers_) = timeit(abba.digitize, pieces, repeat=1)
+        print(frmt.format(scl, '%.3f' % t_all, '%.3f' % t_dedup, '%d/%d' % (len(centers), len(centers_))))
+
+
+    # Ckmeans buffers
+    #-----------------------------------------------------------------------------#
+    print('Compiled Ckmeans called through std::vector conversion vs NumPy buffers')
+    try:
+        from src.Ckmeans import kmeans_1d_dp, kmeans_1d_dp_buffer, double_vector
+        frmt = "{:>10}{:>12}{:>12}"
+        print(frmt.format('n', 'vector [s]', 'buffer [s]'))
+        for n in [10**4, 10**5, 10**6]:
+            x = np.random.randn(n)
+            def vector():
+                output = kmeans_1d_dp(double_vector(x), 2, 4, 0.01, 'linear')
+                return np.array(output.cluster), np.array(output.centres)
+            def buffer():
+                labels = np.empty(n, dtype=np.intc)
+                centres = np.empty(4)
+                k = kmeans_1d_dp_buffer(x, 2, 4, 0.01, 'linear', labels, centres)
+                return labels, centres[:k]
+            t_vector, (labels, centres) = timeit(vector)
+            t_buffer, (labels_, centres_) = timeit(buffer)
+            assert np.array_equal(labels, labels_) and np.array_equal(centres, centres_)
+            print(frmt.format(n, '%.4f' % t_vector, '%.4f' % t_buffer))
+    except ImportError:
+        print('Ckmeans module unavailable, run make.')
+
+
+    # Batched Ckmeans
+    #-----------------------------------------------------------------------------#
+    print('Digitization of 500 time series with scl = 0, one at a time, in a thread pool and in one batched call')
+    from concurrent.futures import ThreadPoolExecutor
+    corpus = [np.cumsum(np.random.randn(np.random.randint(200, 2000))) for i in range(500)]
+    corpus = [(ts - np.mean(ts))/np.std(ts) for ts in corpus]
+    abba = ABBA(tol=0.1, scl=0, verbose=0)
+    pieces_list = [abba.compress(ts) for ts in corpus]
+    def threaded():
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            return list(executor.map(abba.digitize, pieces_list))
+    t_loop, outputs = timeit(lambda: [abba.digitize(pieces) for pieces in pieces_list], repeat=1)
+    t_threads, _ = timeit(threaded, repeat=1)
+    t_batch, (strings, centers) = timeit(abba.digitize_batch, pieces_list, repeat=1)
+    assert strings == [out[0] for out in outputs]
+    print('loop: %.3fs, threads: %.3fs, digitize_batch: %.3fs' % (t_loop, t_threads, t_batch))
+
+
+    # Digitization tolerance sweep
+    #-----------------------------------------------------------------------------#
+    print('Digitization with scl = 0 for 20 tolerances, digitize per tolerance vs digitize_sweep')
+    ts = np.cumsum(np.random.randn(100000))
+    ts = (ts - np.mean(ts))/np.std(ts)
+    tols = list(np.linspace(0.05, 1, 20))
+    abba = ABBA(tol=0.05, scl=0, verbose=0)
+    pieces = abba.compress(ts)
+    def repeated():
+        return [ABBA(tol=[0.05, tol], scl=0, verbose=0).digitize(pieces) for tol in tols]
+    t_repeated, outputs = timeit(repeated, repeat=1)
+    t_sweep, (strings, centers) = timeit(abba.digitize_sweep, pieces, tols, repeat=1)
+    assert strings == [out[0] for out in outputs]
+    print('pieces: %d, digitize: %.3fs, digitize_sweep: %.3fs' % (len(pieces), t_repeated, t_sweep))
+
+
+    # Ckmeans fill methods and memory
+    #-----------------------------------------------------------------------------#
+    print('Compiled Ckmeans with K = 50 clusters, runtime and peak memory of the call per fill method, each in a fresh process (Linux)')
+    import subprocess
+    code = """
+import numpy as np
+from time import perf_counter
+from src.Ckmeans import kmeans_1d_dp_buffer
+def status(key):
+    # resident memory in MB from /proc on Linux
+    return [int(l.split()[1])/2**10 for l in open('/proc/self/status') if l.startswith(key)][0]
+x = np.random.RandomState(0).randn(%d)
+labels, centres = np.empty(len(x), dtype=np.intc), np.empty(50)
+before = status('VmRSS')
+open('/proc/self/clear_refs', 'w').write('5') # reset the peak to the current memory
+t0 = perf_counter()
+kmeans_1d_dp_buffer(x, 50, 50, 0.0, '%s', labels, centres)
+print(perf_counter() - t0, status('VmHWM') - before)
+"""
+    frmt = "{:>10}{:>12}{:>12}{:>12}{:>22}"
+    print(frmt.format('n', 'method', 'time [s]', 'peak [MB]', 'full S and J [MB]'))
+    for n in [10**4, 10**5, 5*10**5]:
+        for method in ['auto', 'linear', 'loglinear', 'quadratic']:
+            if method == 'quadratic' and n > 10**4:
+                continue
+            run = subprocess.run([sys.executable, '-c', code % (n, method)], cwd='..', capture_output=True, text=True)
+            if run.returncode != 0:
+                print('Ckmeans module unavailable, run make.')
+                break
+            t, peak = map(float, run.stdout.split())
+            print(frmt.format(n, method, '%.3f' % t, '%.1f' % peak, '%.1f' % (50*n*16/2**20)))
+
+
+    # Ckmeans on several threads
+    #-----------------------------------------------------------------------------#
+    print('Compiled Ckmeans of 2*10^6 elements with K = 20 clusters per number of OpenMP threads, requires make clean && make OPENMP=1')
+    code = """
+import hashlib, numpy as np
+from time import perf_counter
+from src.Ckmeans import kmeans_1d_dp_buffer
+x = np.random.RandomState(0).randn(2*10**6)
+labels, centres = np.empty(len(x), dtype=np.intc), np.empty(20)
+t0 = perf_counter()
+kmeans_1d_dp_buffer(x, 2, 20, 1e-4, '%s', labels, centres)
+print(perf_counter() - t0, hashlib.md5(labels.tobytes() + centres.tobytes()).hexdigest())
+"""
+    frmt = "{:>12}{:>10}{:>12}"
+    print(frmt.format('method', 'threads', 'time [s]'))
+    for method in ['auto', 'linear']:
+        digests = set()
+        for threads in sorted(set([1, 2, 4, os.cpu_count()])):
+            env = dict(os.environ, OMP_NUM_THREADS=str(threads))
+            run = subprocess.run([sys.executable, '-c', code % method], cwd='..', env=env, capture_output=True, text=True)
+            if run.returncode != 0:
+                print('Ckmeans module unavailable, run make.')
+                break
+            t, digest = run.stdout.split()
+            digests.add(digest)
+            print(frmt.format(method, threads, '%.3f' % float(t)))
+        assert len(digests) <= 1, 'clusters differ between numbers of threads'
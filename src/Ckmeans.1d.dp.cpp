@@ -10,6 +10,21 @@ Modified version of the C++ code from https://cran.r-project.org/web/packages/Ck
 #include <vector>
 #include <cassert>
 #include <cstring>
+#include <atomic>
+#include <thread>
+#ifdef _OPENMP
+#include <omp.h>
+#include <pthread.h>
+
+// OpenMP threads cannot be started in a process forked from one that already
+// ran a parallel region, as in the process pools of ABBA, so forked processes
+// fill the tables on one thread
+static void serial_after_fork()
+{
+  omp_set_num_threads(1);
+}
+static const int fork_handler = pthread_atfork(NULL, NULL, serial_after_fork);
+#endif
 
 template <class ForwardIterator>
 size_t numberOfUnique(ForwardIterator first, ForwardIterator last)
@@ -29,35 +44,11 @@ size_t numberOfUnique(ForwardIterator first, ForwardIterator last)
   return nUnique;
 }
 
-static const double * px;
-bool compi(size_t i, size_t j)
-{
-  return px[i] < px[j];
-}
-
-
-Output kmeans_1d_dp(std::vector<double> x_v, size_t Kmin, size_t Kmax,
-                                  double var, const std::string & method)
+// Sort x[0], ..., x[N-1] into x_sorted, with x_sorted[i] = x[order[i]]
+static void sort_1d(const double* x, const size_t N,
+                    std::vector<size_t> & order, std::vector<double> & x_sorted)
 {
-  const size_t N = x_v.size();
-  const double* x = &x_v[0];
-
-  int* cluster = new int[N];
-  double* centres = new double[Kmax];
-  double* withinss = new double[Kmax];
-  double* size = new double[Kmax];
-  double* BIC = new double[Kmax-Kmin+1];
-
-
-  // Input:
-  //  x -- an array of double precision numbers, not necessarily sorted
-  //  Kmin -- the minimum number of clusters expected
-  //  Kmax -- the maximum number of clusters expected
-  // NOTE: All vectors in this program is considered starting at position 0.
-
-
-  // Sort x
-  std::vector<size_t> order(N);
+  order.resize(N);
   for(size_t i=0; i<order.size(); ++i) {
     order[i] = i;
   }
@@ -68,15 +59,36 @@ Output kmeans_1d_dp(std::vector<double> x_v, size_t Kmin, size_t Kmax,
       break;
     }
   }
-  std::vector<double> x_sorted(x, x+N);
+  x_sorted.assign(x, x+N);
   if(! is_sorted) {
-    px = x;
-    std::sort(order.begin(), order.end(), compi);
+    // compare through x rather than a global so vectors can be sorted in threads
+    std::sort(order.begin(), order.end(),
+              [x](size_t i, size_t j) { return x[i] < x[j]; });
 
     for(size_t i=0ul; i<order.size(); ++i) {
       x_sorted[i] = x[order[i]];
     }
   }
+}
+
+// Cluster x[0], ..., x[N-1], writing the cluster of every element and the
+// centres, within sums of squares and sizes of the clusters, returns Kopt
+static size_t cluster_1d(const double* x, const size_t N, size_t Kmin, size_t Kmax,
+                         double var, const std::string & method,
+                         int* cluster, double* centres, double* withinss,
+                         double* size, double* BIC)
+{
+  // Input:
+  //  x -- an array of double precision numbers, not necessarily sorted
+  //  Kmin -- the minimum number of clusters expected
+  //  Kmax -- the maximum number of clusters expected
+  // NOTE: All vectors in this program is considered starting at position 0.
+
+
+  // Sort x
+  std::vector<size_t> order;
+  std::vector<double> x_sorted;
+  sort_1d(x, N, order, x_sorted);
 
   // Find number of unique values
   const size_t nUnique = numberOfUnique(x_sorted.begin(), x_sorted.end());
@@ -88,8 +100,8 @@ Output kmeans_1d_dp(std::vector<double> x_v, size_t Kmin, size_t Kmax,
 
   if(nUnique > 1) { // The case when not all elements are equal.
 
-    std::vector< std::vector< double > > S( Kmax, std::vector<double>(N) );
-    std::vector< std::vector< size_t > > J( Kmax, std::vector<size_t>(N) );
+    std::vector< std::vector< double > > S(Kmax);
+    std::vector< std::vector<dp_index> > J( Kmax, std::vector<dp_index>(N) );
 
     fill_dp_matrix(x_sorted, S, J, method);
 
@@ -120,6 +132,23 @@ Output kmeans_1d_dp(std::vector<double> x_v, size_t Kmin, size_t Kmax,
     withinss[0] = 0.0;
     size[0] = N;
   }
+  return Kopt;
+}
+
+Output kmeans_1d_dp(std::vector<double> x_v, size_t Kmin, size_t Kmax,
+                                  double var, const std::string & method)
+{
+  const size_t N = x_v.size();
+  const double* x = &x_v[0];
+
+  int* cluster = new int[N];
+  double* centres = new double[Kmax];
+  double* withinss = new double[Kmax](); // accumulated by backtrack
+  double* size = new double[Kmax];
+  double* BIC = new double[Kmax-Kmin+1];
+
+  size_t Kopt = cluster_1d(x, N, Kmin, Kmax, var, method,
+                           cluster, centres, withinss, size, BIC);
 
   std::vector<int> cluster_v(cluster, cluster+N);
   std::vector<double> centres_v(centres, centres+Kopt);
@@ -138,3 +167,158 @@ Output kmeans_1d_dp(std::vector<double> x_v, size_t Kmin, size_t Kmax,
   return output;
 
 }  //end of kmeans_1d_dp()
+
+size_t kmeans_1d_dp_buffer(const double* in_array, size_t in_size,
+                           size_t Kmin, size_t Kmax, double var,
+                           const std::string & method,
+                           int* out_labels, size_t out_labels_size,
+                           double* out_array, size_t out_size)
+{
+  if(in_size == 0 || Kmin > Kmax || out_labels_size < in_size
+       || out_size < std::min(in_size, Kmax)) {
+    return 0;
+  }
+
+  std::vector<double> withinss(Kmax, 0.0);
+  std::vector<double> size(Kmax);
+  std::vector<double> BIC(Kmax-Kmin+1);
+
+  return cluster_1d(in_array, in_size, Kmin, Kmax, var, method,
+                    out_labels, out_array, &withinss[0], &size[0], &BIC[0]);
+}  //end of kmeans_1d_dp_buffer()
+
+int kmeans_1d_dp_batch(const double* in_array, size_t in_size,
+                       const int* offsets, size_t offsets_size,
+                       const int* kmin, size_t kmin_size,
+                       const int* kmax, size_t kmax_size,
+                       const double* var, size_t var_size,
+                       const std::string & method, int n_threads,
+                       int* out_labels, size_t out_labels_size,
+                       double* out_array, size_t out_size,
+                       int* out_k, size_t out_k_size)
+{
+  if(offsets_size < 1
+       || (method != "linear" && method != "loglinear" && method != "quadratic"
+           && method != "auto")) {
+    return -1;
+  }
+  const size_t M = offsets_size - 1;
+  if(kmin_size != M || kmax_size != M || var_size != M || out_k_size < M
+       || out_labels_size < in_size || out_size < in_size) {
+    return -1;
+  }
+  for(size_t m = 0; m < M; ++m) {
+    if(offsets[m] < 0 || offsets[m] > offsets[m+1] || (size_t) offsets[m+1] > in_size
+         || kmin[m] < 1 || kmin[m] > kmax[m]) {
+      return -1;
+    }
+  }
+
+  // vectors are handed out to the threads one at a time
+  std::atomic<size_t> next(0);
+  auto work = [&]() {
+#ifdef _OPENMP
+    // the vectors are already spread over the threads, so each is clustered
+    // by one thread only
+    const int omp_threads = omp_get_max_threads();
+    if(n_threads > 1) {
+      omp_set_num_threads(1);
+    }
+#endif
+    for(size_t m = next++; m < M; m = next++) {
+      const size_t N = (size_t) (offsets[m+1] - offsets[m]);
+      if(N == 0) {
+        out_k[m] = 0;
+        continue;
+      }
+      const size_t Kmax = (size_t) kmax[m];
+      std::vector<double> withinss(Kmax, 0.0);
+      std::vector<double> size(Kmax);
+      std::vector<double> BIC(Kmax-kmin[m]+1);
+      out_k[m] = (int) cluster_1d(in_array + offsets[m], N, (size_t) kmin[m], Kmax,
+                                  var[m], method, out_labels + offsets[m],
+                                  out_array + offsets[m], &withinss[0], &size[0], &BIC[0]);
+    }
+#ifdef _OPENMP
+    omp_set_num_threads(omp_threads);
+#endif
+  };
+
+  if(n_threads < 1) {
+    n_threads = (int) std::thread::hardware_concurrency();
+  }
+  n_threads = (int) std::min((size_t) std::max(n_threads, 1), std::max(M, (size_t) 1));
+  std::vector<std::thread> threads;
+  for(int i = 1; i < n_threads; ++i) {
+    threads.push_back(std::thread(work));
+  }
+  work();
+  for(size_t i = 0; i < threads.size(); ++i) {
+    threads[i].join();
+  }
+  return (int) M;
+}  //end of kmeans_1d_dp_batch()
+
+Ckmeans1d::Ckmeans1d(const double* in_array, size_t in_size, size_t Kmax,
+                     const std::string & method)
+{
+  N = in_size;
+  nUnique = 0;
+  this->Kmax = 0;
+  if(N == 0) {
+    return;
+  }
+  sort_1d(in_array, N, order, x_sorted);
+  nUnique = numberOfUnique(x_sorted.begin(), x_sorted.end());
+  this->Kmax = std::min(nUnique, Kmax);
+
+  if(nUnique > 1 && this->Kmax > 0) {
+    // S is only needed while filling J
+    std::vector< std::vector< double > > S(this->Kmax);
+    J.assign(this->Kmax, std::vector<dp_index>(N));
+    fill_dp_matrix(x_sorted, S, J, method);
+  }
+}
+
+size_t Ckmeans1d::select(double var, size_t Kmin) const
+{
+  if(nUnique <= 1) {
+    return nUnique;
+  }
+  Kmin = std::min(nUnique, Kmin);
+  std::vector<double> BIC(Kmax >= Kmin ? Kmax-Kmin+1 : 1);
+  return select_levels(x_sorted, J, Kmin, Kmax, &BIC[0], var);
+}
+
+size_t Ckmeans1d::cluster(size_t K, int* out_labels, size_t out_labels_size,
+                          double* out_array, size_t out_size) const
+{
+  if(N == 0 || K < 1 || K > std::max(Kmax, (size_t) 1)
+       || out_labels_size < N || out_size < K) {
+    return 0;
+  }
+  if(nUnique <= 1) {  // A single cluster that contains all elements
+    for(size_t i=0; i<N; ++i) {
+      out_labels[i] = 0;
+    }
+    out_array[0] = x_sorted[0];
+    return 1;
+  }
+
+  // Backtrack the first K rows of J as in backtrack
+  size_t cluster_right = N-1;
+  size_t cluster_left;
+  for(int q = ((int)K)-1; q >= 0; --q) {
+    cluster_left = J[q][cluster_right];
+    double sum = 0.0;
+    for(size_t i = cluster_left; i <= cluster_right; ++i) {
+      out_labels[order[i]] = q;
+      sum += x_sorted[i];
+    }
+    out_array[q] = sum / (cluster_right-cluster_left+1);
+    if(q > 0) {
+      cluster_right = cluster_left - 1;
+    }
+  }
+  return K;
+}
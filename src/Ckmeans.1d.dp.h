@@ -6,6 +6,15 @@ Modified version of the C++ code from https://cran.r-project.org/web/packages/Ck
 #include <vector>
 #include <string>
 
+/* Type of the entries of the backtrack matrix J, which hold indices into the
+ sorted data, 32 bits wide to halve the memory of the K x N matrix. */
+typedef unsigned int dp_index;
+
+/* Smallest number of elements worth splitting across threads when the module
+ is built with OpenMP (make OPENMP=1). Every element is computed as in the
+ serial build, so the clusters are identical. */
+const int omp_grain = 4096;
+
 class Output {
 public:
   std::vector<int> cluster;
@@ -25,34 +34,38 @@ public:
   }
 };
 
+/* Fill J for S.size() clusters of the sorted vector x by method "linear",
+ "loglinear", "quadratic" or "auto", which picks one of them by the size of x
+ and the number of clusters. Only the two rows of S a row depends on are kept,
+ every other row of S is left empty. */
 void fill_dp_matrix(
     const std::vector<double> & x,
     std::vector< std::vector< double > > & S,
-    std::vector< std::vector< size_t > > & J,
+    std::vector< std::vector<dp_index> > & J,
     const std::string & method);
 
 void backtrack(
     const std::vector<double> & x,
-    const std::vector< std::vector< size_t > > & J,
+    const std::vector< std::vector<dp_index> > & J,
     int* cluster, double* centres, double* withinss,
     double* count /*int* count*/);
 
 void backtrack(
     const std::vector<double> & x,
-    const std::vector< std::vector< size_t > > & J,
+    const std::vector< std::vector<dp_index> > & J,
     std::vector<size_t> & count);
 
 void fill_row_q_SMAWK(
     int imin, int imax, int q,
     std::vector< std::vector<double> > & S,
-    std::vector< std::vector<size_t> > & J,
+    std::vector< std::vector<dp_index> > & J,
     const std::vector<double> & sum_x,
     const std::vector<double> & sum_x_sq);
 
 void fill_row_q(
     int imin, int imax, int q,
     std::vector< std::vector<double> > & S,
-    std::vector< std::vector<size_t> > & J,
+    std::vector< std::vector<dp_index> > & J,
     const std::vector<double> & sum_x,
     const std::vector<double> & sum_x_sq);
 
@@ -60,7 +73,7 @@ void fill_row_q(
 void fill_row_q_log_linear(
     int imin, int imax, int q, int jmin, int jmax,
     std::vector< std::vector<double> > & S,
-    std::vector< std::vector<size_t> > & J,
+    std::vector< std::vector<dp_index> > & J,
     const std::vector<double> & sum_x,
     const std::vector<double> & sum_x_sq);
 
@@ -70,14 +83,62 @@ void fill_row_q_log_linear(
 Output kmeans_1d_dp(std::vector<double> x_v,size_t Kmin, size_t Kmax,
                    double var, const std::string & method);
 
+/* As kmeans_1d_dp, reading x from in_array and writing the cluster of every
+ element to out_labels, which holds at least in_size elements, and the centres
+ to out_array, which holds at least min(in_size, Kmax) elements. Returns Kopt,
+ or 0 if the arrays are too small. */
+size_t kmeans_1d_dp_buffer(const double* in_array, size_t in_size,
+                           size_t Kmin, size_t Kmax, double var,
+                           const std::string & method,
+                           int* out_labels, size_t out_labels_size,
+                           double* out_array, size_t out_size);
+
+/* Dynamic programming tables of kmeans_1d_dp for one vector x of in_size
+ elements, filled once for up to Kmax clusters. select gives the number of
+ clusters kmeans_1d_dp chooses for var and Kmin, and cluster writes the cluster
+ of every element to out_labels and the centres to out_array for K clusters,
+ returning K, or 0 if K is out of range or the arrays are too small. Both
+ backtrack the tables in O(K N) time. */
+class Ckmeans1d {
+public:
+  Ckmeans1d(const double* in_array, size_t in_size, size_t Kmax,
+            const std::string & method);
+  size_t select(double var, size_t Kmin) const;
+  size_t cluster(size_t K, int* out_labels, size_t out_labels_size,
+                 double* out_array, size_t out_size) const;
+  size_t N;
+  size_t nUnique;
+  size_t Kmax;
+private:
+  std::vector<size_t> order;
+  std::vector<double> x_sorted;
+  std::vector< std::vector<dp_index> > J;
+};
+
+/* Cluster the M vectors in_array[offsets[m]:offsets[m+1]], where offsets holds
+ M+1 elements, with Kmin, Kmax and var given per vector, on n_threads threads
+ (all hardware threads if n_threads < 1). The cluster of every element is
+ written to out_labels and the centres of vector m to out_array from
+ offsets[m] on, both holding at least in_size elements, and Kopt of vector m to
+ out_k[m]. Returns M, or -1 if the arguments are inconsistent. */
+int kmeans_1d_dp_batch(const double* in_array, size_t in_size,
+                       const int* offsets, size_t offsets_size,
+                       const int* kmin, size_t kmin_size,
+                       const int* kmax, size_t kmax_size,
+                       const double* var, size_t var_size,
+                       const std::string & method, int n_threads,
+                       int* out_labels, size_t out_labels_size,
+                       double* out_array, size_t out_size,
+                       int* out_k, size_t out_k_size);
+
 void backtrack(
     const std::vector<double> & x,
-    const std::vector< std::vector< size_t > > & J,
+    const std::vector< std::vector<dp_index> > & J,
     std::vector<size_t> & counts, const int K);
 
 size_t select_levels(
     const std::vector<double> & x,
-    const std::vector< std::vector< size_t > > & J,
+    const std::vector< std::vector<dp_index> > & J,
     size_t Kmin, size_t Kmax, double *BIC, double var);
 
 void range_of_variance(
@@ -13,6 +13,48 @@
 #include <string>
 %}
 
+%include "buffers.i"
+
+%apply (const double* in_array, size_t in_size) { (const double* var, size_t var_size) };
+%apply (const int* in_ints, size_t in_ints_size) {
+  (const int* offsets, size_t offsets_size),
+  (const int* kmin, size_t kmin_size),
+  (const int* kmax, size_t kmax_size)
+};
+%apply (int* out_labels, size_t out_labels_size) { (int* out_k, size_t out_k_size) };
+
+/* The arguments are converted before the GIL is released, so the clustering
+ itself runs in parallel with other Python threads. Exceptions are caught
+ before the GIL is taken back and raised as ValueError, such as the
+ std::string thrown for an unknown method, or RuntimeError. */
+%define %release_gil(function)
+%exception function {
+  PyObject* error_type = NULL;
+  std::string error;
+  Py_BEGIN_ALLOW_THREADS
+  try {
+    $action
+  } catch(const std::string & e) {
+    error_type = PyExc_ValueError;
+    error = e;
+  } catch(const std::exception & e) {
+    error_type = PyExc_RuntimeError;
+    error = e.what();
+  }
+  Py_END_ALLOW_THREADS
+  if(error_type != NULL) {
+    PyErr_SetString(error_type, error.c_str());
+    SWIG_fail;
+  }
+}
+%enddef
+%release_gil(kmeans_1d_dp)
+%release_gil(kmeans_1d_dp_buffer)
+%release_gil(kmeans_1d_dp_batch)
+%release_gil(Ckmeans1d::Ckmeans1d)
+%release_gil(Ckmeans1d::select)
+%release_gil(Ckmeans1d::cluster)
+
 %template(double_vector) std::vector<double>;
 %template(int_vector) std::vector<int>;
 
@@ -36,3 +78,31 @@ public:
 };
 
 Output kmeans_1d_dp(std::vector<double> x_v, size_t Kmin, size_t Kmax, double var, const std::string & method);
+
+size_t kmeans_1d_dp_buffer(const double* in_array, size_t in_size,
+                           size_t Kmin, size_t Kmax, double var,
+                           const std::string & method,
+                           int* out_labels, size_t out_labels_size,
+                           double* out_array, size_t out_size);
+
+int kmeans_1d_dp_batch(const double* in_array, size_t in_size,
+                       const int* offsets, size_t offsets_size,
+                       const int* kmin, size_t kmin_size,
+                       const int* kmax, size_t kmax_size,
+                       const double* var, size_t var_size,
+                       const std::string & method, int n_threads,
+                       int* out_labels, size_t out_labels_size,
+                       double* out_array, size_t out_size,
+                       int* out_k, size_t out_k_size);
+
+class Ckmeans1d {
+public:
+  Ckmeans1d(const double* in_array, size_t in_size, size_t Kmax,
+            const std::string & method);
+  size_t select(double var, size_t Kmin) const;
+  size_t cluster(size_t K, int* out_labels, size_t out_labels_size,
+                 double* out_array, size_t out_size) const;
+  const size_t N;
+  const size_t nUnique;
+  const size_t Kmax;
+};
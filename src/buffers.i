@@ -0,0 +1,97 @@
+/* buffers.i */
+
+/* Typemaps passing Python objects supporting the buffer protocol, such as
+ contiguous numpy arrays, to C++ as a pointer and a number of elements,
+ without copying. Arrays of doubles must be float64, arrays of ints intc. */
+
+%{
+#include <cstring>
+
+static int get_double_buffer(PyObject* obj, Py_buffer* view, int writable)
+{
+  int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0);
+  if(PyObject_GetBuffer(obj, view, flags) != 0) {
+    return -1;
+  }
+  if(view->itemsize != sizeof(double) || view->format == NULL || strcmp(view->format, "d") != 0) {
+    PyBuffer_Release(view);
+    PyErr_SetString(PyExc_TypeError, "expected a contiguous float64 buffer");
+    return -1;
+  }
+  return 0;
+}
+
+static int get_int_buffer(PyObject* obj, Py_buffer* view, int writable)
+{
+  int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0);
+  if(PyObject_GetBuffer(obj, view, flags) != 0) {
+    return -1;
+  }
+  if(view->itemsize != sizeof(int) || view->format == NULL || strcmp(view->format, "i") != 0) {
+    PyBuffer_Release(view);
+    PyErr_SetString(PyExc_TypeError, "expected a contiguous intc buffer");
+    return -1;
+  }
+  return 0;
+}
+%}
+
+%typemap(arginit) (const double* in_array, size_t in_size) "view$argnum.obj = NULL;";
+%typemap(in) (const double* in_array, size_t in_size) (Py_buffer view) {
+  if(get_double_buffer($input, &view, 0) != 0) {
+    view.obj = NULL;
+    SWIG_fail;
+  }
+  $1 = (double*) view.buf;
+  $2 = (size_t) (view.len / sizeof(double));
+}
+%typemap(freearg) (const double* in_array, size_t in_size) {
+  if(view$argnum.obj != NULL) {
+    PyBuffer_Release(&view$argnum);
+  }
+}
+
+%typemap(arginit) (double* out_array, size_t out_size) "view$argnum.obj = NULL;";
+%typemap(in) (double* out_array, size_t out_size) (Py_buffer view) {
+  if(get_double_buffer($input, &view, 1) != 0) {
+    view.obj = NULL;
+    SWIG_fail;
+  }
+  $1 = (double*) view.buf;
+  $2 = (size_t) (view.len / sizeof(double));
+}
+%typemap(freearg) (double* out_array, size_t out_size) {
+  if(view$argnum.obj != NULL) {
+    PyBuffer_Release(&view$argnum);
+  }
+}
+
+%typemap(arginit) (int* out_labels, size_t out_labels_size) "view$argnum.obj = NULL;";
+%typemap(in) (int* out_labels, size_t out_labels_size) (Py_buffer view) {
+  if(get_int_buffer($input, &view, 1) != 0) {
+    view.obj = NULL;
+    SWIG_fail;
+  }
+  $1 = (int*) view.buf;
+  $2 = (size_t) (view.len / sizeof(int));
+}
+%typemap(freearg) (int* out_labels, size_t out_labels_size) {
+  if(view$argnum.obj != NULL) {
+    PyBuffer_Release(&view$argnum);
+  }
+}
+
+%typemap(arginit) (const int* in_ints, size_t in_ints_size) "view$argnum.obj = NULL;";
+%typemap(in) (const int* in_ints, size_t in_ints_size) (Py_buffer view) {
+  if(get_int_buffer($input, &view, 0) != 0) {
+    view.obj = NULL;
+    SWIG_fail;
+  }
+  $1 = (int*) view.buf;
+  $2 = (size_t) (view.len / sizeof(int));
+}
+%typemap(freearg) (const int* in_ints, size_t in_ints_size) {
+  if(view$argnum.obj != NULL) {
+    PyBuffer_Release(&view$argnum);
+  }
+}
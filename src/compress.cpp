@@ -0,0 +1,213 @@
+/*
+Greedy piecewise linear compression used by ABBA.compress. Follows the
+Python implementations in ABBA.py operation by operation.
+ */
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <vector>
+
+#include "compress.h"
+
+// Bound on the rounding error of the squared 2-norm error from running sums
+// relative to the error computed from the whole segment by np.linalg.norm,
+// must match _rounding_bound in ABBA.py
+static double rounding_bound(double L, double y0, double t0, double t1, double t2)
+{
+  const double eps = std::numeric_limits<double>::epsilon();
+  const double scale = std::fabs(t0) + std::fabs(t1) + t2
+                       + std::fabs(y0)*std::sqrt((L + 1)*(std::fabs(t0) + t2));
+  return 8*(L + 1)*eps*scale;
+}
+
+// Sum of a[0:n] in the order of NumPy's pairwise summation, so that the
+// error equals np.linalg.norm(..., 1) in ABBA.py
+static double pairwise_sum(const double* a, size_t n)
+{
+  if(n < 8) {
+    double res = 0.0;
+    for(size_t i = 0; i < n; ++i) {
+      res += a[i];
+    }
+    return res;
+  } else if(n <= 128) {
+    double r[8];
+    for(size_t j = 0; j < 8; ++j) {
+      r[j] = a[j];
+    }
+    size_t i;
+    for(i = 8; i < n - (n % 8); i += 8) {
+      for(size_t j = 0; j < 8; ++j) {
+        r[j] += a[i + j];
+      }
+    }
+    double res = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]));
+    for(; i < n; ++i) {
+      res += a[i];
+    }
+    return res;
+  }
+  size_t n2 = n / 2;
+  n2 -= n2 % 8;
+  return pairwise_sum(a, n2) + pairwise_sum(a + n2, n - n2);
+}
+
+// 1-norm error of the chord from x[start] to x[end], work holds the deviations
+static double error_norm1(const double* x, size_t start, size_t end,
+                          std::vector<double>& work)
+{
+  const double L = (double)(end - start);
+  const double inc = x[end] - x[start];
+  work.resize(end - start + 1);
+  for(size_t i = 0; i <= end - start; ++i) {
+    work[i] = std::fabs((x[start] + (inc/L)*i) - x[start + i]);
+  }
+  return pairwise_sum(work.data(), work.size());
+}
+
+// Squared 2-norm error of the chord from x[start] to x[end] summed in index
+// order. Sets exact when the squares and all their partial sums in any order
+// are exact, that is when the squares are multiples of a power of two whose
+// multiple by 2^53 exceeds the sum. The error then equals
+// np.linalg.norm(...)**2 in ABBA.py whatever the summation order of BLAS.
+static double error_norm2(const double* x, size_t start, size_t end, bool& exact)
+{
+  const double L = (double)(end - start);
+  const double inc = x[end] - x[start];
+  double err = 0.0;
+  double grid = std::numeric_limits<double>::infinity();
+  exact = true;
+  for(size_t i = 0; i <= end - start; ++i) {
+    const double d = (x[start] + (inc/L)*i) - x[start + i];
+    const double p = d*d;
+    if(p != 0.0) {
+      int e;
+      std::frexp(p, &e);
+      grid = std::min(grid, std::ldexp(1.0, e - 53));
+      exact = exact && std::fma(d, d, -p) == 0.0;
+    }
+    err += p;
+  }
+  exact = exact && err < std::ldexp(grid, 53);
+  return exact ? std::pow(std::sqrt(err), 2.0) : err;
+}
+
+size_t compress_pieces(const double* x, size_t n, size_t start,
+                       size_t open_length, double tol, int norm, double max_len,
+                       double* pieces, size_t size)
+{
+  const double epsilon = std::numeric_limits<double>::epsilon();
+  const size_t capacity = size / 3;
+  size_t count = 0;
+
+  if(n < 2 || start >= n - 1) {
+    return 0;
+  }
+
+  double y0 = x[start];     // first value of open segment
+  size_t m = 0;             // length of open segment
+  double sum_wd = 0.0;      // sum_i i*d_i, norm = 2 only
+  double sum_d2 = 0.0;      // sum_i d_i^2, norm = 2 only
+  double lastinc = 0.0;
+  double lasterr = 0.0;
+  std::vector<double> work; // deviations, norm = 1 only
+
+  size_t end = start + 1;
+  while(end < n) {
+    const double L = (double)(m + 1);
+    const double inc = x[end] - y0;
+    double err, new_wd = 0.0, new_d2 = 0.0;
+
+    const double bound = tol*m + epsilon;
+    if(norm == 2) {
+      new_wd = sum_wd + L*inc;
+      new_d2 = sum_d2 + inc*inc;
+      const double a = inc/L;
+      const double t0 = a*a*(L*(L+1)*(2*L+1)/6);
+      const double t1 = 2*a*new_wd;
+      err = t0 - t1 + new_d2;
+      err = err > 0 ? err : 0.0;
+      // rounding_bound is only evaluated near the bound, using sqrt(z) <= (1+z)/2
+      const double near = 8*(L + 1)*epsilon*(std::fabs(t0) + std::fabs(t1) + new_d2
+                          + std::fabs(y0)*(1 + (L + 1)*(std::fabs(t0) + new_d2))/2);
+      if(m >= open_length && m > 0 && m < max_len && std::fabs(err - bound) <= near
+         && std::fabs(err - bound) <= rounding_bound(L, y0, t0, t1, new_d2)) {
+        // the exact error decides unless it is within rounding of the bound
+        bool exact;
+        err = error_norm2(x, end - m - 1, end, exact);
+        if(!exact && std::fabs(err - bound) <= 4*(L + 2)*epsilon*err) {
+          // undecided, the open segment is written after the pieces and the
+          // caller decides whether it is extended to end
+          if(count < capacity) {
+            pieces[3*count] = (double)m;
+            pieces[3*count + 1] = lastinc;
+            pieces[3*count + 2] = lasterr;
+          }
+          return count;
+        }
+      }
+    } else {
+      err = error_norm1(x, end - m - 1, end, work);
+    }
+
+    if(m < open_length || ((err <= bound) && (m < max_len)) || m == 0) {
+      lastinc = inc;
+      lasterr = err;
+      sum_wd = new_wd;
+      sum_d2 = new_d2;
+      m += 1;
+      end += 1;
+    } else {
+      if(count == capacity) {
+        return count;
+      }
+      pieces[3*count] = (double)m;
+      pieces[3*count + 1] = lastinc;
+      pieces[3*count + 2] = lasterr;
+      count += 1;
+      // the first step of the next piece is always taken, with zero error
+      y0 = x[end - 1];
+      lastinc = x[end] - y0;
+      lasterr = (norm == 2) ? 0.0 : error_norm1(x, end - 1, end, work);
+      sum_wd = lastinc;
+      sum_d2 = lastinc*lastinc;
+      m = 1;
+      open_length = 0;
+      end += 1;
+    }
+  }
+
+  if(count < capacity) {
+    pieces[3*count] = (double)m;
+    pieces[3*count + 1] = lastinc;
+    pieces[3*count + 2] = lasterr;
+    count += 1;
+  }
+  return count;
+}
+
+double critical_tol(const double* x, size_t n, const double* pieces,
+                    size_t size, int norm, double max_len)
+{
+  const double epsilon = std::numeric_limits<double>::epsilon();
+  double critical = std::numeric_limits<double>::infinity();
+  std::vector<double> work;
+  size_t start = 0;
+  for(size_t k = 0; k < size / 3; ++k) {
+    const size_t m = (size_t)pieces[3*k];
+    if(start + m + 1 < n && m > 0 && m < max_len) {
+      double err;
+      if(norm == 2) {
+        bool exact;
+        err = error_norm2(x, start, start + m + 1, exact);
+      } else {
+        err = error_norm1(x, start, start + m + 1, work);
+      }
+      const double tol = std::max(err - epsilon, 0.0)/m;
+      critical = std::min(critical, norm == 2 ? std::sqrt(tol) : tol);
+    }
+    start += m;
+  }
+  return critical;
+}
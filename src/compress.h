@@ -0,0 +1,25 @@
+/*
+Greedy piecewise linear compression used by ABBA.compress.
+ */
+
+#include <cstddef> // For size_t
+
+/* Compress x[start:n] into pieces [length, increment, error], written row by
+ row into pieces, which holds size/3 rows. The first segment is accepted up to
+ x[start + open_length]. tol is the squared tolerance for norm 2. Stops when
+ the time series is exhausted or pieces is full, and returns the number of
+ pieces written. Compression of the remainder can be resumed from start plus
+ the sum of the lengths returned. For norm 2 it also stops when the error of
+ extending the open segment is within rounding of the tolerance, writing the
+ open segment [length, increment, error] after the pieces if there is room,
+ see _compress_native in ABBA.py. */
+size_t compress_pieces(const double* in_array, size_t in_size, size_t start,
+                       size_t open_length, double tol, int norm, double max_len,
+                       double* out_array, size_t out_size);
+
+/* Smallest tolerance at which the compression of x would extend one of the
+ pieces [length, increment, error], given row by row as returned by
+ compress_pieces from the start of x, by the step which closed it, or infinity
+ if no piece was closed by the tolerance. Not squared for norm 2. */
+double critical_tol(const double* in_array, size_t in_size, const double* in_pieces,
+                    size_t in_pieces_size, int norm, double max_len);
@@ -0,0 +1,18 @@
+/* compress.i */
+
+%module compress
+
+%{
+#include "compress.h"
+%}
+
+%include "buffers.i"
+
+%apply (const double* in_array, size_t in_size) { (const double* in_pieces, size_t in_pieces_size) };
+
+size_t compress_pieces(const double* in_array, size_t in_size, size_t start,
+                       size_t open_length, double tol, int norm, double max_len,
+                       double* out_array, size_t out_size);
+
+double critical_tol(const double* in_array, size_t in_size, const double* in_pieces,
+                    size_t in_pieces_size, int norm, double max_len);
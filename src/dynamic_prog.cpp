@@ -10,9 +10,22 @@ Modified version of the C++ code from https://cran.r-project.org/web/packages/Ck
 #include "Ckmeans.1d.dp.h"
 
 
+// Fill method for K clusters of N elements. The quadratic method has the
+// least overhead on short vectors. SMAWK has the best complexity, but its
+// bookkeeping makes it slower than the log-linear method up to at least a
+// million elements and any K when the rows are filled in order, so the
+// log-linear method is used for all longer vectors.
+static std::string auto_method(const int N, const int K)
+{
+  if(N <= 32 || (N <= 64 && 2*K >= N)) {
+    return "quadratic";
+  }
+  return "loglinear";
+}
+
 void fill_dp_matrix(const std::vector<double> & x, // data
                     std::vector< std::vector< double > > & S,
-                    std::vector< std::vector< size_t > > & J,
+                    std::vector< std::vector<dp_index> > & J,
                     const std::string & method)
   /*
    x: One dimension vector to be clustered, must be sorted (in any order).
@@ -25,7 +38,12 @@ void fill_dp_matrix(const std::vector<double> & x, // data
    */
 {
   const int K = (int) S.size();
-  const int N = (int) S[0].size();
+  const int N = (int) x.size();
+
+  const std::string fill = (method == "auto") ? auto_method(N, K) : method;
+  if(fill != "linear" && fill != "loglinear" && fill != "quadratic") {
+    throw std::string("ERROR: unknown method") + method + "!";
+  }
 
   std::vector<double> sum_x(N), sum_x_sq(N);
 
@@ -37,7 +55,7 @@ void fill_dp_matrix(const std::vector<double> & x, // data
   sum_x[0] = x[0] - shift;
   sum_x_sq[0] = (x[0] - shift) * (x[0] - shift);
 
-  S[0][0] = 0;
+  S[0].assign(N, 0.0);
   J[0][0] = 0;
 
   for(int i = 1; i < N; ++i) {
@@ -50,6 +68,10 @@ void fill_dp_matrix(const std::vector<double> & x, // data
     J[0][i] = 0;
   }
 
+  // With OpenMP, one thread walks the rows and the fill methods hand parts of
+  // each row to the team as tasks, which complete before the next row starts
+#pragma omp parallel if(N > omp_grain)
+#pragma omp single
   for(int q = 1; q < K; ++q) {
     int imin;
     if(q < K - 1) {
@@ -59,20 +81,24 @@ void fill_dp_matrix(const std::vector<double> & x, // data
       imin = N-1;
     }
 
-    if(method == "linear") {
+    // Row q only depends on row q-1, so the rows of S before it are freed
+    S[q].assign(N, 0.0);
+    if(q > 1) {
+      std::vector<double>().swap(S[q-2]);
+    }
+
+    if(fill == "linear") {
       fill_row_q_SMAWK(imin, N-1, q, S, J, sum_x, sum_x_sq);
-    } else if(method == "loglinear") {
+    } else if(fill == "loglinear") {
       fill_row_q_log_linear(imin, N-1, q, q, N-1, S, J, sum_x, sum_x_sq);
-    } else if(method == "quadratic") {
-      fill_row_q(imin, N-1, q, S, J, sum_x, sum_x_sq);
     } else {
-      throw std::string("ERROR: unknown method") + method + "!";
+      fill_row_q(imin, N-1, q, S, J, sum_x, sum_x_sq);
     }
   }
 }
 
 void backtrack(const std::vector<double> & x,
-               const std::vector< std::vector< size_t > > & J,
+               const std::vector< std::vector<dp_index> > & J,
                int* cluster, double* centers, double* withinss,
                double* count /*int* count*/)
 {
@@ -107,7 +133,7 @@ void backtrack(const std::vector<double> & x,
 }
 
 void backtrack(const std::vector<double> & x,
-               const std::vector< std::vector< size_t > > & J,
+               const std::vector< std::vector<dp_index> > & J,
                std::vector<size_t> & count, const int K)
 {
   // const int K = (int) J.size();
@@ -14,7 +14,7 @@ void reduce_in_place(int imin, int imax, int istep, int q,
                      const std::vector<size_t> & js,
                      std::vector<size_t> & js_red,
                      const std::vector< std::vector<double> > & S,
-                     const std::vector< std::vector<size_t> > & J,
+                     const std::vector< std::vector<dp_index> > & J,
                      const std::vector<double> & sum_x,
                      const std::vector<double> & sum_x_sq)
 {
@@ -77,22 +77,25 @@ inline void fill_even_positions
   (int imin, int imax, int istep, int q,
    const std::vector<size_t> & js,
    std::vector< std::vector<double> > & S,
-   std::vector< std::vector<size_t> > & J,
+   std::vector< std::vector<dp_index> > & J,
    const std::vector<double> & sum_x,
    const std::vector<double> & sum_x_sq)
 {
   // Derive j for even rows (0-based)
   size_t n = (js.size());
   int istepx2 = (istep << 1);
-  size_t jl = (js[0]);
-  for(int i=(imin), r(0); i<=imax; i+=istepx2) {
+  const int count = (imax - imin) / istepx2 + 1;
 
-    // auto jmin = (i == imin) ? js[0] : J[q][i - istep];
+  // Every even row starts from the first candidate at least the j of the odd
+  // row before it, so the even rows are split across threads
+#pragma omp taskloop if(count > omp_grain) shared(js, S, J, sum_x, sum_x_sq)
+  for(int m = 0; m < count; ++m) {
 
-    while(js[r] < jl) {
-      // Increase r until it points to a value of at least jmin
-      r ++;
-    }
+    const int i = imin + m * istepx2;
+    const size_t jl = (i == imin) ? js[0] : J[q][i - istep];
+
+    // r points to the first candidate of at least jl
+    size_t r = std::lower_bound(js.begin(), js.end(), jl) - js.begin();
 
     // Initialize S[q][i] and J[q][i]
     S[q][i] = S[q-1][js[r]-1] +
@@ -128,8 +131,6 @@ inline void fill_even_positions
         break;
       }
     }
-    r --;
-    jl = jh;
   }
 }
 
@@ -137,7 +138,7 @@ inline void find_min_from_candidates
   (int imin, int imax, int istep, int q,
    const std::vector<size_t> & js,
    std::vector< std::vector<double> > & S,
-   std::vector< std::vector<size_t> > & J,
+   std::vector< std::vector<dp_index> > & J,
    const std::vector<double> & sum_x,
    const std::vector<double> & sum_x_sq)
 {
@@ -174,7 +175,7 @@ void SMAWK
   (int imin, int imax, int istep, int q,
    const std::vector<size_t> & js,
    std::vector< std::vector<double> > & S,
-   std::vector< std::vector<size_t> > & J,
+   std::vector< std::vector<dp_index> > & J,
    const std::vector<double> & sum_x,
    const std::vector<double> & sum_x_sq)
 {
@@ -206,7 +207,7 @@ void SMAWK
 
 void fill_row_q_SMAWK(int imin, int imax, int q,
                       std::vector< std::vector<double> > & S,
-                      std::vector< std::vector<size_t> > & J,
+                      std::vector< std::vector<dp_index> > & J,
                       const std::vector<double> & sum_x,
                       const std::vector<double> & sum_x_sq)
 {
@@ -9,7 +9,7 @@ Modified version of the C++ code from https://cran.r-project.org/web/packages/Ck
 void fill_row_q_log_linear(int imin, int imax, int q,
                            int jmin, int jmax,
                            std::vector< std::vector<double> > & S,
-                           std::vector< std::vector<size_t> > & J,
+                           std::vector< std::vector<dp_index> > & J,
                            const std::vector<double> & sum_x,
                            const std::vector<double> & sum_x_sq)
 {
@@ -17,7 +17,7 @@ void fill_row_q_log_linear(int imin, int imax, int q,
     return;
   }
 
-  const int N = (int) S[0].size();
+  const int N = (int) S[q].size();
 
   int i = (imin + imax) / 2;
 
@@ -68,15 +68,19 @@ void fill_row_q_log_linear(int imin, int imax, int q,
     }
   }
 
-  jmin = (imin > q) ? (int)J[q][imin-1] : q;
-  jmax = (int)J[q][i];
+  // The halves only read J[q] at i and outside [imin, imax], so they can be
+  // filled concurrently
+  const int jmin_left = (imin > q) ? (int)J[q][imin-1] : q;
+  const int jmax_left = (int)J[q][i];
+  const int jmin_right = (int)J[q][i];
+  const int jmax_right = (imax < N-1) ? (int)J[q][imax+1] : imax;
 
-  fill_row_q_log_linear(imin, i-1, q, jmin, jmax,
+#pragma omp task if(i - imin > omp_grain) shared(S, J, sum_x, sum_x_sq)
+  fill_row_q_log_linear(imin, i-1, q, jmin_left, jmax_left,
                         S, J, sum_x, sum_x_sq);
 
-  jmin = (int)J[q][i];
-  jmax = (imax < N-1) ? (int)J[q][imax+1] : imax;
-  fill_row_q_log_linear(i+1, imax, q, jmin, jmax,
+  fill_row_q_log_linear(i+1, imax, q, jmin_right, jmax_right,
                         S, J, sum_x, sum_x_sq);
+#pragma omp taskwait
 
 }
@@ -13,11 +13,13 @@ Modified version of the C++ code from https://cran.r-project.org/web/packages/Ck
 
 void fill_row_q(int imin, int imax, int q,
                 std::vector< std::vector<double> > & S,
-                std::vector< std::vector<size_t> > & J,
+                std::vector< std::vector<dp_index> > & J,
                 const std::vector<double> & sum_x,
                 const std::vector<double> & sum_x_sq)
 {
   // Assumption: each cluster must have at least one point.
+  // Every i only reads row q-1, so the i are split across threads
+#pragma omp taskloop if(imax - imin > omp_grain) shared(S, J, sum_x, sum_x_sq)
   for(int i=imin; i<=imax; ++i) {
     S[q][i] = S[q-1][i-1];
     J[q][i] = i;
@@ -0,0 +1,243 @@
+"""
+NumPy implementation of the optimal one dimensional k-means clustering in
+Ckmeans.1d.dp.cpp, used by ABBA when the compiled Ckmeans module is unavailable.
+The dynamic programming matrix is filled row by row, and every row is filled by
+divide and conquer over the monotone optimal split points, evaluating all
+candidate splits of one level of the recursion at once. Sums are evaluated as
+in the C++ implementation and ties are resolved as by its 'quadratic' method,
+so on exactly representable data the clusters agree with that method. The
+other methods, including the default 'linear', may resolve ties differently.
+Unlike
+the compiled module, the elements may be weighted, as if every element was
+repeated weights times.
+"""
+
+import numpy as np
+
+class Output(object):
+    """
+    Result of kmeans_1d_dp, with the same attributes as the Output class of the
+    compiled module.
+    """
+
+    def __init__(self, cluster, centres, withinss, size, Kopt):
+        self.cluster = cluster
+        self.centres = centres
+        self.withinss = withinss
+        self.size = size
+        self.Kopt = Kopt
+
+def _dissimilarity(j, i, sum_x, sum_x_sq, sum_w=None):
+    # within cluster sum of squares of x[j], ..., x[i], see Ckmeans.1d.dp.h,
+    # sum_x and sum_x_sq are weighted by the running sum of weights sum_w if given
+    if sum_w is None:
+        (n, total) = ((i - j + 1).astype(float), i + 1)
+    else:
+        (n, total) = (sum_w[i] - np.where(j > 0, sum_w[j-1], 0.0), sum_w[i])
+    lower_x = np.where(j > 0, sum_x[j-1], 0.0)
+    lower_x_sq = np.where(j > 0, sum_x_sq[j-1], 0.0)
+    muji = (sum_x[i] - lower_x)/n
+    sji = np.where(j > 0, sum_x_sq[i] - lower_x_sq - n*muji*muji, sum_x_sq[i] - sum_x[i]*sum_x[i]/total)
+    sji = np.where(j >= i, 0.0, sji)
+    return np.maximum(sji, 0.0)
+
+def _fill_row(q, imin, imax, S_prev, S_row, J, sum_x, sum_x_sq, sum_w=None):
+    """
+    Fill S_row[imin:imax+1] and J[q][imin:imax+1] given the previous row S_prev
+    of S, where x[J[q][i]], ..., x[i] is the last of q+1 clusters. J[q] is non-decreasing in i, so the optimal
+    split of the middle row of an interval bounds the splits of both halves.
+    Ties are resolved to the largest split, as by the 'quadratic' method of the
+    C++ implementation.
+    """
+    (ilo, ihi, jlo, jhi) = (np.array([imin]), np.array([imax]), np.array([q]), np.array([imax]))
+    while len(ilo) > 0:
+        i = (ilo + ihi)//2
+        first = np.maximum(np.maximum(jlo, q), J[q-1][i])
+        last = np.minimum(jhi, i)
+        first = np.minimum(first, last)
+        counts = last - first + 1
+
+        # all candidate splits j of all rows i of this level
+        owner = np.repeat(np.arange(len(i)), counts)
+        offsets = np.cumsum(counts) - counts
+        j = first[owner] + np.arange(np.sum(counts)) - offsets[owner]
+        cost = S_prev[j-1] + _dissimilarity(j, i[owner], sum_x, sum_x_sq, sum_w)
+        best = np.minimum.reduceat(cost, offsets)
+        split = np.maximum.reduceat(np.where(cost == best[owner], j, -1), offsets)
+        S_row[i] = best
+        J[q][i] = split
+
+        # left halves take splits up to the optimum, right halves from it
+        left = ilo < i
+        right = i < ihi
+        (ilo, ihi, jlo, jhi) = (np.concatenate([ilo[left], i[right]+1]),
+                                np.concatenate([i[left]-1, ihi[right]]),
+                                np.concatenate([jlo[left], split[right]]),
+                                np.concatenate([split[left], jhi[right]]))
+
+def fill_dp_matrix(x, K, weights=None):
+    """
+    Backtrack matrix J for K clusters of the sorted array x, with elements
+    weighted by weights if given, see fill_dp_matrix in dynamic_prog.cpp. Only
+    the two rows of S a row depends on are kept, and J holds 32 bit indices.
+    """
+    N = len(x)
+    J = np.zeros([K, N], dtype=np.int32)
+
+    # shift by the median to improve numerical stability
+    shift = x[N//2]
+    if weights is None:
+        (w, sum_w) = (1, None)
+    else:
+        (w, sum_w) = (weights, np.cumsum(weights))
+    sum_x = np.cumsum(w*(x - shift))
+    sum_x_sq = np.cumsum(w*(x - shift)*(x - shift))
+    S_prev = _dissimilarity(np.zeros(N, dtype=int), np.arange(N), sum_x, sum_x_sq, sum_w)
+
+    for q in range(1, K):
+        # No need to compute S[K-1][0] ... S[K-1][N-2]
+        imin = max(1, q) if q < K-1 else N-1
+        S_row = np.zeros(N)
+        _fill_row(q, imin, N-1, S_prev, S_row, J, sum_x, sum_x_sq, sum_w)
+        S_prev = S_row
+    return J
+
+def backtrack(J, K):
+    """
+    Index of the first element of each of K clusters, see backtrack in
+    dynamic_prog.cpp.
+    """
+    left = np.zeros(K, dtype=int)
+    right = J.shape[1]-1
+    for q in range(K-1, -1, -1):
+        left[q] = J[q][right]
+        right = left[q] - 1
+    return left
+
+def select_levels(x, J, Kmin, Kmax, var, weights=None):
+    """
+    Smallest number of clusters K between Kmin and Kmax for which every
+    cluster has variance below var, with elements weighted by weights if
+    given, see select_levels.cpp.
+    """
+    N = len(x)
+    if Kmin > Kmax or N < 2:
+        return min(Kmin, Kmax)
+    for K in range(Kmin, Kmax+1):
+        left = backtrack(J, K)
+        right = np.append(left[1:], N) - 1
+        size = right - left + 1
+
+        # variance of each cluster, shifted by its median element
+        median = x[(left + right)//2]
+        shifted = x - np.repeat(median, size)
+        if weights is not None:
+            total = np.add.reduceat(weights*shifted, left)
+            total_sq = np.add.reduceat(weights*shifted**2, left)
+            size = np.add.reduceat(weights, left)
+        else:
+            total = np.array([np.cumsum(shifted[l:l+n])[-1] for (l, n) in zip(left, size)])
+            total_sq = np.array([np.cumsum(shifted[l:l+n]**2)[-1] for (l, n) in zip(left, size)])
+        variance = np.where(size > 1, (total_sq - total*total/size)/size, 0.0)
+        if np.max(variance) < var:
+            return K
+    return Kmax
+
+class Ckmeans1d(object):
+    """
+    Dynamic programming tables of kmeans_1d_dp for one array x, filled once for
+    up to Kmax clusters, with the same methods as the class of the compiled
+    module. select gives the number of clusters kmeans_1d_dp chooses for var and
+    Kmin, and cluster writes the labels and centres for K clusters into the
+    arrays passed to it.
+    """
+
+    def __init__(self, x, Kmax, method='linear'):
+        x = np.asarray(x, dtype=float)
+        self.N = len(x)
+        self.order = np.argsort(x, kind='stable')
+        self.x_sorted = x[self.order]
+        self.nUnique = 1 + int(np.count_nonzero(np.diff(self.x_sorted))) if self.N > 0 else 0
+        self.Kmax = min(self.nUnique, Kmax)
+        if self.nUnique > 1 and self.Kmax > 0:
+            self.J = fill_dp_matrix(self.x_sorted, self.Kmax)
+
+    def select(self, var, Kmin):
+        if self.nUnique <= 1:
+            return self.nUnique
+        return select_levels(self.x_sorted, self.J, min(self.nUnique, Kmin), self.Kmax, var)
+
+    def cluster(self, K, labels, centres):
+        if self.N == 0 or K < 1 or K > max(self.Kmax, 1) or len(labels) < self.N or len(centres) < K:
+            return 0
+        if self.nUnique <= 1:
+            labels[:self.N] = 0
+            centres[0] = self.x_sorted[0]
+            return 1
+        left = backtrack(self.J[:K], K)
+        size = np.diff(np.append(left, self.N))
+        labels[self.order] = np.repeat(np.arange(K), size)
+        # sums accumulated in order as in the C++ implementation
+        centres[:K] = [np.cumsum(self.x_sorted[l:l+n])[-1]/n for (l, n) in zip(left, size)]
+        return K
+
+def kmeans_1d_dp(x, Kmin, Kmax, var, method='linear', weights=None):
+    """
+    Optimal k-means clustering of one dimensional data, with the number of
+    clusters chosen by select_levels.
+    Parameters
+    ----------
+    x - numpy array
+        Data to cluster.
+    Kmin - int
+        Minimum number of clusters.
+    Kmax - int
+        Maximum number of clusters.
+    var - float
+        Bound on the variance of every cluster.
+    method - string
+        Accepted for compatibility with the compiled module, rows are always
+        filled by divide and conquer.
+    weights - numpy array
+        Positive weight of every element of x, for instance the number of
+        occurrences of distinct values. If None then every weight is one.
+    Returns
+    -------
+    output - Output
+        Cluster label of every element, centres, within cluster sum of squares
+        and size of every cluster, and the number of clusters Kopt.
+    """
+    x = np.asarray(x, dtype=float)
+    N = len(x)
+    order = np.argsort(x, kind='stable')
+    x_sorted = x[order]
+    w_sorted = None if weights is None else np.asarray(weights, dtype=float)[order]
+
+    # Adjust Kmax according to the number of unique values
+    n_unique = 1 + int(np.count_nonzero(np.diff(x_sorted))) if N > 0 else 0
+    Kmax = min(n_unique, Kmax)
+    Kmin = min(n_unique, Kmin)
+
+    cluster = np.zeros(N, dtype=int)
+    if n_unique <= 1:
+        # A single cluster that contains all elements
+        size = float(N) if weights is None else np.sum(w_sorted)
+        return Output(cluster, x[:1].copy(), np.zeros(1), np.array([size]), 1)
+
+    J = fill_dp_matrix(x_sorted, Kmax, w_sorted)
+    Kopt = select_levels(x_sorted, J, Kmin, Kmax, var, w_sorted)
+
+    # Backtrack to find the clusters beginning and ending indices
+    left = backtrack(J[:Kopt], Kopt)
+    size = np.diff(np.append(left, N))
+    labels = np.repeat(np.arange(Kopt), size)
+    cluster[order] = labels
+    if weights is not None:
+        size = np.add.reduceat(w_sorted, left)
+        centres = np.add.reduceat(w_sorted*x_sorted, left)/size
+        withinss = np.add.reduceat(w_sorted*(x_sorted - np.repeat(centres, np.diff(np.append(left, N))))**2, left)
+        return Output(cluster, centres, withinss, size, Kopt)
+    # sums accumulated in order as in the C++ implementation
+    centres = np.array([np.cumsum(x_sorted[l:l+n])[-1] for (l, n) in zip(left, size)])/size
+    withinss = np.array([np.cumsum((x_sorted[l:l+n] - c)**2)[-1] for (l, n, c) in zip(left, size, centres)])
+    return Output(cluster, centres, withinss, size.astype(float), Kopt)
@@ -67,7 +67,7 @@ void range_of_variance(const std::vector<double> & x,
 
 // Choose an optimal number of levels between Kmin and Kmax
 size_t select_levels(const std::vector<double> & x,
-                     const std::vector< std::vector< size_t > > & J,
+                     const std::vector< std::vector<dp_index> > & J,
                      size_t Kmin, size_t Kmax,
                      double * BIC, double var)
 {
@@ -92,13 +92,19 @@ size_t select_levels(const std::vector<double> & x,
     std::vector<size_t> size(K);
     backtrack(x, J, size, (int)K);
 
-    size_t indexLeft = 0;
-    size_t indexRight;
+    std::vector<size_t> left(K, 0);
+    for (size_t k = 1; k < K; ++k) {
+      left[k] = left[k-1] + size[k-1];
+    }
 
+    // The clusters are independent, so with OpenMP they are split across
+    // threads
+#pragma omp parallel for schedule(dynamic) if(N > omp_grain)
     for (size_t k = 0; k < K; ++k) { // Estimate GMM parameters first
       lambda[k] = size[k] / (double) N;
 
-      indexRight = indexLeft + size[k] - 1;
+      const size_t indexLeft = left[k];
+      const size_t indexRight = indexLeft + size[k] - 1;
 
       shifted_data_variance(x, indexLeft, indexRight, mu[k], sigma2[k]);
       variance[k] = sigma2[k];
@@ -119,8 +125,6 @@ size_t select_levels(const std::vector<double> & x,
       }
 
       coeff[k] = lambda[k] / std::sqrt(2.0 * M_PI * sigma2[k]);
-
-      indexLeft = indexRight + 1;
     }
 
     if(*std::max_element(std::begin(variance), std::end(variance)) < var){
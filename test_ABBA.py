@@ -1,8 +1,16 @@
 import unittest
-from ABBA import ABBA
+from ABBA import ABBA, ABBAPyramid, _PieceBuffer
 import numpy as np
 import warnings
+import collections
+import os
+import sys
+import subprocess
+import tempfile
+import threading
+import time
 from util import dtw
+from src.kmeans_1d import kmeans_1d_dp, Ckmeans1d
 
 def ignore_warnings(test_func):
     def do_test(self, *args, **kwargs):
@@ -11,6 +19,89 @@ def ignore_warnings(test_func):
             test_func(self, *args, **kwargs)
     return do_test
 
+def digitize_incremental_reference(abba, data):
+    """
+    digitize_incremental as it was before its cluster statistics were updated
+    incrementally, recomputing the center and error of every trial cluster.
+    """
+    def weighted_median(data, weights):
+        data, weights = np.array(data).squeeze(), np.array(weights).squeeze()
+        s_data, s_weights = map(np.array, zip(*sorted(zip(data, weights))))
+        midpoint = 0.5 * sum(s_weights)
+        if any(weights > midpoint):
+            w_median = (data[weights == np.max(weights)])[0]
+        else:
+            cs_weights = np.cumsum(s_weights)
+            idx = np.where(cs_weights <= midpoint)[0][-1]
+            if cs_weights[idx] == midpoint:
+                w_median = np.mean(s_data[idx:idx+2])
+            else:
+                w_median = s_data[idx+1]
+        return w_median
+
+    centers = np.zeros((0,2))
+    labels = [-1]*np.shape(data)[0]
+    if abba.symmetric:
+        ind = np.argsort(abs(data[:,1]))
+    else:
+        ind = np.argsort(data[:,1])
+    k = 0
+    inds = 0
+    inde = 0
+    mval = data[ind[inds], 1]
+    last_sign = np.sign(mval)
+    sign_change = False
+    sign_sorted = False
+    while inde < np.shape(data)[0]:
+        if inde == np.shape(data)[0]-1:
+            old_mval = mval
+            nrmerr = np.inf
+        else:
+            vals = data[np.sort(ind[inds:inde+2]), 1]
+            if np.sign(data[ind[inde+1], 1]) != last_sign:
+                sign_change = True
+            ell = inde-inds+2
+            old_mval = mval
+            if abba.weighted and abba.norm==1:
+                wgts = np.arange(1,ell+1)
+                wvals = np.cumsum(vals)/wgts
+                mval = weighted_median(wvals, wgts)
+                err = np.cumsum(vals) - np.arange(1,ell+1)*mval
+                nrmerr = np.linalg.norm(err,1)
+            if abba.weighted and abba.norm==2:
+                wgths = (ell+1)*ell/2 - np.cumsum(np.arange(0,ell))
+                wvals = vals*wgths
+                mval = np.sum(wvals)/((ell)*(ell+1)*(2*ell+1)/6)
+                err = np.cumsum(vals) - np.arange(1,ell+1)*mval
+                nrmerr = np.linalg.norm(err)**2
+            if not abba.weighted and abba.norm==1:
+                mval = np.median(vals)
+                err = vals - np.ones((1,ell))*mval
+                nrmerr = np.linalg.norm(err,1)
+            if not abba.weighted and abba.norm==2:
+                mval = np.sum(vals)/ell
+                err = vals - np.ones((1,ell))*mval
+                nrmerr = np.linalg.norm(err)**2
+        if nrmerr < ell*abba.digitization_tol and inde+1<np.shape(data)[0]:
+            inde += 1
+        else:
+            mlen = np.mean(data[ind[inds:inde+1], 0])
+            for ii in ind[inds:inde+1]:
+                labels[ii] = k
+            centers = np.vstack((centers, np.array([mlen, old_mval])))
+            if abba.symmetric and not sign_sorted and sign_change:
+                ind1 = ind[inde+1:]
+                lst = data[ind1, 1]
+                ind2 = np.lexsort((np.abs(lst),np.sign(lst)))
+                ind[inde+1:] = ind1[ind2]
+                sign_sorted = True
+            k += 1
+            inds = inde+1
+            inde = inds
+            if inds < np.shape(data)[0]:
+                mval = data[ind[inds], 1]
+    return labels, centers
+
 class test_ABBA(unittest.TestCase):
     #--------------------------------------------------------------------------#
     # _check_parameters
@@ -39,6 +130,26 @@ class test_ABBA(unittest.TestCase):
         """
         self.assertRaises(ValueError, ABBA, min_k=6, max_k=3)
 
+    def test_CheckParameters_CompressMethod(self):
+        """
+        compress_method should be known, and linear requires norm = 2
+        """
+        self.assertRaises(ValueError, ABBA, compress_method='fast')
+        self.assertRaises(ValueError, ABBA, compress_method='linear', norm=1)
+        self.assertRaises(ValueError, ABBA, compress_method='gallop', norm=2)
+
+    def test_CheckParameters_KSearch(self):
+        """
+        k_search and ck_method should be known and n_init a positive integer
+        """
+        self.assertRaises(ValueError, ABBA, k_search='random')
+        self.assertRaises(ValueError, ABBA, n_init=0)
+        self.assertRaises(ValueError, ABBA, k_jobs=0)
+        self.assertRaises(ValueError, ABBA, k_jobs=2, k_search='warm')
+        self.assertRaises(ValueError, ABBA, k_backend='mpi')
+        self.assertRaises(ValueError, ABBA, dedup=1)
+        self.assertRaises(ValueError, ABBA, ck_method='cubic')
+
     #--------------------------------------------------------------------------#
     # transform
     #--------------------------------------------------------------------------#
@@ -55,6 +166,57 @@ class test_ABBA(unittest.TestCase):
         string2, centers2 = abba.digitize(pieces)
         self.assertTrue(np.allclose(centers, centers2))
 
+    #--------------------------------------------------------------------------#
+    # compress_batch / transform_batch
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_CompressBatch_MatchesCompress(self):
+        """
+        Check compress_batch returns the pieces of each time series in input order.
+        """
+        np.random.seed(0)
+        ts_list = [np.random.randn(n) for n in [50, 10, 200, 2, 75]]
+        abba = ABBA(verbose=0)
+        pieces, errors = abba.compress_batch(ts_list, n_jobs=2, chunksize=2)
+        self.assertEqual(errors, [None]*len(ts_list))
+        for ts, p in zip(ts_list, pieces):
+            self.assertTrue(np.allclose(p, abba.compress(ts)))
+
+    def test_TransformBatch_OpenMP(self):
+        """
+        Check a batch in worker processes does not hang after transform has run
+        KMeans in the parent with several OpenMP threads.
+        """
+        script = '\n'.join([
+            'import numpy as np',
+            'from ABBA import ABBA',
+            'np.random.seed(0)',
+            'ts_list = [np.cumsum(np.random.randn(200)) for i in range(4)]',
+            'abba = ABBA(verbose=0, scl=1)',
+            'string, centers = abba.transform(ts_list[0])',
+            'strings, centers, errors = abba.transform_batch(ts_list, n_jobs=2, random_state=0)',
+            'assert errors == [None]*4'])
+        env = dict(os.environ, OMP_NUM_THREADS='4')
+        result = subprocess.run([sys.executable, '-c', script], env=env, timeout=300,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0)
+
+    @ignore_warnings
+    def test_TransformBatch_ErrorCapture(self):
+        """
+        Check a time series which is too short does not abort the batch.
+        """
+        np.random.seed(0)
+        ts_list = [np.random.randn(40), [1.0, 2.0], np.random.randn(60)]
+        abba = ABBA(verbose=0, scl=1)
+        strings, centers, errors = abba.transform_batch(ts_list, n_jobs=1, random_state=0)
+        self.assertIsNone(strings[1])
+        self.assertIsInstance(errors[1], ValueError)
+        for i in [0, 2]:
+            string, c = abba.transform(ts_list[i])
+            self.assertEqual(strings[i], string)
+            self.assertTrue(np.allclose(centers[i], c))
+
     #--------------------------------------------------------------------------#
     # inverse_transform
     #--------------------------------------------------------------------------#
@@ -142,6 +304,737 @@ class test_ABBA(unittest.TestCase):
         correct_pieces = np.array(correct_pieces)
         self.assertTrue(np.allclose(correct_pieces, pieces))
 
+    @ignore_warnings
+    def test_Compress_LinearMatchesNaive(self):
+        """
+        Test compression with running sums gives the same pieces as recomputing
+        the norm over the whole segment, also on exact ties of the tolerance.
+        """
+        np.random.seed(0)
+        integer = [np.random.randint(0, 5, 50).astype(float) for i in range(20)]
+        for ts in [np.random.randn(200), np.cumsum(np.random.randn(500)), np.sin(np.arange(0, 50, 0.1)), np.array([0, 3, 3, 2, 0, 3.])] + integer:
+            for tol in [0.05, 0.5, 1.0, 2.0]:
+                for max_len in [np.inf, 10]:
+                    abba1 = ABBA(tol=tol, max_len=max_len, verbose=0, compress_method='naive')
+                    abba2 = ABBA(tol=tol, max_len=max_len, verbose=0, compress_method='linear')
+                    pieces1 = abba1.compress(ts)
+                    pieces2 = abba2.compress(ts)
+                    self.assertEqual(pieces1.shape, pieces2.shape)
+                    self.assertTrue(np.allclose(pieces1, pieces2))
+
+    @ignore_warnings
+    def test_Compress_BaselineRule(self):
+        """
+        Test every compression method in the 2-norm gives the pieces of the
+        original greedy rule on integer valued time series, where the error
+        often ties with the tolerance.
+        """
+        def compress_reference(ts, tol):
+            # original greedy rule, the norm is recomputed over each segment
+            (start, end, pieces) = (0, 1, [])
+            while end < len(ts):
+                inc = ts[end] - ts[start]
+                err = np.linalg.norm((ts[start] + (inc/(end-start))*np.arange(0, end-start+1)) - ts[start:end+1])**2
+                if err <= tol**2*(end-start-1) + np.finfo(float).eps:
+                    (lastinc, lasterr) = (inc, err)
+                    end += 1
+                else:
+                    pieces.append([end-start-1, lastinc, lasterr])
+                    start = end - 1
+            pieces.append([end-start-1, lastinc, lasterr])
+            return np.array(pieces)
+
+        self.assertEqual(len(compress_reference(np.array([0, 3, 3, 2, 0, 3.]), 1.0)), 4)
+        np.random.seed(0)
+        integer = [np.random.randint(0, 6, 100).astype(float) for i in range(10)]
+        integer += [np.cumsum(np.random.randint(-2, 3, 100)).astype(float) for i in range(10)]
+        for ts in [np.array([0, 3, 3, 2, 0, 3.])] + integer:
+            for tol in [0.5, 1.0, 2.0]:
+                correct_pieces = compress_reference(ts, tol)
+                for method in ['auto', 'naive', 'linear', 'native']:
+                    pieces = ABBA(tol=tol, verbose=0, compress_method=method, buffer_size=7).compress(ts)
+                    self.assertEqual(pieces.shape, correct_pieces.shape)
+                    self.assertTrue(np.allclose(pieces, correct_pieces))
+                stream = ABBA(tol=tol, verbose=0).compress_stream()
+                pieces = np.vstack([stream.push(ts[:7]), stream.push(ts[7:]), stream.flush()])
+                self.assertTrue(np.allclose(pieces, correct_pieces))
+                pieces = ABBA(tol=tol, verbose=0).compress_multichannel(ts.reshape(-1, 1))
+                self.assertTrue(np.allclose(pieces, correct_pieces))
+
+    @ignore_warnings
+    def test_Compress_GallopMatchesNaive(self):
+        """
+        Test compression with galloping search and exact = True gives the same
+        pieces as the linear scan in the 1-norm.
+        """
+        np.random.seed(0)
+        for ts in [np.random.randn(200), np.cumsum(np.random.randn(300)), np.sin(np.arange(0, 50, 0.1))]:
+            for tol in [0.05, 0.5]:
+                for max_len in [np.inf, 10]:
+                    abba1 = ABBA(tol=tol, max_len=max_len, norm=1, verbose=0, compress_method='naive')
+                    abba2 = ABBA(tol=tol, max_len=max_len, norm=1, verbose=0, compress_method='gallop')
+                    pieces1 = abba1.compress(ts)
+                    pieces2 = abba2.compress(ts)
+                    self.assertEqual(pieces1.shape, pieces2.shape)
+                    self.assertTrue(np.allclose(pieces1, pieces2))
+
+    @ignore_warnings
+    def test_Compress_GallopInexact(self):
+        """
+        Test galloping search with exact = False gives pieces which cover the
+        time series and satisfy the tolerance.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(300))
+        tol = 0.5
+        abba = ABBA(tol=tol, norm=1, verbose=0, compress_method='gallop', exact=False)
+        pieces = abba.compress(ts)
+        self.assertEqual(np.sum(pieces[:,0]), len(ts)-1)
+        self.assertTrue(np.all(pieces[:,2] <= tol*np.maximum(pieces[:,0]-1, 0) + 1e-12))
+        self.assertTrue(np.allclose(abba.inverse_compress(ts[0], pieces)[-1], ts[-1]))
+
+    @ignore_warnings
+    def test_Compress_NativeMatchesNaive(self):
+        """
+        Test compression with the compiled kernel gives the same pieces as the
+        Python implementation, also when the pieces are written in small blocks.
+        In the 1-norm the errors are summed in the same order, so the pieces are
+        equal, not just close.
+        """
+        try:
+            from src.compress import compress_pieces
+        except ImportError: # pragma: no cover
+            self.skipTest('Compression module unavailable, run makefile.')
+        np.random.seed(0)
+        for ts in [np.random.randn(200), np.cumsum(np.random.randn(300)), np.sin(np.arange(0, 50, 0.1)), np.random.randint(0, 5, 300).astype(float), 1000*np.cumsum(np.random.randn(600))]:
+            for norm in [1, 2]:
+                for (tol, max_len) in [(0.3, np.inf), (0.3, 10), (1.0, np.inf), (5.0, np.inf)]:
+                    abba1 = ABBA(tol=tol, max_len=max_len, norm=norm, verbose=0, compress_method='naive')
+                    abba2 = ABBA(tol=tol, max_len=max_len, norm=norm, verbose=0, compress_method='native', buffer_size=4)
+                    pieces1 = abba1.compress(ts)
+                    pieces2 = abba2.compress(ts)
+                    self.assertEqual(pieces1.shape, pieces2.shape)
+                    if norm == 1:
+                        self.assertTrue(np.array_equal(pieces1, pieces2))
+                    else:
+                        self.assertTrue(np.allclose(pieces1, pieces2))
+
+    @ignore_warnings
+    def test_Compress_Norm1NoInfiniteLoop(self):
+        """
+        Test compression with norm = 1 terminates when rounding makes the error
+        of a piece of length one exceed machine epsilon
+        """
+        ts = [2.5, 3.7, 2.1, 7.3, 5.9]
+        abba = ABBA(tol=0.01, verbose=0, norm=1)
+        pieces = abba.compress(ts)
+        self.assertEqual(np.sum(pieces[:,0]), len(ts)-1)
+
+    @ignore_warnings
+    def test_Compress_MemoryMap(self):
+        """
+        Test compression of a memory mapped time series walked in small buffers
+        agrees with compression of the array in memory.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(1000))
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'ts.dat')
+            mm = np.memmap(filename, dtype='float64', mode='w+', shape=ts.shape)
+            mm[:] = ts
+            mm.flush()
+            mm = np.memmap(filename, dtype='float64', mode='r', shape=ts.shape)
+            abba = ABBA(tol=0.2, verbose=0, buffer_size=37)
+            self.assertTrue(np.shares_memory(abba._check_time_series(mm), mm))
+            pieces = abba.compress(mm)
+            del mm
+        self.assertTrue(np.allclose(pieces, ABBA(tol=0.2, verbose=0).compress(ts)))
+
+    #--------------------------------------------------------------------------#
+    # compress_parallel
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_CompressParallel_ValidPieces(self):
+        """
+        Test chunk parallel compression covers the time series with pieces
+        satisfying the tolerance, and stays close to serial compression.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(1000))
+        tol = 0.3
+        abba = ABBA(tol=tol, verbose=0)
+        pieces = abba.compress_parallel(ts, n_jobs=2, n_chunks=5)
+        self.assertEqual(np.sum(pieces[:,0]), len(ts)-1)
+        self.assertTrue(np.all(pieces[:,2] <= tol**2*np.maximum(pieces[:,0]-1, 0) + 1e-12))
+        self.assertTrue(np.allclose(abba.inverse_compress(ts[0], pieces)[-1], ts[-1]))
+        self.assertTrue(abs(len(pieces) - len(abba.compress(ts))) <= 2*4)
+
+    #--------------------------------------------------------------------------#
+    # compress_target
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_CompressTarget_Ratio(self):
+        """
+        Test compress_target returns at most the target number of pieces and the
+        tolerance which reproduces them with compress.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(500))
+        for norm in [1, 2]:
+            abba = ABBA(tol=0.1, norm=norm, verbose=0)
+            pieces, tol = abba.compress_target(ts, ratio=0.2)
+            self.assertTrue(len(pieces) <= 100)
+            self.assertTrue(len(pieces) > 90)
+            self.assertTrue(np.allclose(pieces, ABBA(tol=tol, norm=norm, verbose=0).compress(ts)))
+
+    @ignore_warnings
+    def test_CompressTarget_Critical(self):
+        """
+        Test the pieces only change at the critical tolerance of _tol_upper,
+        with and without the compiled module, and compress_target compresses
+        fewer times than bisection to machine precision.
+        """
+        class Counting(ABBA):
+            # compress_target compresses with a copy of the object
+            count = 0
+            def compress(self, time_series):
+                Counting.count += 1
+                return ABBA.compress(self, time_series)
+
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(2000))
+        for norm in [1, 2]:
+            abba = ABBA(tol=0.5, norm=norm, verbose=0)
+            pieces = abba.compress(ts)
+            upper = abba._tol_upper(ts, pieces)
+            self.assertTrue(np.array_equal(ABBA(tol=upper*(1 - 1e-9), norm=norm, verbose=0).compress(ts), pieces))
+            self.assertFalse(np.array_equal(ABBA(tol=upper*(1 + 1e-9), norm=norm, verbose=0).compress(ts), pieces))
+            compiled = sys.modules.get('src.compress')
+            sys.modules['src.compress'] = None
+            try:
+                self.assertAlmostEqual(abba._tol_upper(ts, pieces), upper)
+            finally:
+                if compiled is None:
+                    del sys.modules['src.compress']
+                else:
+                    sys.modules['src.compress'] = compiled
+
+            Counting.count = 0
+            pieces, tol = Counting(tol=0.1, norm=norm, verbose=0).compress_target(ts, n_pieces=300)
+            self.assertLess(Counting.count, 40)
+            self.assertTrue(len(pieces) <= 300)
+            self.assertTrue(np.array_equal(pieces, ABBA(tol=tol, norm=norm, verbose=0).compress(ts)))
+
+    @ignore_warnings
+    def test_CompressTarget_NoTarget(self):
+        """
+        Test compress_target raises an error without a valid target.
+        """
+        abba = ABBA(verbose=0)
+        self.assertRaises(ValueError, abba.compress_target, np.arange(10.))
+        self.assertRaises(ValueError, abba.compress_target, np.arange(10.), n_pieces=0)
+
+    #--------------------------------------------------------------------------#
+    # compress_hierarchy
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_CompressHierarchy_Nested(self):
+        """
+        Test levels of compress_hierarchy are nested, satisfy their tolerance,
+        and can be extracted from the breakpoint index with the same lengths
+        and increments.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(500))
+        tols = [0.05*i for i in range(1, 11)]
+        for norm in [1, 2]:
+            abba = ABBA(tol=0.1, norm=norm, verbose=0)
+            hierarchy, index = abba.compress_hierarchy(ts, tols)
+            self.assertTrue(np.allclose(hierarchy[0], ABBA(tol=tols[0], norm=norm, verbose=0).compress(ts)))
+            for i, tol in enumerate(tols):
+                pieces = hierarchy[i]
+                self.assertEqual(np.sum(pieces[:,0]), len(ts)-1)
+                bound = tol**2 if norm == 2 else tol
+                self.assertTrue(np.all(pieces[:,2] <= bound*(pieces[:,0]-1) + 1e-9))
+                extracted = abba.extract_pieces(ts, index, tol)
+                self.assertTrue(np.allclose(extracted, pieces))
+                # increments are differences of the time series, as when extracted
+                self.assertTrue(np.array_equal(extracted[:,:2], pieces[:,:2]))
+                if i > 0:
+                    self.assertTrue(set(np.cumsum(pieces[:,0])) <= set(np.cumsum(hierarchy[i-1][:,0])))
+
+    @ignore_warnings
+    def test_CompressHierarchy_Unsorted(self):
+        """
+        Test compress_hierarchy raises an error for unsorted tolerances.
+        """
+        abba = ABBA(verbose=0)
+        self.assertRaises(ValueError, abba.compress_hierarchy, np.arange(10.), [0.2, 0.1])
+
+    #--------------------------------------------------------------------------#
+    # pyramid
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_Pyramid_SearchMatchesBruteForce(self):
+        """
+        Test coarse-to-fine search finds the same windows as a scan of the
+        reconstruction at the target level.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(1000))
+        ts = (ts - np.mean(ts))/np.std(ts)
+        pyramid = ABBA(verbose=0).pyramid(ts, [0.1, 0.4, 0.2])
+        self.assertEqual(pyramid.tols, [0.4, 0.2, 0.1])
+        query = ts[400:440]
+        for finest in range(3):
+            bound = np.max(pyramid.levels[finest]['error'])
+            level = pyramid.level_for(bound)
+            self.assertTrue(level <= finest)
+            reconstruction = pyramid.reconstruct(level=level)
+            windows = np.array([reconstruction[i:i+40] for i in range(len(ts)-39)])
+            correct = np.where(np.max(np.abs(windows - query), axis=1) <= 0.5)[0]
+            self.assertTrue(np.array_equal(pyramid.search(query, 0.5, bound), correct))
+            self.assertTrue(np.max(np.abs(reconstruction - ts)) <= bound)
+
+    @ignore_warnings
+    def test_Pyramid_Children(self):
+        """
+        Test each coarse piece covers the fine pieces it is linked to.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(500))
+        ts = (ts - np.mean(ts))/np.std(ts)
+        pyramid = ABBA(verbose=0).pyramid(ts, [0.1, 0.3])
+        coarse, fine = pyramid.levels[0]['pieces'], pyramid.levels[1]['pieces']
+        for p in range(len(coarse)):
+            self.assertEqual(np.sum(fine[pyramid.children(0, p), 0]), coarse[p, 0])
+
+    @ignore_warnings
+    def test_Pyramid_SaveLoad(self):
+        """
+        Test a saved pyramid is loaded unchanged.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(500))
+        ts = (ts - np.mean(ts))/np.std(ts)
+        pyramid = ABBA(verbose=0).pyramid(ts, [0.1, 0.3])
+        with tempfile.TemporaryDirectory() as folder:
+            file = os.path.join(folder, 'pyramid.npz')
+            pyramid.save(file)
+            loaded = ABBAPyramid.load(file)
+        self.assertEqual(loaded.tols, pyramid.tols)
+        for level in range(2):
+            self.assertEqual(loaded.levels[level]['string'], pyramid.levels[level]['string'])
+            self.assertTrue(np.array_equal(loaded.reconstruct(level=level), pyramid.reconstruct(level=level)))
+
+    #--------------------------------------------------------------------------#
+    # compress_multichannel
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_CompressMultichannel_OneChannel(self):
+        """
+        Test multichannel compression of a single channel agrees with compress
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(200))
+        for norm in [1, 2]:
+            abba = ABBA(tol=0.3, verbose=0, norm=norm)
+            pieces = abba.compress_multichannel(ts.reshape(-1, 1))
+            self.assertTrue(np.allclose(pieces, abba.compress(ts)))
+
+    @ignore_warnings
+    def test_CompressMultichannel_SharedBreakpoints(self):
+        """
+        Test multichannel compression cuts where any channel requires it
+        """
+        ts = np.array([[0, 0], [1, 0], [2, 0], [3, 0], [4, 2], [5, 4]]).astype(float)
+        abba = ABBA(tol=0.01, verbose=0)
+        pieces = abba.compress_multichannel(ts)
+        correct_pieces = [[3, 3, 0, 0],
+                          [2, 2, 4, 0]]
+        self.assertTrue(np.allclose(pieces, np.array(correct_pieces)))
+        pieces = abba.compress_multichannel(ts, criterion='mean')
+        self.assertEqual(pieces.shape[1], 4)
+        self.assertEqual(np.sum(pieces[:,0]), 5)
+
+    #--------------------------------------------------------------------------#
+    # compress_stream
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_CompressStream_MatchesCompress(self):
+        """
+        Test pushing a time series in chunks gives the same pieces as compress
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(300))
+        for norm in [1, 2]:
+            abba = ABBA(tol=0.3, verbose=0, norm=norm)
+            stream = abba.compress_stream()
+            pieces = [stream.push(chunk) for chunk in np.split(ts, [0, 1, 50, 51, 170])]
+            pieces.append(stream.flush())
+            pieces = np.vstack(pieces)
+            correct_pieces = abba.compress(ts)
+            self.assertEqual(pieces.shape, correct_pieces.shape)
+            self.assertTrue(np.allclose(pieces, correct_pieces))
+
+    @ignore_warnings
+    def test_CompressStream_Flush(self):
+        """
+        Test flush returns the trailing piece and resets the compressor
+        """
+        stream = ABBA(verbose=0).compress_stream()
+        self.assertEqual(stream.flush().shape, (0, 3))
+        self.assertEqual(stream.push([1, 3]).shape, (0, 3))
+        self.assertTrue(np.allclose(stream.flush(), np.array([[1.0, 2.0, 0.0]])))
+        self.assertEqual(stream.flush().shape, (0, 3))
+
+    #--------------------------------------------------------------------------#
+    # kmeans_1d_dp
+    #--------------------------------------------------------------------------#
+    def test_Kmeans1d_Example(self):
+        """
+        Test NumPy kmeans_1d_dp on well separated clusters in any order.
+        """
+        x = np.array([10.1, -5, 0.1, 10, -5.2, 0, 9.9, -4.9, 0.2])
+        output = kmeans_1d_dp(x, 1, 5, 0.1)
+        self.assertEqual(output.Kopt, 3)
+        self.assertTrue(np.array_equal(output.cluster, [2, 0, 1, 2, 0, 1, 2, 0, 1]))
+        self.assertTrue(np.allclose(output.centres, [-15.1/3, 0.1, 10]))
+
+    def test_Kmeans1d_OneValue(self):
+        """
+        Test NumPy kmeans_1d_dp when all elements are equal.
+        """
+        output = kmeans_1d_dp(np.ones(5), 2, 5, 0.1)
+        self.assertEqual(output.Kopt, 1)
+        self.assertTrue(np.array_equal(output.cluster, np.zeros(5)))
+
+    def test_Kmeans1d_MatchesCompiled(self):
+        """
+        Test NumPy kmeans_1d_dp gives the same clusters as the compiled module.
+        """
+        try:
+            from src.Ckmeans import kmeans_1d_dp as compiled, double_vector
+        except ImportError: # pragma: no cover
+            self.skipTest('Ckmeans module unavailable')
+        np.random.seed(0)
+        for trial in range(20):
+            x = np.round(np.random.randn(np.random.randint(2, 200)), trial % 3 + 1)
+            var = np.random.rand()*0.1
+            output = compiled(double_vector(x), 2, 30, var, 'linear')
+            output_ = kmeans_1d_dp(x, 2, 30, var)
+            self.assertEqual(output.Kopt, output_.Kopt)
+            self.assertTrue(np.array_equal(np.array(output.cluster), output_.cluster))
+            self.assertTrue(np.array_equal(np.array(output.centres), output_.centres))
+
+    def test_Kmeans1d_QuantisedTies(self):
+        """
+        Test NumPy kmeans_1d_dp resolves ties as the 'quadratic' method of the
+        compiled module on quantised data.
+        """
+        try:
+            from src.Ckmeans import kmeans_1d_dp as compiled, double_vector
+        except ImportError: # pragma: no cover
+            self.skipTest('Ckmeans module unavailable')
+        np.random.seed(1)
+        for trial in range(200):
+            x = np.random.randint(-10, 20, np.random.randint(2, 300))*[0.25, 0.5, 1.0][trial % 3]
+            (var, min_k) = (np.random.rand(), np.random.randint(1, 4))
+            output = compiled(double_vector(x), min_k, 30, var, 'quadratic')
+            output_ = kmeans_1d_dp(x, min_k, 30, var)
+            self.assertEqual(output.Kopt, output_.Kopt)
+            self.assertTrue(np.array_equal(np.array(output.cluster), output_.cluster))
+            self.assertTrue(np.array_equal(np.array(output.centres), output_.centres))
+
+    def test_Kmeans1d_Buffer(self):
+        """
+        Test the buffer entry point of the compiled module writes the clusters of
+        kmeans_1d_dp into the arrays passed to it.
+        """
+        try:
+            from src.Ckmeans import kmeans_1d_dp as compiled, kmeans_1d_dp_buffer, double_vector
+        except ImportError: # pragma: no cover
+            self.skipTest('Ckmeans module unavailable')
+        np.random.seed(0)
+        for trial in range(20):
+            x = np.round(np.random.randn(np.random.randint(2, 200)), trial % 3 + 1)
+            var = np.random.rand()*0.1
+            output = compiled(double_vector(x), 2, 30, var, 'linear')
+            labels = np.empty(len(x), dtype=np.intc)
+            centres = np.empty(30)
+            k = kmeans_1d_dp_buffer(x, 2, 30, var, 'linear', labels, centres)
+            self.assertEqual(k, output.Kopt)
+            self.assertTrue(np.array_equal(labels, np.array(output.cluster)))
+            self.assertTrue(np.array_equal(centres[:k], np.array(output.centres)))
+
+        # wrong types and arrays too small
+        self.assertRaises(TypeError, kmeans_1d_dp_buffer, x.astype(np.float32), 2, 30, 0.1, 'linear', labels, centres)
+        self.assertRaises(TypeError, kmeans_1d_dp_buffer, x, 2, 30, 0.1, 'linear', labels.astype(float), centres)
+        self.assertEqual(kmeans_1d_dp_buffer(x, 2, 30, 0.1, 'linear', labels[:1], centres), 0)
+        # ABBA raises on the rejected arguments instead of returning no clusters
+        abba = ABBA(verbose=0)
+        (abba.min_k, abba.max_k) = (5, 3)
+        self.assertRaises(ValueError, abba._kmeans_1d_dp, x, 0.1)
+
+    def test_Kmeans1d_Batch(self):
+        """
+        Test the batched entry point of the compiled module clusters every vector
+        as the buffer entry point, on one or several threads.
+        """
+        try:
+            from src.Ckmeans import kmeans_1d_dp_buffer, kmeans_1d_dp_batch
+        except ImportError: # pragma: no cover
+            self.skipTest('Ckmeans module unavailable')
+        np.random.seed(0)
+        vectors = [np.round(np.random.randn(np.random.randint(1, 100)), 1) for i in range(30)]
+        x = np.concatenate(vectors)
+        offsets = np.concatenate([[0], np.cumsum([len(v) for v in vectors])]).astype(np.intc)
+        kmin = np.full(30, 2, dtype=np.intc)
+        kmax = np.random.randint(2, 20, 30).astype(np.intc)
+        var = np.random.rand(30)*0.1
+        for n_threads in [1, 3]:
+            labels = np.empty(len(x), dtype=np.intc)
+            centres = np.empty(len(x))
+            k = np.empty(30, dtype=np.intc)
+            self.assertEqual(kmeans_1d_dp_batch(x, offsets, kmin, kmax, var, 'linear', n_threads, labels, centres, k), 30)
+            for m, v in enumerate(vectors):
+                labels_ = np.empty(len(v), dtype=np.intc)
+                centres_ = np.empty(kmax[m])
+                k_ = kmeans_1d_dp_buffer(v, 2, int(kmax[m]), var[m], 'linear', labels_, centres_)
+                self.assertEqual(k[m], k_)
+                self.assertTrue(np.array_equal(labels[offsets[m]:offsets[m+1]], labels_))
+                self.assertTrue(np.array_equal(centres[offsets[m]:offsets[m]+k_], centres_[:k_]))
+
+        # inconsistent arguments
+        self.assertEqual(kmeans_1d_dp_batch(x, offsets, kmin, kmax[:3], var, 'linear', 1, labels, centres, k), -1)
+        self.assertEqual(kmeans_1d_dp_batch(x, offsets, kmin, kmax, var, 'cubic', 1, labels, centres, k), -1)
+        # unknown methods raise with the GIL held again
+        self.assertRaises(ValueError, kmeans_1d_dp_buffer, x, 2, 10, 0.1, 'cubic', labels, centres)
+
+    def test_Kmeans1d_Table(self):
+        """
+        Test the dynamic programming tables of Ckmeans1d give the clusters of
+        kmeans_1d_dp for every variance bound, in NumPy and in the compiled module.
+        """
+        try:
+            from src.Ckmeans import Ckmeans1d as CompiledCkmeans1d, kmeans_1d_dp_buffer
+        except ImportError: # pragma: no cover
+            CompiledCkmeans1d = None
+        np.random.seed(0)
+        for trial in range(10):
+            x = np.round(np.random.randn(np.random.randint(1, 200)), trial % 3 + 1)
+            table = Ckmeans1d(x, 30)
+            compiled = None if CompiledCkmeans1d is None else CompiledCkmeans1d(x, 30, 'linear')
+            for var in [0, 0.001, 0.01, 0.1, 1]:
+                output = kmeans_1d_dp(x, 2, 30, var)
+                labels = np.empty(len(x), dtype=np.intc)
+                centres = np.empty(30)
+                k = table.cluster(table.select(var, 2), labels, centres)
+                self.assertEqual(k, output.Kopt)
+                self.assertTrue(np.array_equal(labels, output.cluster))
+                self.assertTrue(np.array_equal(centres[:k], output.centres))
+                if compiled is not None:
+                    labels_ = np.empty(len(x), dtype=np.intc)
+                    centres_ = np.empty(30)
+                    k_ = kmeans_1d_dp_buffer(x, 2, 30, var, 'linear', labels_, centres_)
+                    self.assertEqual(compiled.cluster(compiled.select(var, 2), labels, centres), k_)
+                    self.assertTrue(np.array_equal(labels, labels_))
+                    self.assertTrue(np.array_equal(centres[:k_], centres_[:k_]))
+            # more clusters than the tables hold
+            self.assertEqual(table.cluster(31, labels, centres), 0)
+
+    def test_Kmeans1d_Weights(self):
+        """
+        Test weighted NumPy kmeans_1d_dp on distinct values gives the clusters of
+        the repeated values.
+        """
+        np.random.seed(0)
+        for trial in range(10):
+            x = np.round(np.random.randn(500), 1)
+            values, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+            var = np.random.rand()*0.1
+            output = kmeans_1d_dp(x, 2, 30, var)
+            output_ = kmeans_1d_dp(values, 2, 30, var, 'linear', counts.astype(float))
+            self.assertEqual(output.Kopt, output_.Kopt)
+            self.assertTrue(np.array_equal(output.cluster, output_.cluster[inverse]))
+            self.assertTrue(np.allclose(output.centres, output_.centres))
+            self.assertTrue(np.allclose(output.withinss, output_.withinss))
+            self.assertTrue(np.array_equal(output.size, output_.size))
+
+    def test_Kmeans1d_Methods(self):
+        """
+        Test every fill method of the compiled module, and the automatic choice,
+        give the same clusters, and ABBA passes ck_method on.
+        """
+        try:
+            from src.Ckmeans import kmeans_1d_dp_buffer
+        except ImportError: # pragma: no cover
+            self.skipTest('Ckmeans module unavailable')
+        np.random.seed(0)
+        for trial in range(20):
+            x = np.round(np.random.randn(np.random.randint(2, 300)), trial % 3 + 1)
+            var = np.random.rand()*0.1
+            (labels, centres) = (np.empty(len(x), dtype=np.intc), np.empty(30))
+            k = kmeans_1d_dp_buffer(x, 2, 30, var, 'linear', labels, centres)
+            for method in ['auto', 'loglinear', 'quadratic']:
+                (labels_, centres_) = (np.empty(len(x), dtype=np.intc), np.empty(30))
+                self.assertEqual(kmeans_1d_dp_buffer(x, 2, 30, var, method, labels_, centres_), k)
+                self.assertTrue(np.array_equal(labels, labels_))
+                self.assertTrue(np.array_equal(centres[:k], centres_[:k]))
+
+        pieces = np.random.rand(200, 3)
+        string, centers = ABBA(verbose=0, ck_method='linear').digitize(pieces)
+        for ck_method in ['auto', 'loglinear', 'quadratic']:
+            string_, centers_ = ABBA(verbose=0, ck_method=ck_method).digitize(pieces)
+            self.assertEqual(string, string_)
+            self.assertTrue(np.array_equal(centers, centers_))
+
+    def test_Kmeans1d_MethodTies(self):
+        """
+        Test the fill methods find clusterings of the same cost on quantised
+        data with ties, and ABBA uses the clusters of 'linear' by default.
+        """
+        try:
+            from src.Ckmeans import kmeans_1d_dp_buffer
+        except ImportError: # pragma: no cover
+            self.skipTest('Ckmeans module unavailable')
+        np.random.seed(5)
+        x = np.random.randint(0, 8, 100).astype(float)
+        cost = {}
+        for method in ['linear', 'loglinear', 'quadratic', 'auto']:
+            (labels, centres) = (np.empty(len(x), dtype=np.intc), np.empty(20))
+            k = kmeans_1d_dp_buffer(x, 2, 20, 1.0, method, labels, centres)
+            self.assertEqual(k, 3)
+            cost[method] = sum(np.sum((x[labels == j] - np.mean(x[labels == j]))**2) for j in range(k))
+            if method == 'linear':
+                expected = labels
+        self.assertFalse(np.array_equal(labels, expected))
+        for method in cost:
+            self.assertAlmostEqual(cost[method], cost['linear'])
+        (labels, centres, k) = ABBA(verbose=0, min_k=2, max_k=20)._kmeans_1d_dp(x, 1.0)
+        self.assertTrue(np.array_equal(labels, expected))
+
+    def test_Kmeans1d_Long(self):
+        """
+        Test the compiled module gives the clusters of the NumPy implementation
+        on a vector long enough to be split across threads in an OpenMP build.
+        """
+        try:
+            from src.Ckmeans import kmeans_1d_dp_buffer
+        except ImportError: # pragma: no cover
+            self.skipTest('Ckmeans module unavailable')
+        np.random.seed(0)
+        x = np.random.randn(20000)
+        output = kmeans_1d_dp(x, 2, 30, 0.01)
+        for method in ['auto', 'linear', 'loglinear']:
+            (labels, centres) = (np.empty(len(x), dtype=np.intc), np.empty(30))
+            k = kmeans_1d_dp_buffer(x, 2, 30, 0.01, method, labels, centres)
+            self.assertEqual(k, output.Kopt)
+            self.assertTrue(np.array_equal(labels, output.cluster))
+            self.assertTrue(np.array_equal(centres[:k], output.centres))
+
+    #--------------------------------------------------------------------------#
+    # fit
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_Fit_NearestCenter(self):
+        """
+        Test a fitted ABBA object assigns every piece of a new time series to
+        the nearest center of the shared codebook.
+        """
+        np.random.seed(0)
+        corpus = [np.cumsum(np.random.randn(300)) for i in range(4)]
+        corpus = [(ts - np.mean(ts))/np.std(ts) for ts in corpus]
+        for scl in [0, np.inf, 1]:
+            abba = ABBA(tol=0.1, scl=scl, verbose=0).fit(corpus[:3])
+            string, centers = abba.transform(corpus[3])
+            self.assertTrue(centers is abba.centers_)
+            pieces = abba.compress(corpus[3])
+            scale = np.array([0 if scl == 0 else 1/abba.len_std_, 0 if scl == np.inf else 1/abba.inc_std_])
+            distance = np.linalg.norm((pieces[:,:2]*scale)[:,None,:] - (centers*scale)[None,:,:], axis=2)
+            correct = ''.join([chr(97 + j) for j in np.argmin(distance, axis=1)])
+            self.assertEqual(string, correct)
+
+    @ignore_warnings
+    def test_Fit_SaveLoad(self):
+        """
+        Test a saved fitted ABBA object is loaded with the same codebook.
+        """
+        np.random.seed(0)
+        corpus = [np.cumsum(np.random.randn(300)) for i in range(3)]
+        abba = ABBA(tol=0.1, scl=1, verbose=0).fit(corpus)
+        with tempfile.TemporaryDirectory() as folder:
+            file = os.path.join(folder, 'abba.npz')
+            abba.save(file)
+            loaded = ABBA.load(file)
+        self.assertEqual(loaded.scl, 1)
+        self.assertTrue(np.array_equal(loaded.centers_, abba.centers_))
+        self.assertEqual(loaded.transform(corpus[0])[0], abba.transform(corpus[0])[0])
+
+    def test_Fit_NotFitted(self):
+        """
+        Test digitize_fitted and save require a fitted ABBA object.
+        """
+        abba = ABBA(verbose=0)
+        self.assertRaises(ValueError, abba.digitize_fitted, np.array([[1, 1, 0]]))
+        self.assertRaises(ValueError, abba.save, 'abba.npz')
+
+    #--------------------------------------------------------------------------#
+    # digitize_stream
+    #--------------------------------------------------------------------------#
+    @ignore_warnings
+    def test_DigitizeStream_NearestCenter(self):
+        """
+        Test digitize_stream returns one string per batch, with every piece
+        assigned to the nearest center and 'a' the most populated cluster.
+        """
+        np.random.seed(0)
+        corpus = [np.cumsum(np.random.randn(500)) for i in range(5)]
+        corpus = [(ts - np.mean(ts))/np.std(ts) for ts in corpus]
+        for scl in [0, 1]:
+            abba = ABBA(tol=[0.1, 1], scl=scl, max_k=20, verbose=0)
+            batches = [abba.compress(ts) for ts in corpus]
+            strings, centers = abba.digitize_stream(lambda: iter(batches), batch_size=50)
+            strings = list(strings)
+            self.assertEqual([len(s) for s in strings], [len(p) for p in batches])
+            string = ''.join(strings)
+            self.assertEqual(len(set(string)), len(centers))
+            self.assertTrue(collections.Counter(string).most_common(1)[0][0] == 'a')
+
+            pieces = np.vstack(batches)[:,:2]
+            scale = np.array([scl/np.std(pieces[:,0]), 1/np.std(pieces[:,1])])
+            distance = np.linalg.norm((pieces*scale)[:,None,:] - (centers*scale)[None,:,:], axis=2)
+            labels = np.array([ord(c) - 97 for c in string])
+            self.assertTrue(np.allclose(distance[np.arange(len(labels)), labels], np.min(distance, axis=1)))
+
+    @ignore_warnings
+    def test_DigitizeStream_Bound(self):
+        """
+        Test the clusters of digitize_stream satisfy the bound on the cluster
+        variance, unless max_k clusters are used.
+        """
+        np.random.seed(1)
+        pieces = np.vstack([np.random.randint(1, 10, 1000), np.random.randn(1000), np.zeros(1000)]).T
+        abba = ABBA(tol=[0.1, 2], scl=0, verbose=0)
+        strings, centers = abba.digitize_stream([pieces[:300], pieces[300:]], batch_size=200)
+        labels = np.array([ord(c) - 97 for c in ''.join(strings)])
+        N = 1 + np.sum(pieces[:,0])
+        bound = ((6*(N-1000))/(N*1000))*((2*2)/(.2*.2))
+        inc = pieces[:,1]/np.std(pieces[:,1])
+        variance = max([np.var(inc[labels == j]) for j in range(len(centers))])
+        self.assertTrue(len(centers) < abba.max_k)
+        self.assertTrue(variance <= bound)
+
+    def test_DigitizeStream_Exceptions(self):
+        """
+        Test digitize_stream requires re-iterable batches and c_method kmeans.
+        """
+        pieces = np.array([[1, 1, 0], [2, -1, 0], [1, 2, 0]])
+        abba = ABBA(verbose=0)
+        self.assertRaises(ValueError, abba.digitize_stream, iter([pieces]))
+        abba = ABBA(c_method='incremental', verbose=0)
+        self.assertRaises(ValueError, abba.digitize_stream, [pieces])
+
     #--------------------------------------------------------------------------#
     # inverse_compress
     #--------------------------------------------------------------------------#
@@ -264,6 +1157,193 @@ class test_ABBA(unittest.TestCase):
         pieces = np.array(pieces)
         self.assertRaises(ValueError, abba.digitize, pieces)
 
+    @ignore_warnings
+    def test_Digitize_KSearch(self):
+        """
+        Test each k_search returns a number of clusters whose cluster variance is
+        within the bound, and bracketing agrees with the linear search on well
+        separated clusters.
+        """
+        np.random.seed(0)
+        data = np.vstack([c + 0.01*np.random.randn(20, 2) for c in np.random.randn(7, 2)*10])
+        for k_search in ['linear', 'warm', 'bracket']:
+            abba = ABBA(verbose=0, min_k=2, max_k=20, k_search=k_search, n_init=1)
+            k, centers, labels = abba._select_k(data, 0.01)
+            self.assertEqual(k, 7)
+            self.assertTrue(max(abba._max_cluster_var(data, labels, centers, k)) <= 0.01)
+
+    @ignore_warnings
+    def test_Digitize_KSearchMaxK(self):
+        """
+        Test each k_search falls back to max_k if no k satisfies the bound.
+        """
+        np.random.seed(0)
+        data = np.random.randn(50, 2)
+        for k_search in ['linear', 'warm', 'bracket']:
+            abba = ABBA(verbose=0, min_k=2, max_k=5, k_search=k_search)
+            k, centers, labels = abba._select_k(data, 0)
+            self.assertEqual(k, 5)
+            self.assertEqual(len(centers), 5)
+
+    @ignore_warnings
+    def test_Digitize_KJobs(self):
+        """
+        Test fitting several values of k at once gives the same clusters as the
+        serial search, including when max_k is used.
+        """
+        np.random.seed(0)
+        data = np.vstack([c + 0.01*np.random.randn(20, 2) for c in np.random.randn(7, 2)*10])
+        for bound in [0.01, 0]:
+            serial = ABBA(verbose=0, min_k=2, max_k=12)._select_k(data, bound)
+            for k_jobs, k_backend in [(3, 'thread'), (None, 'thread'), (2, 'process')]:
+                abba = ABBA(verbose=0, min_k=2, max_k=12, k_jobs=k_jobs, k_backend=k_backend)
+                k, centers, labels = abba._select_k(data, bound)
+                self.assertEqual(k, serial[0])
+                self.assertTrue(np.array_equal(centers, serial[1]))
+                self.assertTrue(np.array_equal(labels, serial[2]))
+
+    @ignore_warnings
+    def test_Digitize_KJobsCancel(self):
+        """
+        Test the parallel search returns once k is found, without waiting for
+        fits of larger k still running.
+        """
+        release = threading.Event()
+        class Slow(ABBA):
+            def _fit_kmeans(self, data, k, bound, init=None, weights=None):
+                if k > self.min_k:
+                    release.wait(30)
+                return ABBA._fit_kmeans(self, data, k, bound, init, weights)
+
+        np.random.seed(0)
+        data = np.random.randn(100, 2)
+        try:
+            start = time.time()
+            k, centers, labels = Slow(verbose=0, min_k=2, max_k=12, k_jobs=3)._select_k(data, np.inf)
+            self.assertEqual(k, 2)
+            self.assertLess(time.time() - start, 10)
+        finally:
+            release.set()
+
+    def test_Digitize_KJobsOpenMP(self):
+        """
+        Test fitting k in worker processes does not hang after KMeans has run in
+        the parent with several OpenMP threads.
+        """
+        script = '\n'.join([
+            'import numpy as np',
+            'from ABBA import ABBA',
+            'np.random.seed(0)',
+            'data = np.vstack([c + 0.01*np.random.randn(20, 2) for c in np.random.randn(7, 2)*10])',
+            'serial = ABBA(verbose=0, min_k=2, max_k=12)._select_k(data, 0.01)',
+            'k = ABBA(verbose=0, min_k=2, max_k=12, k_jobs=2, k_backend=\'process\')._select_k(data, 0.01)[0]',
+            'assert k == serial[0]'])
+        env = dict(os.environ, OMP_NUM_THREADS='4')
+        result = subprocess.run([sys.executable, '-c', script], env=env, timeout=300,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0)
+
+    @ignore_warnings
+    def test_Digitize_Dedup(self):
+        """
+        Test dedup gives the symbols found without it in one dimension, also
+        on quantised pieces, and weighted cluster variances equal those of the
+        repeated pieces.
+        """
+        np.random.seed(0)
+        pieces = np.vstack([np.random.randint(1, 6, 2000), np.round(np.random.randn(2000)*4)/4, np.zeros(2000)]).T
+        for scl in [0, np.inf]:
+            string, centers = ABBA(tol=[0.1, 0.5], scl=scl, verbose=0).digitize(pieces)
+            string_, centers_ = ABBA(tol=[0.1, 0.5], scl=scl, verbose=0, dedup=True).digitize(pieces)
+            self.assertEqual(string, string_)
+            self.assertTrue(np.allclose(centers, centers_))
+
+        # quantised pieces with ties between equally good clusters
+        for seed in [33, 53]:
+            rs = np.random.RandomState(seed)
+            n = rs.randint(50, 400)
+            pieces_ = np.vstack([rs.randint(1, rs.randint(3, 30), n), rs.randint(-20, 21, n)*0.5, np.zeros(n)]).T
+            for scl in [0, np.inf]:
+                string, centers = ABBA(tol=0.05, scl=scl, min_k=1, verbose=0).digitize(pieces_)
+                string_, centers_ = ABBA(tol=0.05, scl=scl, min_k=1, verbose=0, dedup=True).digitize(pieces_)
+                self.assertEqual(string, string_)
+                self.assertTrue(np.array_equal(centers, centers_))
+
+        abba = ABBA(verbose=0)
+        data, inverse, counts = np.unique(pieces[:,:2], axis=0, return_inverse=True, return_counts=True)
+        labels = (data[:,1] > 0).astype(int)
+        centers = np.array([np.mean(pieces[inverse.reshape(-1), :2][labels[inverse.reshape(-1)] == j], axis=0) for j in range(2)])
+        variance = abba._max_cluster_var(pieces[:,:2], labels[inverse.reshape(-1)], centers, 2)
+        variance_ = abba._max_cluster_var(data, labels, centers, 2, counts.astype(float))
+        self.assertTrue(np.allclose(variance, variance_))
+
+    @ignore_warnings
+    def test_Digitize_DedupKMeans(self):
+        """
+        Test deduplication keeps the order of the pieces for KMeans, so without
+        duplicates the symbols are those found without dedup, and with
+        duplicates the bound still holds.
+        """
+        np.random.seed(0)
+        pieces = np.vstack([np.random.randint(1, 6, 400) + np.random.rand(400), np.random.randn(400)*4, np.zeros(400)]).T
+        for scl in [0.5, 3]:
+            string, centers = ABBA(tol=[0.1, 0.5], scl=scl, verbose=0).digitize(pieces)
+            string_, centers_ = ABBA(tol=[0.1, 0.5], scl=scl, verbose=0, dedup=True).digitize(pieces)
+            self.assertEqual(string, string_)
+            self.assertTrue(np.allclose(centers, centers_))
+
+        pieces = np.vstack([pieces[:200], pieces[:100]])
+        abba = ABBA(tol=[0.1, 0.5], scl=1, verbose=0, dedup=True)
+        string, centers = abba.digitize(pieces)
+        labels = np.array([ord(c) - 97 for c in string])
+        data = pieces[:,:2]/np.std(pieces[:,:2], axis=0)
+        (N, n, k) = (1 + np.sum(pieces[:,0]), len(pieces), len(centers))
+        bound = ((6*(N-n))/(N*n))*((abba.digitization_tol**2)/(0.2**2))
+        means = np.array([np.mean(data[labels == j], axis=0) for j in range(k)])
+        self.assertLessEqual(max(abba._max_cluster_var(data, labels, means, k)), bound*(1 + 1e-9))
+
+    @ignore_warnings
+    def test_DigitizeBatch(self):
+        """
+        Test digitize_batch gives the symbolic representation of digitize for
+        every time series, including one with too few unique pieces for Ckmeans.
+        """
+        np.random.seed(0)
+        corpus = [np.cumsum(np.random.randn(np.random.randint(100, 500))) for i in range(10)]
+        corpus = [(ts - np.mean(ts))/np.std(ts) for ts in corpus]
+        for scl in [0, np.inf, 1]:
+            abba = ABBA(tol=[0.1, 0.5], scl=scl, verbose=0)
+            pieces_list = [abba.compress(ts) for ts in corpus[:3 if scl == 1 else 10]]
+            pieces_list.append(np.array([[1, 1, 0], [1, 1, 0], [2, 1, 0]], dtype=float))
+            strings, centers = abba.digitize_batch(pieces_list, n_threads=2)
+            for pieces, string, c in zip(pieces_list, strings, centers):
+                string_, c_ = abba.digitize(pieces)
+                self.assertEqual(string, string_)
+                self.assertTrue(np.array_equal(c, c_, equal_nan=True))
+        self.assertRaises(ValueError, abba.digitize_batch, [np.array([[1, 1, 0]])])
+        abba = ABBA(tol=[0.1, 0.5], scl=0, verbose=0)
+        abba.ck_method = 'cubic'
+        self.assertRaises(ValueError, abba.digitize_batch, pieces_list)
+
+    @ignore_warnings
+    def test_DigitizeSweep(self):
+        """
+        Test digitize_sweep gives the symbolic representation of digitize for
+        every digitization tolerance.
+        """
+        np.random.seed(0)
+        ts = np.cumsum(np.random.randn(1000))
+        ts = (ts - np.mean(ts))/np.std(ts)
+        for scl in [0, np.inf, 1]:
+            abba = ABBA(tol=0.1, scl=scl, verbose=0)
+            pieces = abba.compress(ts)
+            tols = [0.5, 1, 2] if scl == 1 else [0.05, 0.1, 0.2, 0.5, 1]
+            strings, centers = abba.digitize_sweep(pieces, tols)
+            for tol, string, c in zip(tols, strings, centers):
+                string_, c_ = ABBA(tol=[0.1, tol], scl=scl, verbose=0).digitize(pieces)
+                self.assertEqual(string, string_)
+                self.assertTrue(np.array_equal(c, c_, equal_nan=True))
+
     @ignore_warnings
     def test_Digitize_TooManyK(self):
         """
@@ -317,6 +1397,16 @@ class test_ABBA(unittest.TestCase):
         correct_pieces = np.array(correct_pieces).astype(float)
         self.assertTrue(np.allclose(pieces, correct_pieces))
 
+    @ignore_warnings
+    def test_InverseDigitize_EmptyString(self):
+        """
+        Test inverse digitize returns no pieces for an empty string
+        """
+        abba = ABBA(verbose=0)
+        centers = np.array([[3, 3], [1, -9/2]]).astype(float)
+        pieces = abba.inverse_digitize('', centers)
+        self.assertEqual(pieces.shape, (0, 2))
+
     #--------------------------------------------------------------------------#
     # quantize
     #--------------------------------------------------------------------------#
@@ -430,6 +1520,20 @@ class test_ABBA(unittest.TestCase):
         correct_c = np.array([[4, 5/2], [1, -5/3]])
         self.assertTrue(np.allclose(correct_c, c))
 
+    #--------------------------------------------------------------------------#
+    # _PieceBuffer
+    #--------------------------------------------------------------------------#
+    def test_PieceBuffer_Growth(self):
+        """
+        Test piece buffer keeps all rows when growing past its capacity
+        """
+        buffer = _PieceBuffer(3, capacity=2)
+        rows = np.arange(30, dtype=float).reshape(10, 3)
+        for row in rows:
+            buffer.append(row)
+        self.assertEqual(len(buffer), 10)
+        self.assertTrue(np.allclose(buffer.array(), rows))
+
     #--------------------------------------------------------------------------#
     # _max_cluster_var
     #--------------------------------------------------------------------------#
@@ -453,6 +1557,25 @@ class test_ABBA(unittest.TestCase):
         ee2 = max([np.var([4,-5,1]), np.var([4,-4])])
         self.assertTrue(np.allclose([e1, e2], [ee1, ee2]))
 
+    @ignore_warnings
+    def test_MaxClusterVar_EmptyAndSingleton(self):
+        """
+        Test _max_cluster_var ignores empty clusters, clusters with one member
+        and clusters without deviation from their center, and _build_centers
+        gives NaN for empty clusters.
+        """
+        pieces = np.array([[1, 2], [3, 2], [5, 7], [2, 0]]).astype(float)
+        labels = np.array([0, 0, 2, 3])
+        centers = np.array([[2, 2], [0, 0], [5, 7], [0, 0]]).astype(float)
+        abba = ABBA(verbose=0)
+        (e1, e2) = abba._max_cluster_var(pieces, labels, centers, 4)
+        self.assertTrue(np.allclose([e1, e2], [1, 0]))
+        (e1, e2) = abba._max_cluster_var(pieces[:,:1], labels, centers[:,:1], 4)
+        self.assertTrue(np.allclose([e1, e2], [1, 0]))
+        c = abba._build_centers(pieces, labels, centers[:,1], 4, 0)
+        self.assertTrue(np.allclose(c[[0,2,3],0], [2, 5, 2]))
+        self.assertTrue(np.isnan(c[1,0]))
+
     #--------------------------------------------------------------------------#
     # digitize when ordered=True
     #--------------------------------------------------------------------------#
@@ -562,6 +1685,27 @@ class test_ABBA(unittest.TestCase):
         string, centers = abba.digitize(pieces)
         self.assertTrue('abcaba'==string)
 
+    @ignore_warnings
+    def test_DigitizeInc_MatchesReference(self):
+        """
+        Test updating the cluster statistics incrementally gives the same labels
+        and centers as recomputing them for every trial cluster, also when errors
+        tie with the tolerance.
+        """
+        np.random.seed(0)
+        for trial in range(10):
+            n = np.random.randint(10, 80)
+            lengths = np.random.randint(1, 6, n).astype(float)
+            for increments in [np.random.randint(-4, 5, n).astype(float), np.round(np.random.randn(n)*4)/4]:
+                data = np.column_stack([lengths, increments])
+                for (norm, weighted) in [(1, False), (2, False), (1, True), (2, True)]:
+                    for tol in [0.1, 0.25, 0.5, 1.0, 2.0]:
+                        abba = ABBA(verbose=0, tol=tol, norm=norm, weighted=weighted, c_method='incremental')
+                        labels, centers = abba.digitize_incremental(data.copy())
+                        correct_labels, correct_centers = digitize_incremental_reference(abba, data.copy())
+                        self.assertEqual(labels, correct_labels)
+                        self.assertTrue(np.array_equal(centers, correct_centers))
+
     #--------------------------------------------------------------------------#
     # get_patches
     #--------------------------------------------------------------------------#